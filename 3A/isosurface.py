@@ -1,38 +1,113 @@
 #!/usr/bin/env python
 
 import argparse
+import os
 import sys
 
 import vtk
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from isotools.cine import add_cine_arguments, check_cine_arguments, cine_from_args
+from isotools.clipbox import add_crop_arguments, cropper_from_args, sweep_from_args
+from isotools.cache import add_cache_arguments, cache_from_args, extract_isosurface
+from isotools.livedrag import (add_live_drag_arguments, check_live_drag_arguments,
+	live_drag_from_args)
+from isotools.lod import add_lod_arguments, lod_actor, lod_from_args
+from isotools.meshstore import add_mesh_store_arguments, store_from_args
+from isotools.progressive import add_progressive_arguments, preview_from_args
+from isotools.rawvolume import (add_volume_arguments, check_volume_arguments, volume_bounds,
+	volume_from_args)
+from isotools.service import add_daemon_arguments, check_daemon_arguments, daemon_from_args
+from isotools.spanspace import add_span_space_arguments, bricks_from_args
+from isotools.streaming import add_stream_arguments, check_stream_arguments, stream_from_args
+from isotools.trace import add_trace_arguments, trace_from_args
+from isotools.worker import add_worker_arguments, detach, worker_from_args
+
 # default values
 DEFAULT_ISOVALUE = 500
 DEFAULT_COORDINATES = [0, 0, 0]
 
 class Visualization(object):
 	def slider_isovalue_handler(self, obj, event):
-		self.isovalue = obj.GetRepresentation().GetValue()
-		self.contours.SetValue(0, self.isovalue)
+		# whole isovalues, so revisiting a value hits the surface cache
+		self.isovalue = int(round(obj.GetRepresentation().GetValue()))
+		# while the sweep is shown the slider picks one of its frames
+		if self.cine is not None and self.cine.seek(self.isovalue):
+			return
+		self.update_visualization(event == "InteractionEvent")
 
 	def clip_x_slider_handler(self, obj, event):
 		self.clip_x = obj.GetRepresentation().GetValue()
-		self.update_visualization()
+		self.update_visualization(event == "InteractionEvent")
 
 	def clip_y_slider_handler(self, obj, event):
 		self.clip_y = obj.GetRepresentation().GetValue()
-		self.update_visualization()
+		self.update_visualization(event == "InteractionEvent")
 
 	def clip_z_slider_handler(self, obj, event):
 		self.clip_z = obj.GetRepresentation().GetValue()
-		self.update_visualization()
-
-	def update_visualization(self):
-		self.plane_x.SetOrigin((self.clip_x,0,0))
-		self.plane_y.SetOrigin(0,self.clip_y,0)
-		self.plane_z.SetOrigin(0,0,self.clip_z)
-		self.clipper_x.Update()
-		self.clipper_y.Update()
+		self.update_visualization(event == "InteractionEvent")
+
+	def parameters(self):
+		return (self.isovalue, (self.clip_x, self.clip_y, self.clip_z))
+
+	def update_visualization(self, dragging=False):
+		if self.cine is not None:
+			# a sweep per mouse move would only be cancelled by the next one
+			if dragging:
+				self.cine.hold(self.parameters()[1])
+			else:
+				self.cine.prepare(self.parameters()[1])
+		if dragging and self.preview is not None:
+			if self.worker is not None:
+				self.worker.cancel()
+			isovalue, lower = self.parameters()
+			self.mapper.SetInputData(self.preview.extract(isovalue, lower))
+		elif self.worker is not None:
+			self.worker.submit(self.parameters())
+		else:
+			self.mapper.SetInputData(self.compute_surface(self.parameters()))
+
+	def extract_surface(self, isovalue):
+		if self.store is not None:
+			return self.store.fetch(isovalue, self.contour_surface)
+		return self.contour_surface(isovalue)
+
+	def contour_surface(self, isovalue):
+		if self.remote is not None:
+			return self.remote.extract(isovalue)
+		if self.stream is not None:
+			return self.stream.extract(isovalue)
+		if self.bricks is not None:
+			return self.bricks.extract(isovalue)
+		return extract_isosurface(self.contours, isovalue)
+
+	def fetch_surface(self, isovalue):
+		if self.cache is None:
+			return self.extract_surface(isovalue)
+		return self.cache.fetch(self.dataset, isovalue, self.extract_surface)
+
+	def compute_surface(self, params):
+		"""Clipped isosurface for (isovalue, clip box lower corner)."""
+		isovalue, lower = params
+		if self.cropper is not None:
+			return self.cropper.extract(isovalue, lower)
+
+		if isovalue != self.extracted_isovalue:
+			self.clipper_x.SetInputData(self.fetch_surface(isovalue))
+			self.extracted_isovalue = isovalue
+		if self.sweep is not None:
+			return self.sweep.clip(self.clipper_x.GetInput(), lower)
+		self.plane_x.SetOrigin((lower[0],0,0))
+		self.plane_y.SetOrigin(0,lower[1],0)
+		self.plane_z.SetOrigin(0,0,lower[2])
 		self.clipper_z.Update()
+		return detach(self.clipper_z)
+
+	def show_surface(self, surface):
+		self.mapper.SetInputData(surface)
+		self.render_window.Render()
 
 	def __init__(self, args):
 		# Image loading
@@ -42,23 +117,44 @@ class Visualization(object):
 		self.clip_y = args.clip[1]
 		self.clip_z = args.clip[2]
 
+		self.cache = cache_from_args(args)
+		self.extracted_isovalue = None
+
 		ct_name = args.data
-		ct_image = vtk.vtkXMLImageDataReader()
-		ct_image.SetFileName(ct_name)
-		ct_image.Update()
+		self.dataset = os.path.abspath(ct_name)
+		self.remote = daemon_from_args(args)
+		if self.remote is not None:
+			# the daemon holds the volume and contours it
+			ct_image = None
+			self.bounds = self.remote.info()['bounds']
+			self.stream = self.bricks = self.preview = None
+			self.cropper = self.remote if args.crop else None
+		else:
+			ct_image = volume_from_args(args, ct_name, update=args.stream_slab <= 0)
+			# the clip sliders span the loaded part of the volume
+			self.bounds = volume_bounds(ct_image)
+			self.stream = stream_from_args(args, ct_image)
+			self.bricks = bricks_from_args(args, ct_image.GetOutput())
+			self.cropper = cropper_from_args(args, ct_image.GetOutput(), self.bricks)
+			self.preview = preview_from_args(args, ct_image.GetOutput())
+		# cropped surfaces depend on the clip box and are not worth keeping, and
+		# the daemon keeps the whole ones without the viewer hashing the scan
+		self.store = None
+		if self.cropper is None and self.remote is None:
+			self.store = store_from_args(args, {'normals': True})
 
 		self.contours = vtk.vtkContourFilter()
-		self.contours.SetInputConnection(ct_image.GetOutputPort());
+		if ct_image is not None:
+			self.contours.SetInputConnection(ct_image.GetOutputPort());
 		self.contours.ComputeNormalsOn()
-		self.contours.SetValue(0, self.isovalue)
 
 		#Cutting planes
+		self.sweep = sweep_from_args(args)
 		self.plane_x = vtk.vtkPlane()
 		self.plane_x.SetOrigin(self.clip_x, 0, 0)
 		self.plane_x.SetNormal(1, 0, 0)
 		self.clipper_x = vtk.vtkClipPolyData()
 		self.clipper_x.SetClipFunction(self.plane_x)
-		self.clipper_x.SetInputConnection(self.contours.GetOutputPort())
 
 		self.plane_y = vtk.vtkPlane()
 		self.plane_y.SetOrigin(0, self.clip_y, 0)
@@ -94,18 +190,29 @@ class Visualization(object):
 		color_bar.SetHeight(0.7)
 
 		# mapper and actor
-		mapper = vtk.vtkDataSetMapper()
-		mapper.SetInputConnection(self.clipper_z.GetOutputPort())
-		mapper.SetLookupTable(color_scale)
+		self.mapper = vtk.vtkDataSetMapper()
+		self.mapper.SetInputData(self.compute_surface(self.parameters()))
+		self.mapper.SetLookupTable(color_scale)
+
+		filters = [self.contours, self.clipper_x, self.clipper_y, self.clipper_z]
+		if self.stream is not None:
+			filters.append(self.stream.contour)
+		if self.bricks is not None:
+			filters.append(self.bricks.contour)
+		if self.cropper is not None:
+			filters.append(self.cropper.contour)
+		if self.sweep is not None:
+			filters.extend(self.sweep.clippers)
+		self.worker = worker_from_args(args, self.compute_surface, self.show_surface, filters)
 
-		actor = vtk.vtkActor()
-		actor.SetMapper(mapper)
+		self.lods = lod_from_args(args)
+		actor = lod_actor(self.lods, self.mapper)
 
 		renderer = vtk.vtkRenderer()
-		render_window = vtk.vtkRenderWindow()
-		render_window.AddRenderer(renderer)
+		self.render_window = vtk.vtkRenderWindow()
+		self.render_window.AddRenderer(renderer)
 		interactive_ren = vtk.vtkRenderWindowInteractor()
-		interactive_ren.SetRenderWindow(render_window)
+		interactive_ren.SetRenderWindow(self.render_window)
 
 		renderer.AddActor(actor)
 		renderer.AddActor(color_bar)
@@ -138,9 +245,17 @@ class Visualization(object):
 		slider_widget_isovalues.SetEnabled(True)
 		slider_widget_isovalues.AddObserver("EndInteractionEvent", self.slider_isovalue_handler)
 
+		self.cine = None
+		if ct_image is not None:
+			self.cine = cine_from_args(args, ct_image.GetOutput(), self.mapper, actor, renderer,
+				slider_isovalue, lambda: self.slider_isovalue_handler(slider_widget_isovalues,
+				"EndInteractionEvent"))
+		if self.cine is not None:
+			self.cine.prepare(self.parameters()[1])
+
 		slider_clip_x = vtk.vtkSliderRepresentation2D()
-		slider_clip_x.SetMinimumValue(0)
-		slider_clip_x.SetMaximumValue(190)
+		slider_clip_x.SetMinimumValue(self.bounds[0])
+		slider_clip_x.SetMaximumValue(self.bounds[1])
 		slider_clip_x.SetValue(self.clip_x)
 		slider_clip_x.SetTitleText("X")
 		slider_clip_x.GetPoint1Coordinate().SetCoordinateSystemToNormalizedDisplay()
@@ -164,8 +279,8 @@ class Visualization(object):
 		slider_widget_x.AddObserver("EndInteractionEvent", self.clip_x_slider_handler)
 
 		slider_clip_y = vtk.vtkSliderRepresentation2D()
-		slider_clip_y.SetMinimumValue(0)
-		slider_clip_y.SetMaximumValue(190)
+		slider_clip_y.SetMinimumValue(self.bounds[2])
+		slider_clip_y.SetMaximumValue(self.bounds[3])
 		slider_clip_y.SetValue(self.clip_y)
 		slider_clip_y.SetTitleText("Y")
 		slider_clip_y.GetPoint1Coordinate().SetCoordinateSystemToNormalizedDisplay()
@@ -189,8 +304,8 @@ class Visualization(object):
 		slider_widget_y.AddObserver("EndInteractionEvent", self.clip_y_slider_handler)
 
 		slider_clip_z = vtk.vtkSliderRepresentation2D()
-		slider_clip_z.SetMinimumValue(0)
-		slider_clip_z.SetMaximumValue(190)
+		slider_clip_z.SetMinimumValue(self.bounds[4])
+		slider_clip_z.SetMaximumValue(self.bounds[5])
 		slider_clip_z.SetValue(self.clip_z)
 		slider_clip_z.SetTitleText("Z")
 		slider_clip_z.GetPoint1Coordinate().SetCoordinateSystemToNormalizedDisplay()
@@ -213,11 +328,41 @@ class Visualization(object):
 		slider_widget_z.SetEnabled(True)
 		slider_widget_z.AddObserver("EndInteractionEvent", self.clip_z_slider_handler)
 
+		self.live = live_drag_from_args(args, self.worker)
+		if self.live is not None or self.preview is not None:
+			for widget, handler in ((slider_widget_isovalues, self.slider_isovalue_handler),
+					(slider_widget_x, self.clip_x_slider_handler),
+					(slider_widget_y, self.clip_y_slider_handler),
+					(slider_widget_z, self.clip_z_slider_handler)):
+				if self.live is not None:
+					self.live.watch(widget, handler)
+				else:
+					widget.AddObserver("InteractionEvent", handler)
+
+		self.trace = trace_from_args(args)
+		if self.trace is not None:
+			self.trace.watch_all({'contour': self.contours, 'clip_x': self.clipper_x,
+				'clip_y': self.clipper_y, 'clip_z': self.clipper_z,
+				'bricks': self.bricks and self.bricks.contour,
+				'crop': self.cropper and self.cropper.contour})
+			self.trace.watch_render(self.render_window)
+			for widget, name in ((slider_widget_isovalues, "isovalue"), (slider_widget_x, "slider_x"),
+					(slider_widget_y, "slider_y"), (slider_widget_z, "slider_z")):
+				self.trace.watch_widget(widget, name)
+
 		# Render
 		interactive_ren.Initialize()
-		render_window.SetSize(800, 600)
-		render_window.SetWindowName("Project 3a: Isocontours - Pedro Acevedo & Randy Consuegra")
-		render_window.Render()
+		if self.worker is not None:
+			self.worker.attach(interactive_ren)
+		if self.lods is not None:
+			self.lods.attach(interactive_ren)
+		if self.live is not None:
+			self.live.attach(interactive_ren)
+		if self.cine is not None:
+			self.cine.attach(interactive_ren)
+		self.render_window.SetSize(800, 600)
+		self.render_window.SetWindowName("Project 3a: Isocontours - Pedro Acevedo & Randy Consuegra")
+		self.render_window.Render()
 		interactive_ren.Start()
 
 
@@ -229,6 +374,24 @@ if __name__ == "__main__":
 	parser.add_argument('--isoval', '-v',type=int, metavar='int', help='Initial Isovalue', default=DEFAULT_ISOVALUE)
 	parser.add_argument('--clip', '-c', type=int, metavar='int', nargs=3,
 						help='Initial coordinates of cutting planes', default=DEFAULT_COORDINATES)
+	add_cache_arguments(parser)
+	add_mesh_store_arguments(parser)
+	add_span_space_arguments(parser)
+	add_crop_arguments(parser)
+	add_volume_arguments(parser)
+	add_daemon_arguments(parser)
+	add_worker_arguments(parser)
+	add_progressive_arguments(parser)
+	add_lod_arguments(parser)
+	add_live_drag_arguments(parser)
+	add_stream_arguments(parser)
+	add_trace_arguments(parser)
+	add_cine_arguments(parser)
 	args = parser.parse_args()
+	check_stream_arguments(parser, args)
+	check_volume_arguments(parser, args)
+	check_live_drag_arguments(parser, args)
+	check_daemon_arguments(parser, args)
+	check_cine_arguments(parser, args)
 
 	Visualization(args)
\ No newline at end of file
@@ -1,8 +1,28 @@
 #!/usr/bin/env python
 
+import os
+import sys
+
 import vtk
 import argparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from isotools.clipbox import add_crop_arguments, cropper_from_args, sweep_from_args
+from isotools.gradient import GradientSampler, add_gradient_arguments, gradient_from_args
+from isotools.livedrag import (add_live_drag_arguments, check_live_drag_arguments,
+	live_drag_from_args)
+from isotools.lod import add_lod_arguments, lod_actor, lod_from_args
+from isotools.progressive import add_progressive_arguments, preview_from_args
+from isotools.rawvolume import (add_volume_arguments, check_volume_arguments, volume_bounds,
+	volume_from_args)
+from isotools.service import add_daemon_arguments, check_daemon_arguments, daemon_from_args
+from isotools.spanspace import add_span_space_arguments, bricks_from_args
+from isotools.streaming import (add_stream_arguments, check_stream_arguments, slab_sampler_from_args,
+	stream_from_args)
+from isotools.trace import add_trace_arguments, trace_from_args
+from isotools.worker import add_worker_arguments, detach, worker_from_args
+
 
 DEFAULT_COLORMAP = [[0, 1, 1, 1], [2500, 1, 1, 1], [109404, 1, 0, 0]]
 DEFAULT_PLANE_POS = [0, 0, 0]
@@ -13,23 +33,42 @@ class Visualization(object):
 
 	def clip_x_slider_handler(self,obj, event):
 		self.clip_x = obj.GetRepresentation().GetValue()
-		self.update_CT()
+		self.update_CT(event == "InteractionEvent")
 
 	def clip_y_slider_handler(self,obj, event):
 		self.clip_y = obj.GetRepresentation().GetValue()
-		self.update_CT()
+		self.update_CT(event == "InteractionEvent")
 
 	def clip_z_slider_handler(self,obj, event):
 		self.clip_z = obj.GetRepresentation().GetValue()
-		self.update_CT()
-
-	def update_CT(self):
-		self.plane_x.SetOrigin((self.clip_x,0,0))
-		self.plane_y.SetOrigin(0,self.clip_y,0)
-		self.plane_z.SetOrigin(0,0,self.clip_z)
-		self.clipper_x.Update()
-		self.clipper_y.Update()
+		self.update_CT(event == "InteractionEvent")
+
+	def update_CT(self, dragging=False):
+		lower = (self.clip_x, self.clip_y, self.clip_z)
+		if dragging and self.preview is not None:
+			if self.worker is not None:
+				self.worker.cancel()
+			self.color_mapper.SetInputData(self.preview.extract(self.isovalues, lower))
+		elif self.worker is not None:
+			self.worker.submit(lower)
+		else:
+			self.color_mapper.SetInputData(self.compute_surface(lower))
+
+	def compute_surface(self, lower):
+		"""Probed isosurfaces clipped to the box with the given lower corner."""
+		if self.cropper is not None:
+			return self.sampler.attach(self.cropper.extract(self.isovalues, lower))
+		if self.sweep is not None:
+			return self.sweep.clip(self.clipper_x.GetInput(), lower)
+		self.plane_x.SetOrigin((lower[0],0,0))
+		self.plane_y.SetOrigin(0,lower[1],0)
+		self.plane_z.SetOrigin(0,0,lower[2])
 		self.clipper_z.Update()
+		return detach(self.clipper_z)
+
+	def show_surface(self, surface):
+		self.color_mapper.SetInputData(surface)
+		self.render_window.Render()
 
 	def __init__(self, args):
 		## Files reading and settings
@@ -40,16 +79,30 @@ class Visualization(object):
 		self.clip_y = args.clip[1]
 		self.clip_z = args.clip[2]
 
-		ct_image = vtk.vtkXMLImageDataReader()
-		ct_image.SetFileName(args.data)
-		ct_image.Update()
-
-		gm_image = vtk.vtkXMLImageDataReader()
-		gm_image.SetFileName(args.gradmag)
-		gm_image.Update()
+		remote = daemon_from_args(args, args.gradmag)
+		if remote is not None:
+			# the daemon holds the volumes, contours and probes them
+			ct_image = None
+			self.bounds = remote.info()['bounds']
+			self.stream = None
+			self.sampler = remote
+			self.preview = None
+		else:
+			ct_image = volume_from_args(args, args.data, update=args.stream_slab <= 0)
+			# the clip sliders span the loaded part of the volume
+			self.bounds = volume_bounds(ct_image)
+			self.stream = stream_from_args(args, ct_image)
+			if self.stream is not None:
+				self.sampler = slab_sampler_from_args(args, args.gradmag, ct_image)
+				self.preview = None
+			else:
+				gm_image = gradient_from_args(args, args.gradmag, ct_image)
+				self.sampler = GradientSampler(gm_image.GetOutput())
+				self.preview = preview_from_args(args, ct_image.GetOutput(), gm_image.GetOutput())
 
 		self.ct_contour = vtk.vtkContourFilter()
-		self.ct_contour.SetInputConnection(ct_image.GetOutputPort());
+		if ct_image is not None:
+			self.ct_contour.SetInputConnection(ct_image.GetOutputPort());
 		self.ct_contour.ComputeNormalsOn()
 
 		for i in range(len(self.isovalues)):
@@ -62,12 +115,30 @@ class Visualization(object):
 			color_func.AddRGBPoint(c[0], c[1], c[2], c[3])
 
 		#Cutting planes
+		self.sweep = sweep_from_args(args)
 		self.plane_x = vtk.vtkPlane()
 		self.plane_x.SetOrigin(self.clip_x, 0, 0)
 		self.plane_x.SetNormal(1, 0, 0)
 		self.clipper_x = vtk.vtkClipPolyData()
 		self.clipper_x.SetClipFunction(self.plane_x)
-		self.clipper_x.SetInputConnection(self.ct_contour.GetOutputPort())
+		if remote is not None:
+			bricks = None
+			self.cropper = remote if args.crop else None
+		else:
+			bricks = bricks_from_args(args, ct_image.GetOutput())
+			self.cropper = cropper_from_args(args, ct_image.GetOutput(), bricks)
+		if self.cropper is None:
+			# the isovalues are fixed, so the gradient is probed once for all clip positions
+			if remote is not None:
+				surface = remote.extract(self.isovalues)
+			elif self.stream is not None:
+				surface = self.stream.extract(self.isovalues)
+			elif bricks is not None:
+				surface = bricks.extract(self.isovalues)
+			else:
+				self.ct_contour.Update()
+				surface = self.ct_contour.GetOutput()
+			self.clipper_x.SetInputData(self.sampler.attach(surface))
 
 		self.plane_y = vtk.vtkPlane()
 		self.plane_y.SetOrigin(0, self.clip_y, 0)
@@ -83,17 +154,23 @@ class Visualization(object):
 		self.clipper_z.SetClipFunction(self.plane_z)
 		self.clipper_z.SetInputConnection(self.clipper_y.GetOutputPort())
 
-		probe_filter = vtk.vtkProbeFilter()
-		probe_filter.SetSourceConnection(gm_image.GetOutputPort())
-		probe_filter.SetInputConnection(self.clipper_z.GetOutputPort())
-
-		color_mapper = vtk.vtkPolyDataMapper()
-		color_mapper.SetLookupTable(color_func)
-		color_mapper.SetInputConnection(probe_filter.GetOutputPort())
-		color_mapper.SetScalarRange(probe_filter.GetOutput().GetScalarRange())
+		surface = self.compute_surface((self.clip_x, self.clip_y, self.clip_z))
+		self.color_mapper = vtk.vtkPolyDataMapper()
+		self.color_mapper.SetLookupTable(color_func)
+		self.color_mapper.SetInputData(surface)
+		self.color_mapper.SetScalarRange(surface.GetScalarRange())
+
+		filters = [self.ct_contour, self.clipper_x, self.clipper_y, self.clipper_z, self.sampler.probe]
+		if self.stream is not None:
+			filters.append(self.stream.contour)
+		if self.cropper is not None:
+			filters.append(self.cropper.contour)
+		if self.sweep is not None:
+			filters.extend(self.sweep.clippers)
+		self.worker = worker_from_args(args, self.compute_surface, self.show_surface, filters)
 
 		color_bar = vtk.vtkScalarBarActor()
-		color_bar.SetLookupTable(color_mapper.GetLookupTable())
+		color_bar.SetLookupTable(self.color_mapper.GetLookupTable())
 		color_bar.SetTitle("Gradient")
 		color_bar.SetNumberOfLabels(5)
 		color_bar.SetLabelFormat("%3.0f")
@@ -101,9 +178,9 @@ class Visualization(object):
 		color_bar.SetWidth(0.08)
 		color_bar.SetHeight(0.6)
 
-		color_actor=vtk.vtkActor()
+		self.lods = lod_from_args(args)
+		color_actor = lod_actor(self.lods, self.color_mapper)
 		#color_actor.GetProperty().SetRepresentationToWireframe()
-		color_actor.SetMapper(color_mapper)
 
 		back_faces = vtk.vtkProperty()
 		back_faces.SetSpecular(0)
@@ -113,10 +190,10 @@ class Visualization(object):
 		color_actor.SetBackfaceProperty(back_faces)
 
 		renderer = vtk.vtkRenderer()
-		render_window = vtk.vtkRenderWindow()
-		render_window.AddRenderer(renderer)
+		self.render_window = vtk.vtkRenderWindow()
+		self.render_window.AddRenderer(renderer)
 		interactive_renderer = vtk.vtkRenderWindowInteractor()
-		interactive_renderer.SetRenderWindow(render_window)
+		interactive_renderer.SetRenderWindow(self.render_window)
 
 		renderer.AddActor(color_actor)
 		renderer.AddActor(color_bar)
@@ -125,8 +202,8 @@ class Visualization(object):
 		renderer.ResetCameraClippingRange()
 
 		slider_clip_x = vtk.vtkSliderRepresentation2D()
-		slider_clip_x.SetMinimumValue(0)
-		slider_clip_x.SetMaximumValue(245)
+		slider_clip_x.SetMinimumValue(self.bounds[0])
+		slider_clip_x.SetMaximumValue(self.bounds[1])
 		slider_clip_x.SetValue(self.clip_x)
 		slider_clip_x.SetTitleText("X")
 		slider_clip_x.GetPoint1Coordinate().SetCoordinateSystemToNormalizedDisplay()
@@ -150,8 +227,8 @@ class Visualization(object):
 		slider_widget_x.AddObserver("EndInteractionEvent", self.clip_x_slider_handler)
 
 		slider_clip_y = vtk.vtkSliderRepresentation2D()
-		slider_clip_y.SetMinimumValue(0)
-		slider_clip_y.SetMaximumValue(245)
+		slider_clip_y.SetMinimumValue(self.bounds[2])
+		slider_clip_y.SetMaximumValue(self.bounds[3])
 		slider_clip_y.SetValue(self.clip_y)
 		slider_clip_y.SetTitleText("Y")
 		slider_clip_y.GetPoint1Coordinate().SetCoordinateSystemToNormalizedDisplay()
@@ -175,8 +252,8 @@ class Visualization(object):
 		slider_widget_y.AddObserver("EndInteractionEvent", self.clip_y_slider_handler)
 
 		slider_clip_z = vtk.vtkSliderRepresentation2D()
-		slider_clip_z.SetMinimumValue(0)
-		slider_clip_z.SetMaximumValue(245)
+		slider_clip_z.SetMinimumValue(self.bounds[4])
+		slider_clip_z.SetMaximumValue(self.bounds[5])
 		slider_clip_z.SetValue(self.clip_z)
 		slider_clip_z.SetTitleText("Z")
 		slider_clip_z.GetPoint1Coordinate().SetCoordinateSystemToNormalizedDisplay()
@@ -199,11 +276,37 @@ class Visualization(object):
 		slider_widget_z.SetEnabled(True)
 		slider_widget_z.AddObserver("EndInteractionEvent", self.clip_z_slider_handler)
 
+		self.live = live_drag_from_args(args, self.worker)
+		if self.live is not None or self.preview is not None:
+			for widget, handler in ((slider_widget_x, self.clip_x_slider_handler),
+					(slider_widget_y, self.clip_y_slider_handler),
+					(slider_widget_z, self.clip_z_slider_handler)):
+				if self.live is not None:
+					self.live.watch(widget, handler)
+				else:
+					widget.AddObserver("InteractionEvent", handler)
+
 		# Render
+		self.trace = trace_from_args(args)
+		if self.trace is not None:
+			self.trace.watch_all({'contour': self.ct_contour, 'clip_x': self.clipper_x,
+				'clip_y': self.clipper_y, 'clip_z': self.clipper_z, 'probe': self.sampler.probe,
+				'bricks': bricks and bricks.contour, 'crop': self.cropper and self.cropper.contour})
+			self.trace.watch_render(self.render_window)
+			for widget, name in ((slider_widget_x, "slider_x"), (slider_widget_y, "slider_y"),
+					(slider_widget_z, "slider_z")):
+				self.trace.watch_widget(widget, name)
+
 		interactive_renderer.Initialize()
-		render_window.SetSize(800, 600)
-		render_window.SetWindowName("Project 3b: Isocontours - Pedro Acevedo & Randy Consuegra")
-		render_window.Render()
+		if self.worker is not None:
+			self.worker.attach(interactive_renderer)
+		if self.lods is not None:
+			self.lods.attach(interactive_renderer)
+		if self.live is not None:
+			self.live.attach(interactive_renderer)
+		self.render_window.SetSize(800, 600)
+		self.render_window.SetWindowName("Project 3b: Isocontours - Pedro Acevedo & Randy Consuegra")
+		self.render_window.Render()
 		interactive_renderer.Start()
 
 
@@ -224,12 +327,28 @@ if __name__ == "__main__":
 	parser = argparse.ArgumentParser(
 		description="Takes CT images and shows them making use of VTK. Proyect 3 Part B")
 	parser.add_argument('data', help='File with 3D scalar dataset')
-	parser.add_argument('gradmag', help='File with gradient magnitude')
+	parser.add_argument('gradmag', nargs='?',
+						help='File with gradient magnitude (computed from data when left out)')
 	parser.add_argument('isoval', help='txt with isovalues')
 	parser.add_argument('--cmap','-cm', type=str, metavar='filename', help='input colormap file', default='NULL')
 	parser.add_argument('--clip','-c', type=int, metavar='int', nargs=3,
 						help='initial positions of clipping planes', default=DEFAULT_PLANE_POS)
+	add_gradient_arguments(parser)
+	add_span_space_arguments(parser)
+	add_crop_arguments(parser)
+	add_volume_arguments(parser)
+	add_daemon_arguments(parser)
+	add_worker_arguments(parser)
+	add_progressive_arguments(parser)
+	add_lod_arguments(parser)
+	add_live_drag_arguments(parser)
+	add_stream_arguments(parser)
+	add_trace_arguments(parser)
 	args = parser.parse_args()
+	check_stream_arguments(parser, args)
+	check_volume_arguments(parser, args)
+	check_live_drag_arguments(parser, args)
+	check_daemon_arguments(parser, args)
 
 	try:
 		args.isoval = readFromFile(args.isoval)
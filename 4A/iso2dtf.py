@@ -1,16 +1,37 @@
 #!/usr/bin/env python
 
+import math
+import os
+import sys
+
 import vtk
 import argparse
 
-GRAD_MAX = 109404
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from isotools.clipbox import add_crop_arguments, cropper_from_args, sweep_from_args
+from isotools.cache import add_cache_arguments, cache_from_args, extract_isosurface
+from isotools.gradient import (GradientSampler, GradientWindow, add_gradient_arguments,
+	gradient_from_args)
+from isotools.livedrag import (add_live_drag_arguments, check_live_drag_arguments,
+	live_drag_from_args)
+from isotools.lod import add_lod_arguments, lod_actor, lod_from_args
+from isotools.narrow import scalar_range
+from isotools.progressive import add_progressive_arguments, preview_from_args
+from isotools.rawvolume import (add_volume_arguments, check_volume_arguments, volume_bounds,
+	volume_from_args)
+from isotools.service import add_daemon_arguments, check_daemon_arguments, daemon_from_args
+from isotools.spanspace import add_span_space_arguments, bricks_from_args
+from isotools.trace import add_trace_arguments, trace_from_args
+from isotools.worker import add_worker_arguments, check_abort, detach, worker_from_args
 
 class Visualization(object):
 	"""docstring for Visualizatoin"""
 
 	def slider_isovalue_handler(self, obj, event):
-		self.isovalue = obj.GetRepresentation().GetValue()
-		self.ct_contour.SetValue(0, self.isovalue)
+		# whole isovalues, so revisiting a value hits the surface cache
+		self.isovalue = int(round(obj.GetRepresentation().GetValue()))
+		self.updateCT(event == "InteractionEvent")
 
 	def gmin_slider_handler(self, obj, event):
 		self.gmin = obj.GetRepresentation().GetValue()
@@ -18,8 +39,7 @@ class Visualization(object):
 			self.gmin = self.gmax-1
 			self.gmin_slider.SetValue(self.gmin)
 
-		self.gm_clipper_min.SetValue(self.gmin)
-		self.gm_clipper_min.Update()
+		self.updateCT(event == "InteractionEvent")
 
 	def gmax_slider_handler(self, obj, event):
 		self.gmax = obj.GetRepresentation().GetValue()
@@ -27,28 +47,89 @@ class Visualization(object):
 			self.gmax = self.gmin+1
 			self.gmax_slider.SetValue(self.gmax)
 
-		self.gm_clipper_max.SetValue(self.gmax)
-		self.gm_clipper_max.Update()
+		self.updateCT(event == "InteractionEvent")
 
 	def clip_x_slider_handler(self,obj, event):
 		self.clip_x = obj.GetRepresentation().GetValue()
-		self.updateCT()
+		self.updateCT(event == "InteractionEvent")
 
 	def clip_y_slider_handler(self,obj, event):
 		self.clip_y = obj.GetRepresentation().GetValue()
-		self.updateCT()
+		self.updateCT(event == "InteractionEvent")
 
 	def clip_z_slider_handler(self,obj, event):
 		self.clip_z = obj.GetRepresentation().GetValue()
-		self.updateCT()
-
-	def updateCT(self):
-		self.plane_x.SetOrigin((self.clip_x,0,0))
-		self.plane_y.SetOrigin(0,self.clip_y,0)
-		self.plane_z.SetOrigin(0,0,self.clip_z)
-		self.clipper_x.Update()
-		self.clipper_y.Update()
-		self.clipper_z.Update()
+		self.updateCT(event == "InteractionEvent")
+
+	def parameters(self):
+		return (self.isovalue, (self.clip_x, self.clip_y, self.clip_z), self.gmin, self.gmax)
+
+	def window_of(self, isovalue, lower):
+		"""GradientWindow of the full surface for isovalue and the clip box, if at hand."""
+		# key and window are swapped together, the worker thread replaces them
+		windowed = self.windowed
+		if windowed is not None and windowed[0] == (isovalue, lower):
+			return windowed[1]
+		return None
+
+	def updateCT(self, dragging=False):
+		isovalue, lower, gmin, gmax = self.parameters()
+		window = self.window_of(isovalue, lower)
+		if window is not None:
+			# only the gradient window moved, select it on the full surface at once
+			if self.worker is not None:
+				self.worker.cancel()
+			self.mapper.SetInputData(window.select(gmin, gmax))
+		elif dragging and self.preview is not None:
+			if self.worker is not None:
+				self.worker.cancel()
+			self.mapper.SetInputData(self.preview.extract(isovalue, lower, (gmin, gmax)))
+		elif self.worker is not None:
+			self.worker.submit(self.parameters())
+		else:
+			self.mapper.SetInputData(self.compute_surface(self.parameters()))
+
+	def extract_surface(self, isovalue):
+		"""Isosurface carrying the gradient magnitude, probed once per isovalue."""
+		if self.remote is not None:
+			return self.sampler.attach(self.remote.extract(isovalue))
+		if self.bricks is not None:
+			return self.sampler.attach(self.bricks.extract(isovalue))
+		return self.sampler.attach(extract_isosurface(self.ct_contour, isovalue))
+
+	def fetch_surface(self, isovalue):
+		if self.cache is None:
+			return self.extract_surface(isovalue)
+		return self.cache.fetch(self.dataset, isovalue, self.extract_surface)
+
+	def compute_surface(self, params):
+		"""Gradient windowed surface for (isovalue, clip box lower corner, gmin, gmax)."""
+		isovalue, lower, gmin, gmax = params
+		# moving a gradient slider only selects another run of the window
+		window = self.window_of(isovalue, lower)
+		if window is None:
+			if self.cropper is not None:
+				surface = self.sampler.attach(self.cropper.extract(isovalue, lower))
+			else:
+				if isovalue != self.extracted:
+					self.clipper_x.SetInputData(self.fetch_surface(isovalue))
+					self.extracted = isovalue
+				if self.sweep is not None:
+					surface = self.sweep.clip(self.clipper_x.GetInput(), lower)
+				else:
+					self.plane_x.SetOrigin((lower[0],0,0))
+					self.plane_y.SetOrigin(0,lower[1],0)
+					self.plane_z.SetOrigin(0,0,lower[2])
+					self.clipper_z.Update()
+					check_abort(self.clipper_z)
+					surface = detach(self.clipper_z)
+			window = GradientWindow(surface)
+			self.windowed = ((isovalue, lower), window)
+		return window.select(gmin, gmax)
+
+	def show_surface(self, surface):
+		self.mapper.SetInputData(surface)
+		self.render_window.Render()
 
 	def __init__(self, args):
 		## Files reading and settings
@@ -58,26 +139,45 @@ class Visualization(object):
 		self.clip_y = args.clip[1]
 		self.clip_z = args.clip[2]
 
-		ct_image = vtk.vtkXMLImageDataReader()
-		ct_image.SetFileName(args.data)
-		ct_image.Update()
-
-		gm_image = vtk.vtkXMLImageDataReader()
-		gm_image.SetFileName(args.gradmag)
-		gm_image.Update()
+		self.cache = cache_from_args(args)
+		self.extracted = None
+		self.windowed = None
+		self.dataset = os.path.abspath(args.data)
+
+		self.remote = daemon_from_args(args, args.gradmag)
+		if self.remote is not None:
+			# the daemon holds the volumes, contours and probes them
+			ct_image = None
+			info = self.remote.info(gradient=True)
+			self.bounds = info['bounds']
+			gmrange = info['gradient_range']
+			self.bricks = self.preview = None
+			self.cropper = self.remote if args.crop else None
+			self.sampler = self.remote
+		else:
+			ct_image = volume_from_args(args, args.data)
+			# the clip sliders span the loaded part of the volume
+			self.bounds = volume_bounds(ct_image)
+			self.bricks = bricks_from_args(args, ct_image.GetOutput())
+			self.cropper = cropper_from_args(args, ct_image.GetOutput(), self.bricks)
+
+			gm_image = gradient_from_args(args, args.gradmag, ct_image)
+			gmrange = scalar_range(gm_image.GetOutput())
+			self.sampler = GradientSampler(gm_image.GetOutput())
+			self.preview = preview_from_args(args, ct_image.GetOutput(), gm_image.GetOutput())
 
 		self.ct_contour = vtk.vtkContourFilter()
 		self.ct_contour.ComputeNormalsOn()
-		self.ct_contour.SetValue(0, self.isovalue)
-		self.ct_contour.SetInputConnection(ct_image.GetOutputPort());
+		if ct_image is not None:
+			self.ct_contour.SetInputConnection(ct_image.GetOutputPort());
 
 		#Cutting planes
+		self.sweep = sweep_from_args(args)
 		self.plane_x = vtk.vtkPlane()
 		self.plane_x.SetOrigin(self.clip_x, 0, 0)
 		self.plane_x.SetNormal(1, 0, 0)
 		self.clipper_x = vtk.vtkClipPolyData()
 		self.clipper_x.SetClipFunction(self.plane_x)
-		self.clipper_x.SetInputConnection(self.ct_contour.GetOutputPort())
 
 		self.plane_y = vtk.vtkPlane()
 		self.plane_y.SetOrigin(0, self.clip_y, 0)
@@ -93,36 +193,31 @@ class Visualization(object):
 		self.clipper_z.SetClipFunction(self.plane_z)
 		self.clipper_z.SetInputConnection(self.clipper_y.GetOutputPort())
 
-		probe_filter = vtk.vtkProbeFilter()
-		probe_filter.SetInputConnection(1,gm_image.GetOutputPort())
-		probe_filter.SetInputConnection(0,self.clipper_z.GetOutputPort())
-
-		gmrange = probe_filter.GetOutput().GetScalarRange()
-		self.gmin = gmrange[0]
-		self.gmax = GRAD_MAX
-
-		self.gm_clipper_min = vtk.vtkClipPolyData()
-		self.gm_clipper_min.SetInputConnection(probe_filter.GetOutputPort())
-		self.gm_clipper_min.InsideOutOff()
-		self.gm_clipper_min.SetValue(self.gmin)
-
-		self.gm_clipper_max = vtk.vtkClipPolyData()
-		self.gm_clipper_max.SetInputConnection(self.gm_clipper_min.GetOutputPort())
-		self.gm_clipper_max.InsideOutOn()
-		self.gm_clipper_max.SetValue(int(self.gmax))
+		self.gmin = math.floor(gmrange[0])
+		self.gmax = math.ceil(gmrange[1])
 
 		color_transfer_func = vtk.vtkColorTransferFunction()
 		color_transfer_func.SetColorSpaceToRGB()
 		color_transfer_func.AddRGBPoint(0, 1, 1, 1)
 		color_transfer_func.AddRGBPoint(2500, 1, 1, 1)
-		color_transfer_func.AddRGBPoint(109404, 1, 0, 0)
+		color_transfer_func.AddRGBPoint(self.gmax, 1, 0, 0)
 
-		mapper = vtk.vtkPolyDataMapper()
-		mapper.SetInputConnection(self.gm_clipper_max.GetOutputPort())
-		mapper.SetLookupTable(color_transfer_func)
+		self.mapper = vtk.vtkPolyDataMapper()
+		self.mapper.SetInputData(self.compute_surface(self.parameters()))
+		self.mapper.SetLookupTable(color_transfer_func)
 
-		actor = vtk.vtkActor()
-		actor.SetMapper(mapper)
+		filters = [self.ct_contour, self.clipper_x, self.clipper_y, self.clipper_z,
+			self.sampler.probe]
+		if self.bricks is not None:
+			filters.append(self.bricks.contour)
+		if self.cropper is not None:
+			filters.append(self.cropper.contour)
+		if self.sweep is not None:
+			filters.extend(self.sweep.clippers)
+		self.worker = worker_from_args(args, self.compute_surface, self.show_surface, filters)
+
+		self.lods = lod_from_args(args)
+		actor = lod_actor(self.lods, self.mapper)
 
 		color_bar = vtk.vtkScalarBarActor()
 		color_bar.SetLookupTable(color_transfer_func)
@@ -141,17 +236,17 @@ class Visualization(object):
 		actor.SetBackfaceProperty(back_faces)
 
 		renderer = vtk.vtkRenderer()
-		render_window = vtk.vtkRenderWindow()
-		render_window.AddRenderer(renderer)
+		self.render_window = vtk.vtkRenderWindow()
+		self.render_window.AddRenderer(renderer)
 		interactive_render = vtk.vtkRenderWindowInteractor()
-		interactive_render.SetRenderWindow(render_window)
+		interactive_render.SetRenderWindow(self.render_window)
 
 		renderer.AddActor(actor)
 		renderer.AddActor(color_bar)
 		renderer.ResetCamera()
 		renderer.SetBackground(0.2,0.3,0.4)
 		renderer.ResetCameraClippingRange()
-		render_window.SetSize(1200, 600)
+		self.render_window.SetSize(1200, 600)
 
 		self.gmin_slider = vtk.vtkSliderRepresentation2D()
 		self.gmin_slider.SetMinimumValue(self.gmin)
@@ -180,7 +275,7 @@ class Visualization(object):
 
 		self.gmax_slider = vtk.vtkSliderRepresentation2D()
 		self.gmax_slider.SetMinimumValue(self.gmin)
-		self.gmax_slider.SetMaximumValue(200000)
+		self.gmax_slider.SetMaximumValue(self.gmax)
 		self.gmax_slider.SetValue(self.gmax)
 		self.gmax_slider.SetTitleText("gradmax")
 		self.gmax_slider.GetPoint1Coordinate().SetCoordinateSystemToNormalizedDisplay()
@@ -229,8 +324,8 @@ class Visualization(object):
 		slider_widget_isovalue.AddObserver("EndInteractionEvent", self.slider_isovalue_handler)
 
 		slider_clip_x = vtk.vtkSliderRepresentation2D()
-		slider_clip_x.SetMinimumValue(0)
-		slider_clip_x.SetMaximumValue(300)
+		slider_clip_x.SetMinimumValue(self.bounds[0])
+		slider_clip_x.SetMaximumValue(self.bounds[1])
 		slider_clip_x.SetValue(self.clip_x)
 		slider_clip_x.SetTitleText("X")
 		slider_clip_x.GetPoint1Coordinate().SetCoordinateSystemToNormalizedDisplay()
@@ -254,8 +349,8 @@ class Visualization(object):
 		Slider_widget_x.AddObserver("EndInteractionEvent", self.clip_x_slider_handler)
 
 		slider_clip_y = vtk.vtkSliderRepresentation2D()
-		slider_clip_y.SetMinimumValue(0)
-		slider_clip_y.SetMaximumValue(300)
+		slider_clip_y.SetMinimumValue(self.bounds[2])
+		slider_clip_y.SetMaximumValue(self.bounds[3])
 		slider_clip_y.SetValue(self.clip_y)
 		slider_clip_y.SetTitleText("Y")
 		slider_clip_y.GetPoint1Coordinate().SetCoordinateSystemToNormalizedDisplay()
@@ -279,8 +374,8 @@ class Visualization(object):
 		slider_widget_y.AddObserver("EndInteractionEvent", self.clip_y_slider_handler)
 
 		clip_z_slider = vtk.vtkSliderRepresentation2D()
-		clip_z_slider.SetMinimumValue(0)
-		clip_z_slider.SetMaximumValue(300)
+		clip_z_slider.SetMinimumValue(self.bounds[4])
+		clip_z_slider.SetMaximumValue(self.bounds[5])
 		clip_z_slider.SetValue(self.clip_z)
 		clip_z_slider.SetTitleText("Z")
 		clip_z_slider.GetPoint1Coordinate().SetCoordinateSystemToNormalizedDisplay()
@@ -303,11 +398,42 @@ class Visualization(object):
 		Slider_widget_z.SetEnabled(True)
 		Slider_widget_z.AddObserver("EndInteractionEvent", self.clip_z_slider_handler)
 
+		self.live = live_drag_from_args(args, self.worker)
+		if self.live is not None or self.preview is not None:
+			for widget, handler in ((self.gmin_slider_widget, self.gmin_slider_handler),
+					(self.gmax_slider_widget, self.gmax_slider_handler),
+					(slider_widget_isovalue, self.slider_isovalue_handler),
+					(Slider_widget_x, self.clip_x_slider_handler),
+					(slider_widget_y, self.clip_y_slider_handler),
+					(Slider_widget_z, self.clip_z_slider_handler)):
+				if self.live is not None:
+					self.live.watch(widget, handler)
+				else:
+					widget.AddObserver("InteractionEvent", handler)
+
+		self.trace = trace_from_args(args)
+		if self.trace is not None:
+			self.trace.watch_all({'contour': self.ct_contour, 'clip_x': self.clipper_x,
+				'clip_y': self.clipper_y, 'clip_z': self.clipper_z, 'probe': self.sampler.probe,
+				'bricks': self.bricks and self.bricks.contour,
+				'crop': self.cropper and self.cropper.contour})
+			self.trace.watch_render(self.render_window)
+			for widget, name in ((self.gmin_slider_widget, "gmin"), (self.gmax_slider_widget, "gmax"),
+					(slider_widget_isovalue, "isovalue"), (Slider_widget_x, "slider_x"),
+					(slider_widget_y, "slider_y"), (Slider_widget_z, "slider_z")):
+				self.trace.watch_widget(widget, name)
+
 		# Render
 		interactive_render.Initialize()
-		render_window.SetSize(800, 400)
-		render_window.SetWindowName("Project 4a: Isocontours - Pedro Acevedo & Randy Consuegra")
-		render_window.Render()
+		if self.worker is not None:
+			self.worker.attach(interactive_render)
+		if self.lods is not None:
+			self.lods.attach(interactive_render)
+		if self.live is not None:
+			self.live.attach(interactive_render)
+		self.render_window.SetSize(800, 400)
+		self.render_window.SetWindowName("Project 4a: Isocontours - Pedro Acevedo & Randy Consuegra")
+		self.render_window.Render()
 		interactive_render.Start()
 
 
@@ -315,11 +441,26 @@ if __name__ == "__main__":
 	# --define argument parser and parse arguments--
 	parser = argparse.ArgumentParser()
 	parser.add_argument('data', help='File with 3D scalar dataset')
-	parser.add_argument('gradmag', help='File with gradient magnitude')
+	parser.add_argument('gradmag', nargs='?',
+						help='File with gradient magnitude (computed from data when left out)')
 	parser.add_argument('--val', type=int, help='Initial isovalue',
 		metavar='int', default=500)
 	parser.add_argument('--clip', type=int, metavar='int', nargs=3,
 						help='initial positions of clipping planes', default=[0, 0, 0])
+	add_cache_arguments(parser)
+	add_gradient_arguments(parser)
+	add_span_space_arguments(parser)
+	add_crop_arguments(parser)
+	add_volume_arguments(parser)
+	add_daemon_arguments(parser)
+	add_worker_arguments(parser)
+	add_progressive_arguments(parser)
+	add_lod_arguments(parser)
+	add_live_drag_arguments(parser)
+	add_trace_arguments(parser)
 	args = parser.parse_args()
+	check_daemon_arguments(parser, args)
+	check_volume_arguments(parser, args)
+	check_live_drag_arguments(parser, args)
 
 	Visualization(args = args)
\ No newline at end of file
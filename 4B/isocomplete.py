@@ -1,7 +1,35 @@
 #!/usr/bin/env python
 
+import os
+import sys
+
 import vtk
 import argparse
+from vtk.util import numpy_support
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from isotools.clipbox import add_crop_arguments, cropper_from_args, sweep_from_args
+from isotools.dvr import add_dvr_arguments, check_dvr_arguments, dvr_from_args
+from isotools.gradient import (GradientSampler, add_gradient_arguments, gradient_from_args,
+	gradient_window)
+from isotools.mesh import split_by_value
+from isotools.livedrag import (add_live_drag_arguments, check_live_drag_arguments,
+	live_drag_from_args)
+from isotools.lod import add_lod_arguments, lod_actor, lod_from_args
+from isotools.meshstore import add_mesh_store_arguments, store_from_args
+from isotools.progressive import add_progressive_arguments, preview_from_args
+from isotools.rawvolume import (add_volume_arguments, check_volume_arguments, volume_bounds,
+	volume_from_args)
+from isotools.service import add_daemon_arguments, check_daemon_arguments, daemon_from_args
+from isotools.spanspace import add_span_space_arguments, bricks_from_args
+from isotools.streaming import (add_stream_arguments, check_stream_arguments, slab_sampler_from_args,
+	stream_from_args)
+from isotools.trace import add_trace_arguments, trace_from_args
+from isotools.transparency import (add_peeling_arguments, check_peeling_arguments,
+	peeling_from_args)
+from isotools.worker import (add_pool_arguments, add_worker_arguments, detach, pool_from_args,
+	worker_from_args)
 
 
 DEFAULT_COLORMAP = [[0, 1, 1, 1], [2500, 1, 1, 1], [109404, 1, 0, 0]]
@@ -13,79 +41,142 @@ class Visualization(object):
 
 	def clipXSliderHandler(self,obj, event):
 		self.clip_x = obj.GetRepresentation().GetValue()
-		self.updateCT()
+		self.updateCT(event == "InteractionEvent")
 
 	def clipYSliderHandler(self,obj, event):
 		self.clip_y = obj.GetRepresentation().GetValue()
-		self.updateCT()
+		self.updateCT(event == "InteractionEvent")
 
 	def clipZSliderHandler(self,obj, event):
 		self.clip_z = obj.GetRepresentation().GetValue()
-		self.updateCT()
-
-	def updateCT(self):
-		self.plane_x.SetOrigin((self.clip_x,0,0))
-		self.plane_y.SetOrigin(0,self.clip_y,0)
-		self.plane_z.SetOrigin(0,0,self.clip_z)
-
-		for i in range(len(self.clipper_X)):
-			self.clipper_X[i].Update()
-			self.clipper_Y[i].Update()
-			self.clipper_Z[i].Update()
-
-	def contours(self, i, ct_image, isovalue, cmap):
-		contour = vtk.vtkContourFilter()
-		contour.SetInputConnection(self.ct_image.GetOutputPort());
-		contour.ComputeNormalsOn()
-
-		contour.SetValue(0, isovalue)
-
+		self.updateCT(event == "InteractionEvent")
+
+	def updateCT(self, dragging=False):
+		lower = (self.clip_x, self.clip_y, self.clip_z)
+		if self.dvr is not None:
+			# the ray caster clips against the planes as it draws
+			self.movePlanes(lower)
+			self.renWin.Render()
+		elif dragging and self.preview is not None:
+			if self.worker is not None:
+				self.worker.cancel()
+			self.setLayers(self.previewLayers(lower))
+		elif self.worker is not None:
+			self.worker.submit(lower)
+		else:
+			self.setLayers(self.computeLayers(lower))
+
+	def extractLayers(self, lower=None):
+		"""Gradient windowed surface of every layer from a single contour pass.
+
+		lower is the lower corner of the clip box, only used when cropping.
+		"""
+		if self.cropper is not None:
+			surface = self.cropper.extract(self.isovalues, lower)
+		elif self.store is not None:
+			surface = self.store.fetch(self.isovalues, self.contourLayers)
+		else:
+			surface = self.contourLayers(self.isovalues)
+		if surface.GetNumberOfPoints() == 0:
+			return [vtk.vtkPolyData() for value in self.isovalues]
+		# the contour value of every point tells the layers apart after probing
+		values = numpy_support.vtk_to_numpy(surface.GetPointData().GetScalars())
+		layers = split_by_value(self.sampler.attach(surface), values, self.isovalues)
+		# the windows are fixed, so they are applied before any clip plane
+		return [gradient_window(layers[i], self.gimin[i], self.gimax[i]) for i in range(len(layers))]
+
+	def contourLayers(self, isovalues):
+		if self.remote is not None:
+			return self.remote.extract(isovalues)
+		if self.stream is not None:
+			return self.stream.extract(isovalues)
+		if self.bricks is not None:
+			return self.bricks.extract(isovalues)
+		self.contour.Update()
+		return self.contour.GetOutput()
+
+	def movePlanes(self, lower):
+		for plane_x, plane_y, plane_z in [(self.plane_x, self.plane_y, self.plane_z)] + self.layer_planes:
+			plane_x.SetOrigin((lower[0],0,0))
+			plane_y.SetOrigin(0,lower[1],0)
+			plane_z.SetOrigin(0,0,lower[2])
+
+	def computeLayers(self, lower):
+		"""Final surface of every layer for the clip box with the given lower corner."""
+		self.movePlanes(lower)
+
+		if self.cropper is not None:
+			return self.extractLayers(lower)
+
+		# the layers share no filter, so they can run side by side
+		layers = range(len(self.outputs))
+		if self.pool is not None:
+			return list(self.pool.map(self.updateLayer, layers, [lower] * len(layers)))
+		return [self.updateLayer(i, lower) for i in layers]
+
+	def updateLayer(self, i, lower):
+		if self.sweeps[i] is not None:
+			return self.sweeps[i].clip(self.clipper_X[i].GetInput(), lower)
+		self.outputs[i].Update()
+		return detach(self.outputs[i])
+
+	def previewLayers(self, lower):
+		return [self.preview.extract(self.isovalues[i], lower, (self.gimin[i], self.gimax[i]))
+			for i in range(len(self.isovalues))]
+
+	def setLayers(self, surfaces):
+		for i in range(len(surfaces)):
+			self.mappers[i].SetInputData(surfaces[i])
+
+	def showLayers(self, surfaces):
+		self.setLayers(surfaces)
+		self.renWin.Render()
+
+	def contours(self, i, surface, isovalue, cmap):
 		color_fun = vtk.vtkColorTransferFunction()
 		color_fun.SetColorSpaceToRGB()
 		color_fun.AddRGBPoint(isovalue, cmap[0], cmap[1],cmap[2])
 
 
+		# planes and input of its own, so that the layer pool never updates
+		# two pipelines through a shared object
+		planes = []
+		for axis in range(3):
+			normal = [0, 0, 0]
+			normal[axis] = 1
+			planes.append(vtk.vtkPlane())
+			planes[axis].SetNormal(normal)
+		self.layer_planes.append(planes)
+
 		clipper_x = vtk.vtkClipPolyData()
-		clipper_x.SetClipFunction(self.plane_x)
-		clipper_x.SetInputConnection(contour.GetOutputPort())
+		clipper_x.SetClipFunction(planes[0])
+		if surface is not None:
+			layer = vtk.vtkPolyData()
+			layer.ShallowCopy(surface)
+			clipper_x.SetInputData(layer)
 
 		clipper_y = vtk.vtkClipPolyData()
-		clipper_y.SetClipFunction(self.plane_y)
+		clipper_y.SetClipFunction(planes[1])
 		clipper_y.SetInputConnection(clipper_x.GetOutputPort())
 
 		clipper_z = vtk.vtkClipPolyData()
-		clipper_z.SetClipFunction(self.plane_z)
+		clipper_z.SetClipFunction(planes[2])
 		clipper_z.SetInputConnection(clipper_y.GetOutputPort())
 
-		probe_filter = vtk.vtkProbeFilter()
-		probe_filter.SetSourceConnection(self.gm_image.GetOutputPort())
-		probe_filter.SetInputConnection(clipper_z.GetOutputPort())
-
-		gmin = self.gimin[i]
-		gmax = self.gimax[i]
-
-		gm_clipper_min = vtk.vtkClipPolyData()
-		gm_clipper_min.SetInputConnection(probe_filter.GetOutputPort())
-		gm_clipper_min.InsideOutOff()
-		gm_clipper_min.SetValue(gmin)
-
-		gm_clipper_max = vtk.vtkClipPolyData()
-		gm_clipper_max.SetInputConnection(gm_clipper_min.GetOutputPort())
-		gm_clipper_max.InsideOutOn()
-		gm_clipper_max.SetValue(int(gmax))
-
 		color_mapper = vtk.vtkPolyDataMapper()
 		color_mapper.SetLookupTable(color_fun)
-		color_mapper.SetInputConnection(gm_clipper_max.GetOutputPort())
-		color_mapper.SetScalarRange(gm_clipper_max.GetOutput().GetScalarRange())
+		color_mapper.SetInputConnection(clipper_z.GetOutputPort())
+		color_mapper.SetScalarRange(clipper_z.GetOutput().GetScalarRange())
 
-		color_actor=vtk.vtkActor()
+		color_actor = lod_actor(self.lods, color_mapper)
 		color_actor.GetProperty().SetOpacity(cmap[3])
-		color_actor.SetMapper(color_mapper)
 
 		self.clipper_X.append(clipper_x)
-		self.clipper_Y.append(clipper_x)
-		self.clipper_Z.append(clipper_x)
+		self.clipper_Y.append(clipper_y)
+		self.clipper_Z.append(clipper_z)
+		self.outputs.append(clipper_z)
+		self.mappers.append(color_mapper)
+		self.filters.extend([clipper_x, clipper_y, clipper_z])
 
 		return color_actor
 
@@ -102,19 +193,51 @@ class Visualization(object):
 		self.clipper_X = []
 		self.clipper_Y = []
 		self.clipper_Z = []
-
-		self.ct_image = vtk.vtkXMLImageDataReader()
-		self.ct_image.SetFileName(args.data)
-		self.ct_image.Update()
-
-		self.gm_image = vtk.vtkXMLImageDataReader()
-		self.gm_image.SetFileName(args.maggrad)
-		self.gm_image.Update()
+		self.layer_planes = []
+		self.outputs = []
+		self.mappers = []
+		self.filters = []
+
+		self.pool = pool_from_args(args, len(self.isovalues))
+		self.lods = lod_from_args(args)
+
+		self.remote = daemon_from_args(args, args.maggrad)
+		self.dvr = None
+		if self.remote is not None:
+			# the daemon holds the volumes, contours and probes them
+			self.ct_image = None
+			self.bounds = self.remote.info()['bounds']
+			self.stream = self.bricks = self.preview = None
+			self.cropper = self.remote if args.crop else None
+			self.sampler = self.remote
+		else:
+			self.ct_image = volume_from_args(args, args.data, update=args.stream_slab <= 0)
+			# the clip sliders span the loaded part of the volume
+			self.bounds = volume_bounds(self.ct_image)
+			self.stream = stream_from_args(args, self.ct_image)
+			self.bricks = bricks_from_args(args, self.ct_image.GetOutput())
+			self.cropper = cropper_from_args(args, self.ct_image.GetOutput(), self.bricks)
+			if self.stream is not None:
+				self.sampler = slab_sampler_from_args(args, args.maggrad, self.ct_image)
+				self.preview = None
+			else:
+				self.gm_image = gradient_from_args(args, args.maggrad, self.ct_image)
+				self.sampler = GradientSampler(self.gm_image.GetOutput())
+				self.preview = preview_from_args(args, self.ct_image.GetOutput(), self.gm_image.GetOutput())
+				self.dvr = dvr_from_args(args, self.ct_image.GetOutput(), self.gm_image.GetOutput(),
+					list(zip(args.isoval, args.mingrad, args.maxgrad, args.cmap)))
+		# cropped surfaces depend on the clip box and are not worth keeping, the
+		# daemon keeps the whole ones without the viewer hashing the scan and the
+		# ray caster extracts none
+		self.store = None
+		if self.cropper is None and self.remote is None and self.dvr is None:
+			self.store = store_from_args(args, {'normals': True})
 
 		self.gimin = args.mingrad
 		self.gimax = args.maxgrad
 
 		#Cutting planes
+		self.sweeps = [sweep_from_args(args) for value in self.isovalues]
 		self.plane_x = vtk.vtkPlane()
 		self.plane_x.SetOrigin(self.clip_x, 0, 0)
 		self.plane_x.SetNormal(1, 0, 0)
@@ -128,26 +251,58 @@ class Visualization(object):
 		self.plane_z.SetNormal(0, 0, 1)
 
 		ren = vtk.vtkRenderer()
-		renWin = vtk.vtkRenderWindow()
-		renWin.AddRenderer(ren)
+		self.renWin = vtk.vtkRenderWindow()
+		self.renWin.AddRenderer(ren)
 		iren = vtk.vtkRenderWindowInteractor()
-		iren.SetRenderWindow(renWin)
-
+		iren.SetRenderWindow(self.renWin)
+
+		# all isovalues in one pass, the layers only differ from the clip planes on
+		self.contour = vtk.vtkContourFilter()
+		if self.ct_image is not None:
+			self.contour.SetInputConnection(self.ct_image.GetOutputPort())
+		self.contour.ComputeNormalsOn()
+		self.contour.ComputeScalarsOn()
+		self.contour.SetNumberOfContours(len(self.isovalues))
 		for i in range(len(self.isovalues)):
-			ren.AddActor(self.contours(i,self.ct_image,self.isovalues[i], self.cmap[i]))
+			self.contour.SetValue(i, self.isovalues[i])
+
+		if self.dvr is not None:
+			# the layers are classified into the volume, no surface is extracted
+			self.dvr.clip([self.plane_x, self.plane_y, self.plane_z])
+			ren.AddVolume(self.dvr.volume)
+		else:
+			# when cropping the layers are extracted again for every clip box
+			surfaces = [None] * len(self.isovalues)
+			if self.cropper is None:
+				surfaces = self.extractLayers()
+			for i in range(len(self.isovalues)):
+				ren.AddActor(self.contours(i, surfaces[i], self.isovalues[i], self.cmap[i]))
+			self.setLayers(self.computeLayers((self.clip_x, self.clip_y, self.clip_z)))
+
+		self.filters.extend([self.contour, self.sampler.probe])
+		for sweep in self.sweeps:
+			if sweep is not None:
+				self.filters.extend(sweep.clippers)
+		if self.stream is not None:
+			self.filters.append(self.stream.contour)
+		if self.bricks is not None:
+			self.filters.append(self.bricks.contour)
+		if self.cropper is not None:
+			self.filters.append(self.cropper.contour)
+		self.worker = worker_from_args(args, self.computeLayers, self.showLayers, self.filters)
 
 		ren.ResetCamera()
 		ren.SetBackground(0.2,0.3,0.4)
 		ren.ResetCameraClippingRange()
-		ren.SetUseDepthPeeling(1)
-		ren.SetMaximumNumberOfPeels(100)
-		ren.SetOcclusionRatio(0.4)
+		self.transparency = None
+		if self.dvr is None:
+			self.transparency = peeling_from_args(args, ren)
 		ren.ResetCamera()
-		renWin.SetSize(1200, 600)
+		self.renWin.SetSize(1200, 600)
 
 		clipXSlider = vtk.vtkSliderRepresentation2D()
-		clipXSlider.SetMinimumValue(0)
-		clipXSlider.SetMaximumValue(300)
+		clipXSlider.SetMinimumValue(self.bounds[0])
+		clipXSlider.SetMaximumValue(self.bounds[1])
 		clipXSlider.SetValue(self.clip_x)
 		clipXSlider.SetTitleText("X")
 		clipXSlider.GetPoint1Coordinate().SetCoordinateSystemToNormalizedDisplay()
@@ -171,8 +326,8 @@ class Visualization(object):
 		SliderWidget2.AddObserver("EndInteractionEvent", self.clipXSliderHandler)
 
 		clipYSlider = vtk.vtkSliderRepresentation2D()
-		clipYSlider.SetMinimumValue(0)
-		clipYSlider.SetMaximumValue(300)
+		clipYSlider.SetMinimumValue(self.bounds[2])
+		clipYSlider.SetMaximumValue(self.bounds[3])
 		clipYSlider.SetValue(self.clip_y)
 		clipYSlider.SetTitleText("Y")
 		clipYSlider.GetPoint1Coordinate().SetCoordinateSystemToNormalizedDisplay()
@@ -196,8 +351,8 @@ class Visualization(object):
 		SliderWidget3.AddObserver("EndInteractionEvent", self.clipYSliderHandler)
 
 		clipZSlider = vtk.vtkSliderRepresentation2D()
-		clipZSlider.SetMinimumValue(0)
-		clipZSlider.SetMaximumValue(300)
+		clipZSlider.SetMinimumValue(self.bounds[4])
+		clipZSlider.SetMaximumValue(self.bounds[5])
 		clipZSlider.SetValue(self.clip_z)
 		clipZSlider.SetTitleText("Z")
 		clipZSlider.GetPoint1Coordinate().SetCoordinateSystemToNormalizedDisplay()
@@ -220,10 +375,41 @@ class Visualization(object):
 		SliderWidget4.SetEnabled(True)
 		SliderWidget4.AddObserver("EndInteractionEvent", self.clipZSliderHandler)
 
+		self.live = live_drag_from_args(args, self.worker)
+		if self.live is not None or self.preview is not None:
+			for widget, handler in ((SliderWidget2, self.clipXSliderHandler),
+					(SliderWidget3, self.clipYSliderHandler),
+					(SliderWidget4, self.clipZSliderHandler)):
+				if self.live is not None:
+					self.live.watch(widget, handler)
+				else:
+					widget.AddObserver("InteractionEvent", handler)
+
+		self.trace = trace_from_args(args)
+		if self.trace is not None:
+			# contours() adds the x, y and z clippers of every layer first
+			for i, clipper in enumerate(self.filters[:3 * len(self.outputs)]):
+				self.trace.watch(clipper, "layer%d clip_%s" % (i // 3, "xyz"[i % 3]))
+			self.trace.watch_all({'contour': self.contour, 'probe': self.sampler.probe,
+				'bricks': self.bricks and self.bricks.contour,
+				'crop': self.cropper and self.cropper.contour})
+			self.trace.watch_render(self.renWin)
+			for widget, name in ((SliderWidget2, "slider_x"), (SliderWidget3, "slider_y"),
+					(SliderWidget4, "slider_z")):
+				self.trace.watch_widget(widget, name)
+
 		# Render
 		iren.Initialize()
-		renWin.SetWindowName("Project 4b: GeoVisualization - Pedro Acevedo & Randy Consuegra")
-		renWin.Render()
+		if self.worker is not None:
+			self.worker.attach(iren)
+		if self.lods is not None:
+			self.lods.attach(iren)
+		if self.live is not None:
+			self.live.attach(iren)
+		if self.transparency is not None:
+			self.transparency.attach(iren)
+		self.renWin.SetWindowName("Project 4b: GeoVisualization - Pedro Acevedo & Randy Consuegra")
+		self.renWin.Render()
 		iren.Start()
 
 
@@ -243,11 +429,33 @@ def readFromFile(name):
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser()
 	parser.add_argument('data', help='File with 3D scalar dataset')
-	parser.add_argument('maggrad', help='File with gradient magnitude')
+	parser.add_argument('maggrad', nargs='?',
+						help='File with gradient magnitude (computed from data when left out)')
 	parser.add_argument('params', help='txt with isovalues, grad range and scale colors.')
 	parser.add_argument('--clip', type=int, metavar='int', nargs=3,
 						help='initial positions of clipping planes', default=DEFAULT_PLANE_POS)
+	add_gradient_arguments(parser)
+	add_mesh_store_arguments(parser)
+	add_span_space_arguments(parser)
+	add_crop_arguments(parser)
+	add_volume_arguments(parser)
+	add_daemon_arguments(parser)
+	add_worker_arguments(parser)
+	add_pool_arguments(parser)
+	add_progressive_arguments(parser)
+	add_lod_arguments(parser)
+	add_live_drag_arguments(parser)
+	add_dvr_arguments(parser)
+	add_peeling_arguments(parser)
+	add_stream_arguments(parser)
+	add_trace_arguments(parser)
 	args = parser.parse_args()
+	check_stream_arguments(parser, args)
+	check_volume_arguments(parser, args)
+	check_live_drag_arguments(parser, args)
+	check_daemon_arguments(parser, args)
+	check_dvr_arguments(parser, args)
+	check_peeling_arguments(parser, args)
 
 	if args.params != 'NULL':
 		params = readFromFile(args.params)
@@ -0,0 +1 @@
+"""Shared helpers for the isosurface viewers of projects 3 and 4."""
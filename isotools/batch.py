@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+"""Headless batch rendering of isovalue / clip / colormap sweeps.
+
+Every combination of the requested isovalues (or params.txt layers), clip
+positions and colormaps is rendered offscreen to a PNG, optionally with the
+extracted meshes. Jobs are spread over a multiprocessing pool; each worker
+loads the volumes once and reuses them for all of its jobs.
+
+	python -m isotools.batch ct.vti --isovalues 500 1040 1153 --clip 0 0 0 --clip 90 0 0
+	python -m isotools.batch ct.vti --gradmag gm.vti --params 4B/params.txt --output qa
+"""
+
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import time
+
+import vtk
+
+from isotools.clipbox import CroppedContour
+from isotools.gradient import GradientSampler, gradient_window
+from isotools.narrow import narrow_volume, scalar_range
+from isotools.rawvolume import add_volume_arguments, check_volume_arguments, open_volume
+
+DEFAULT_SIZE = [800, 600]
+DEFAULT_PLANE_POS = [0, 0, 0]
+# same scales as the viewers of project 3
+ISOVALUE_COLORMAP = [[500, 177/256, 122/256, 101/256], [753, 197/256, 140/256, 133/256],
+	[1040, 248/256, 10/256, 10/256], [1140, 192/256, 104/256, 88/256],
+	[1153, 0.9, 0.9, 0.9], [1319, 0.9, 0.9, 0.9]]
+# white up to 2500, then to red at the maximum of the gradient volume, like iso2dtf
+GRADIENT_COLORMAP = [[0, 1, 1, 1], [2500, 1, 1, 1]]
+MESH_WRITERS = {
+	'vtp': vtk.vtkXMLPolyDataWriter,
+	'ply': vtk.vtkPLYWriter,
+	'stl': vtk.vtkSTLWriter,
+}
+
+# volumes loaded once per worker process
+state = {}
+
+
+def read_table(name):
+	"""Rows of numbers of a params/colormap/isovalues file, skipping comments."""
+	rows = []
+	with open(name, "r") as f:
+		for line in f.readlines():
+			line = line.strip()
+			if line and not line.startswith("#"):
+				rows.append([int(v) if '.' not in v else float(v) for v in line.split()])
+	return rows
+
+
+def make_jobs(args):
+	"""Cartesian product of layer sets, clip positions and colormaps."""
+	if args.params is not None:
+		# one job renders every layer of the file together, like isocomplete
+		layer_sets = [[{'isovalue': row[0], 'gmin': row[1], 'gmax': row[2],
+			'rgba': [c / 255.0 for c in row[3:6]] + [row[6]]} for row in read_table(args.params)]]
+	else:
+		isovalues = list(args.isovalues or [])
+		if args.isovalue_file is not None:
+			isovalues.extend(row[0] for row in read_table(args.isovalue_file))
+		layer_sets = [[{'isovalue': value}] for value in isovalues]
+
+	colormaps = args.cmap or [None]
+	jobs = []
+	for layers, clip, cmap in itertools.product(layer_sets, args.clip or [DEFAULT_PLANE_POS], colormaps):
+		jobs.append({'index': len(jobs), 'layers': layers, 'clip': list(clip), 'cmap': cmap})
+	return jobs
+
+
+def job_name(job):
+	isovalues = "-".join("%g" % layer['isovalue'] for layer in job['layers'])
+	name = "%04d_iso%s_clip%g-%g-%g" % ((job['index'], isovalues) + tuple(job['clip']))
+	if job['cmap'] is not None:
+		name += "_" + os.path.splitext(os.path.basename(job['cmap']))[0]
+	return name
+
+
+def init_worker(data, gradmag, threads, roi=None, stride=1, narrow=False):
+	if threads:
+		vtk.vtkSMPTools.Initialize(threads)
+	state['readers'] = [open_volume(data, roi=roi, stride=stride)]
+	if narrow:
+		state['readers'][0] = narrow_volume(state['readers'][0], name=os.path.basename(data))
+	state['ct'] = state['readers'][0].GetOutput()
+	state['sampler'] = None
+	if gradmag:
+		state['readers'].append(open_volume(gradmag, roi=roi, stride=stride))
+		if narrow:
+			state['readers'][1] = narrow_volume(state['readers'][1], True, os.path.basename(gradmag))
+		state['sampler'] = GradientSampler(state['readers'][1].GetOutput())
+		state['gradient_colormap'] = gradient_colormap(state['readers'][1].GetOutput())
+	state['cropper'] = CroppedContour(state['ct'])
+
+
+def gradient_colormap(gradmag):
+	"""GRADIENT_COLORMAP closed by red at the largest gradient of gradmag."""
+	return GRADIENT_COLORMAP + [[math.ceil(scalar_range(gradmag)[1]), 1, 0, 0]]
+
+
+def color_function(points):
+	color_func = vtk.vtkColorTransferFunction()
+	color_func.SetColorSpaceToRGB()
+	for p in points:
+		color_func.AddRGBPoint(p[0], p[1], p[2], p[3])
+	return color_func
+
+
+def layer_actor(layer, surface, cmap):
+	"""Actor for one layer, colored like the viewer that would show it."""
+	sampler = state['sampler']
+	if sampler is not None:
+		surface = sampler.attach(surface)
+		if 'gmin' in layer:
+			surface = gradient_window(surface, layer['gmin'], layer['gmax'])
+
+	mapper = vtk.vtkPolyDataMapper()
+	mapper.SetInputData(surface)
+	actor = vtk.vtkActor()
+	actor.SetMapper(mapper)
+	if 'rgba' in layer:
+		mapper.ScalarVisibilityOff()
+		actor.GetProperty().SetColor(layer['rgba'][:3])
+		actor.GetProperty().SetOpacity(layer['rgba'][3])
+	elif cmap is not None:
+		mapper.SetLookupTable(color_function(read_table(cmap)))
+	elif sampler is not None:
+		mapper.SetLookupTable(color_function(state['gradient_colormap']))
+	else:
+		mapper.SetLookupTable(color_function(ISOVALUE_COLORMAP))
+	return actor, surface
+
+
+def render_job(job, options):
+	"""Render one job offscreen; runs inside a worker process."""
+	start = time.time()
+	renderer = vtk.vtkRenderer()
+	renderer.SetBackground(0.2, 0.3, 0.4)
+	surfaces = []
+	for layer in job['layers']:
+		surface = state['cropper'].extract(layer['isovalue'], job['clip'])
+		actor, surface = layer_actor(layer, surface, job['cmap'])
+		renderer.AddActor(actor)
+		surfaces.append(surface)
+	if len(job['layers']) > 1:
+		renderer.SetUseDepthPeeling(1)
+		renderer.SetMaximumNumberOfPeels(100)
+		renderer.SetOcclusionRatio(0.4)
+
+	render_window = vtk.vtkRenderWindow()
+	render_window.SetOffScreenRendering(1)
+	render_window.SetSize(options['size'])
+	render_window.AddRenderer(renderer)
+	renderer.ResetCamera()
+	render_window.Render()
+
+	name = os.path.join(options['output'], job_name(job))
+	window_image = vtk.vtkWindowToImageFilter()
+	window_image.SetInput(render_window)
+	window_image.ReadFrontBufferOff()
+	writer = vtk.vtkPNGWriter()
+	writer.SetFileName(name + ".png")
+	writer.SetInputConnection(window_image.GetOutputPort())
+	writer.Write()
+	render_window.Finalize()
+
+	outputs = [name + ".png"]
+	if options['mesh'] is not None:
+		for i, surface in enumerate(surfaces):
+			mesh_name = "%s_layer%d.%s" % (name, i, options['mesh'])
+			mesh_writer = MESH_WRITERS[options['mesh']]()
+			mesh_writer.SetFileName(mesh_name)
+			mesh_writer.SetInputData(surface)
+			mesh_writer.Write()
+			outputs.append(mesh_name)
+
+	return dict(job, outputs=outputs, triangles=sum(s.GetNumberOfPolys() for s in surfaces),
+		seconds=time.time() - start, worker=os.getpid())
+
+
+def run_batch(args):
+	jobs = make_jobs(args)
+	if not os.path.isdir(args.output):
+		os.makedirs(args.output)
+	options = {'output': args.output, 'size': args.size, 'mesh': args.mesh}
+	processes = args.processes or multiprocessing.cpu_count()
+	# one VTK thread per process when the pool already fills the cores
+	threads = 1 if processes > 1 else 0
+
+	start = time.time()
+	pool = multiprocessing.Pool(processes, initializer=init_worker,
+		initargs=(args.data, args.gradmag, threads, args.roi, args.stride, args.narrow))
+	try:
+		results = pool.starmap(render_job, [(job, options) for job in jobs], chunksize=1)
+	finally:
+		pool.close()
+		pool.join()
+	elapsed = time.time() - start
+
+	manifest = {'data': args.data, 'gradmag': args.gradmag, 'processes': processes,
+		'seconds': elapsed, 'jobs': results}
+	with open(os.path.join(args.output, "manifest.json"), "w") as f:
+		json.dump(manifest, f, indent=1)
+	print("%d jobs in %.1f s on %d processes" % (len(jobs), elapsed, processes))
+	return results
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description="Renders isovalue, clip and colormap combinations offscreen.")
+	parser.add_argument('data', help='File with 3D scalar dataset')
+	parser.add_argument('--gradmag', help='File with gradient magnitude, to color by it')
+	parser.add_argument('--isovalues', type=float, nargs='+', metavar='float', help='Isovalues to render')
+	parser.add_argument('--isovalue-file', metavar='filename', help='txt with isovalues, as in 3B')
+	parser.add_argument('--params', metavar='filename',
+						help='txt with isovalue, grad range and color rows, as in 4B; needs --gradmag')
+	parser.add_argument('--clip', type=float, nargs=3, action='append', metavar='float',
+						help='Clipping plane positions, may be repeated')
+	parser.add_argument('--cmap', action='append', metavar='filename',
+						help='Colormap file, may be repeated')
+	parser.add_argument('--output', '-o', default='batch_output', help='Output directory')
+	parser.add_argument('--size', type=int, nargs=2, metavar='int', default=DEFAULT_SIZE,
+						help='Image width and height')
+	parser.add_argument('--mesh', choices=sorted(MESH_WRITERS), help='Also write the meshes')
+	parser.add_argument('--processes', '-j', type=int, metavar='int', default=0,
+						help='Worker processes (default: one per core)')
+	add_volume_arguments(parser)
+	args = parser.parse_args()
+	check_volume_arguments(parser, args)
+
+	if args.params is not None and args.gradmag is None:
+		parser.error("--params needs --gradmag")
+	if args.params is None and not args.isovalues and args.isovalue_file is None:
+		parser.error("give --isovalues, --isovalue-file or --params")
+
+	run_batch(args)
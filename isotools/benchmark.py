@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""Time the pipeline stages of the viewers on synthetic volumes.
+
+For every phantom and size the volume and its gradient magnitude are
+written to a scratch directory, then each stage the viewers use is timed
+with the engines available for it. Every stage runs --repeat times and the
+results, with the VTK version and machine they were measured on, are
+written as JSON so that runs can be compared.
+
+	python -m isotools.benchmark --sizes 64 128 256 --output bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import vtk
+
+from isotools.clipbox import CroppedContour
+from isotools.gradient import GradientWindow, cell_gradient, gradient_window
+from isotools.phantom import ISOVALUES, PHANTOMS, write_phantom
+from isotools.rawvolume import open_volume
+from isotools.spanspace import DEFAULT_BRICK_SIZE, BrickContour
+
+DEFAULT_SIZES = [64, 128, 256]
+DEFAULT_REPEAT = 3
+RENDER_SIZE = [800, 600]
+# the clip box keeps everything above this fraction of the volume
+CLIP_FRACTION = 0.3
+# the gradient window keeps the values between these percentiles
+WINDOW_PERCENTILES = (10, 90)
+
+
+def time_runs(function, repeat):
+	"""Seconds of repeat calls of function, and its last result."""
+	runs = []
+	for i in range(repeat):
+		start = time.perf_counter()
+		result = function()
+		runs.append(time.perf_counter() - start)
+	return runs, result
+
+
+def read_xml(name):
+	reader = vtk.vtkXMLImageDataReader()
+	reader.SetFileName(name)
+	reader.Update()
+	return reader.GetOutput()
+
+
+def contour_filter(image, isovalue):
+	contour = vtk.vtkContourFilter()
+	contour.SetInputData(image)
+	contour.ComputeNormalsOn()
+	contour.SetValue(0, isovalue)
+	contour.Update()
+	return contour.GetOutput()
+
+
+def clip_planes(surface, lower):
+	"""The three chained plane clips of the viewers."""
+	output = surface
+	for axis in range(3):
+		plane = vtk.vtkPlane()
+		origin = [0, 0, 0]
+		origin[axis] = lower[axis]
+		normal = [0, 0, 0]
+		normal[axis] = 1
+		plane.SetOrigin(origin)
+		plane.SetNormal(normal)
+		clipper = vtk.vtkClipPolyData()
+		clipper.SetClipFunction(plane)
+		clipper.SetInputData(output)
+		clipper.Update()
+		output = clipper.GetOutput()
+	return output
+
+
+def probe(surface, gradient):
+	probe_filter = vtk.vtkProbeFilter()
+	probe_filter.SetSourceData(gradient)
+	probe_filter.SetInputData(surface)
+	probe_filter.Update()
+	return probe_filter.GetOutput()
+
+
+def gradient_clips(surface, gmin, gmax):
+	"""The two scalar clips the viewers used for the gradient window."""
+	clipper_min = vtk.vtkClipPolyData()
+	clipper_min.SetInputData(surface)
+	clipper_min.InsideOutOff()
+	clipper_min.SetValue(gmin)
+	clipper_max = vtk.vtkClipPolyData()
+	clipper_max.SetInputConnection(clipper_min.GetOutputPort())
+	clipper_max.InsideOutOn()
+	clipper_max.SetValue(gmax)
+	clipper_max.Update()
+	return clipper_max.GetOutput()
+
+
+def render(surface):
+	"""Offscreen frame of surface, including the upload of the mesh."""
+	mapper = vtk.vtkPolyDataMapper()
+	mapper.SetInputData(surface)
+	actor = vtk.vtkActor()
+	actor.SetMapper(mapper)
+	renderer = vtk.vtkRenderer()
+	renderer.AddActor(actor)
+	window = vtk.vtkRenderWindow()
+	window.SetOffScreenRendering(1)
+	window.SetSize(RENDER_SIZE)
+	window.AddRenderer(renderer)
+	renderer.ResetCamera()
+	window.Render()
+	window.Finalize()
+	return surface
+
+
+def cells(result):
+	if isinstance(result, vtk.vtkDataSet):
+		return result.GetNumberOfCells()
+	return None
+
+
+def benchmark_volume(phantom, size, directory, repeat, stages, report):
+	"""Time every stage on one phantom; report(record) receives each result."""
+	data = os.path.join(directory, "%s%d.vti" % (phantom, size))
+	gradmag = os.path.join(directory, "%s%d_gm.vti" % (phantom, size))
+	compressed = os.path.join(directory, "%s%d_zlib.vti" % (phantom, size))
+	write_phantom(phantom, size, data, gradmag)
+	writer = vtk.vtkXMLImageDataWriter()
+	writer.SetInputData(open_volume(data).GetOutput())
+	writer.SetFileName(compressed)
+	writer.Write()
+
+	image = open_volume(data).GetOutput()
+	gradient = open_volume(gradmag).GetOutput()
+	isovalue = ISOVALUES[phantom]
+	lower = [CLIP_FRACTION * (size - 1)] * 3
+
+	surface = contour_filter(image, isovalue)
+	clipped = clip_planes(surface, lower)
+	probed = probe(clipped, gradient)
+	gmin, gmax = 0, 1
+	if probed.GetNumberOfCells():
+		gmin, gmax = np.percentile(cell_gradient(probed), WINDOW_PERCENTILES)
+	bricks = BrickContour(image, DEFAULT_BRICK_SIZE)
+	cropper = CroppedContour(image)
+
+	cases = [
+		('load', 'xml-zlib', lambda: read_xml(compressed)),
+		('load', 'xml-raw', lambda: read_xml(data)),
+		('load', 'mmap', lambda: open_volume(data).GetOutput()),
+		('contour', 'vtkContourFilter', lambda: contour_filter(image, isovalue)),
+		('contour', 'bricks', lambda: bricks.extract(isovalue)),
+		('contour', 'crop', lambda: cropper.extract(isovalue, lower)),
+		('clip', 'planes', lambda: clip_planes(surface, lower)),
+		('probe', 'vtkProbeFilter', lambda: probe(clipped, gradient)),
+		('gradient', 'clips', lambda: gradient_clips(probed, gmin, gmax)),
+		('gradient', 'mask', lambda: gradient_window(probed, gmin, gmax)),
+		('gradient', 'sorted', lambda: GradientWindow(probed).select(gmin, gmax)),
+		('render', 'offscreen', lambda: render(probed)),
+	]
+	for stage, engine, function in cases:
+		if stages and stage not in stages:
+			continue
+		runs, result = time_runs(function, repeat)
+		report({'phantom': phantom, 'size': size, 'stage': stage, 'engine': engine,
+			'best': min(runs), 'mean': sum(runs) / len(runs), 'runs': runs, 'cells': cells(result)})
+
+
+def environment():
+	return {'vtk': vtk.vtkVersion.GetVTKVersion(), 'numpy': np.__version__,
+		'python': platform.python_version(), 'platform': platform.platform(),
+		'processor': platform.processor(), 'cpus': os.cpu_count()}
+
+
+def run_benchmarks(args):
+	directory = args.workdir or tempfile.mkdtemp(prefix="isotools-bench-")
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+	results = []
+
+	def report(record):
+		results.append(record)
+		print("%-8s %4d  %-9s %-17s %9.4f s  %s" % (record['phantom'], record['size'],
+			record['stage'], record['engine'], record['best'],
+			"" if record['cells'] is None else "%d cells" % record['cells']))
+		sys.stdout.flush()
+
+	try:
+		for phantom in args.phantoms:
+			for size in args.sizes:
+				benchmark_volume(phantom, size, directory, args.repeat, args.stages, report)
+	finally:
+		if args.workdir is None:
+			shutil.rmtree(directory, ignore_errors=True)
+
+	output = {'environment': environment(), 'repeat': args.repeat, 'results': results}
+	with open(args.output, "w") as f:
+		json.dump(output, f, indent=1)
+	return output
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Times the viewer pipeline stages on synthetic volumes.")
+	parser.add_argument('--phantoms', nargs='+', choices=sorted(PHANTOMS), default=sorted(PHANTOMS),
+						help='Volumes to generate')
+	parser.add_argument('--sizes', type=int, nargs='+', metavar='int', default=DEFAULT_SIZES,
+						help='Points along each axis, up to 512')
+	parser.add_argument('--stages', nargs='+', choices=['load', 'contour', 'clip', 'probe',
+						'gradient', 'render'], help='Only time these stages')
+	parser.add_argument('--repeat', type=int, metavar='int', default=DEFAULT_REPEAT,
+						help='Runs of every stage, the best one is reported')
+	parser.add_argument('--workdir', metavar='dir',
+						help='Keep the generated volumes here instead of a temporary directory')
+	parser.add_argument('--output', '-o', default='bench.json', help='JSON file with the results')
+	args = parser.parse_args()
+
+	run_benchmarks(args)
@@ -0,0 +1,121 @@
+"""Memory bounded cache of extracted isosurfaces."""
+
+import collections
+
+import vtk
+
+from isotools.worker import check_abort
+
+# default budget for the in-memory surface cache
+DEFAULT_CACHE_MB = 512
+
+
+def surface_bytes(surface):
+	return surface.GetActualMemorySize() * 1024
+
+
+class SurfaceCache(object):
+	"""LRU cache of isosurfaces keyed by (dataset, isovalue).
+
+	Entries are evicted, least recently used first, whenever the stored
+	surfaces exceed max_bytes or max_triangles. A budget of None means
+	no limit on that quantity.
+	"""
+
+	def __init__(self, max_bytes=DEFAULT_CACHE_MB * 1024 * 1024, max_triangles=None):
+		self.max_bytes = max_bytes
+		self.max_triangles = max_triangles
+		self.entries = collections.OrderedDict()
+		self.bytes = 0
+		self.triangles = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __contains__(self, key):
+		return key in self.entries
+
+	def get(self, dataset, isovalue):
+		key = (dataset, float(isovalue))
+		if key not in self.entries:
+			self.misses += 1
+			return None
+		self.hits += 1
+		self.entries.move_to_end(key)
+		return self.entries[key][0]
+
+	def put(self, dataset, isovalue, surface):
+		key = (dataset, float(isovalue))
+		if key in self.entries:
+			self.remove(key)
+
+		size = surface_bytes(surface)
+		triangles = surface.GetNumberOfPolys()
+		if not self.fits(size, triangles):
+			# a surface bigger than the whole budget is never kept
+			return
+		self.entries[key] = (surface, size, triangles)
+		self.bytes += size
+		self.triangles += triangles
+		self.evict()
+
+	def fetch(self, dataset, isovalue, extract):
+		"""Return the cached surface or build it with extract(isovalue)."""
+		surface = self.get(dataset, isovalue)
+		if surface is None:
+			surface = extract(isovalue)
+			self.put(dataset, isovalue, surface)
+		return surface
+
+	def fits(self, size, triangles):
+		if self.max_bytes is not None and size > self.max_bytes:
+			return False
+		if self.max_triangles is not None and triangles > self.max_triangles:
+			return False
+		return True
+
+	def over_budget(self):
+		return not self.fits(self.bytes, self.triangles)
+
+	def evict(self):
+		while self.entries and self.over_budget():
+			self.remove(next(iter(self.entries)))
+			self.evictions += 1
+
+	def remove(self, key):
+		surface, size, triangles = self.entries.pop(key)
+		self.bytes -= size
+		self.triangles -= triangles
+
+	def clear(self):
+		self.entries.clear()
+		self.bytes = 0
+		self.triangles = 0
+
+
+def extract_isosurface(contour_filter, isovalue):
+	"""Run contour_filter at isovalue and detach the result from the pipeline."""
+	contour_filter.SetValue(0, isovalue)
+	contour_filter.Update()
+	check_abort(contour_filter)
+	surface = vtk.vtkPolyData()
+	surface.ShallowCopy(contour_filter.GetOutput())
+	return surface
+
+
+def cache_from_args(args):
+	"""Build the cache requested on the command line, or None if disabled."""
+	if args.cache_mb <= 0:
+		return None
+	return SurfaceCache(max_bytes=args.cache_mb * 1024 * 1024,
+		max_triangles=args.cache_triangles)
+
+
+def add_cache_arguments(parser):
+	parser.add_argument('--cache-mb', type=int, metavar='int', default=DEFAULT_CACHE_MB,
+						help='Memory budget of the isosurface cache in MB (0 disables it)')
+	parser.add_argument('--cache-triangles', type=int, metavar='int', default=None,
+						help='Maximum number of cached triangles')
@@ -0,0 +1,403 @@
+"""Isovalue sweeps played back from memory.
+
+A Cine contours a range of isovalues at a fixed step on a thread pool,
+every thread with its own CroppedContour, so the frames are clipped to the
+box of the viewer as its own surfaces are. The sweep starts over once a
+clip plane is let go, not while it is dragged. A frame is kept packed:
+points as uint16 steps across the bounds of the surface, normals as int8
+and triangles as int32, about 17 bytes per triangle instead of the 46 of
+the contour filter output. In frames form every surface is drawn once
+offscreen with the camera of the viewer, a few per timer tick, and only
+the zlib compressed picture is kept. When the sweep outgrows its memory
+cap every other frame is dropped and the step doubled, so the frames
+still span the whole range.
+
+Space plays and pauses the sweep at a steady frame rate, the arrow keys step
+through it and the isovalue slider scrubs it; nothing is contoured while the
+sweep is shown. Escape goes back to the surface of the slider value.
+"""
+
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from isotools.clipbox import CroppedContour
+from isotools.mesh import points_array, triangles_array
+from isotools.meshstore import mesh_from_arrays
+
+DEFAULT_CINE_STEP = 10
+DEFAULT_CINE_RANGE = (100, 2000)
+DEFAULT_CINE_FPS = 10
+DEFAULT_CINE_MB = 512
+CINE_FORMS = ("mesh", "frames")
+# how often finished frames are collected and playback advanced, in milliseconds
+POLL_MS = 20
+# pictures drawn per timer tick in frames form, so the view keeps answering
+PAINTS_PER_TICK = 2
+POINT_LEVELS = 65535
+
+
+def pack_surface(surface):
+	"""Compact copy of the triangles of surface as a dict of arrays."""
+	triangles = triangles_array(surface)
+	if len(triangles) == 0:
+		return {}
+	# clipped surfaces share the points of the whole contour
+	used = np.zeros(surface.GetNumberOfPoints(), dtype=bool)
+	used[triangles] = True
+	ids = np.flatnonzero(used)
+	points = points_array(surface)[ids]
+	low = points.min(axis=0).astype(np.float64)
+	high = points.max(axis=0).astype(np.float64)
+	scale = np.where(high > low, (high - low) / POINT_LEVELS, 1.0)
+	packed = {'points': np.rint((points - low) / scale).astype(np.uint16), 'origin': low,
+		'scale': scale, 'triangles': (np.cumsum(used) - 1)[triangles].astype(np.int32)}
+	point_data = surface.GetPointData()
+	if point_data.GetNormals() is not None:
+		normals = numpy_support.vtk_to_numpy(point_data.GetNormals())[ids]
+		packed['normals'] = np.rint(normals * 127).astype(np.int8)
+	if point_data.GetScalars() is not None:
+		packed['scalars_name'] = point_data.GetScalars().GetName() or ""
+	return packed
+
+
+def unpack_surface(packed, isovalue):
+	"""vtkPolyData of a pack_surface() copy; every point of it has the scalar isovalue."""
+	if not packed:
+		return vtk.vtkPolyData()
+	points = (packed['points'] * packed['scale'] + packed['origin']).astype(np.float32)
+	arrays = {'points': points, 'triangles': packed['triangles']}
+	if 'normals' in packed:
+		arrays['normals'] = packed['normals'].astype(np.float32) / 127
+	if 'scalars_name' in packed:
+		arrays['scalars'] = np.full(len(points), isovalue, dtype=np.float32)
+		arrays['scalars_name'] = packed['scalars_name']
+	return mesh_from_arrays(arrays)
+
+
+def packed_bytes(frame):
+	if isinstance(frame, dict):
+		return sum(value.nbytes for value in frame.values() if isinstance(value, np.ndarray))
+	return len(frame[1])
+
+
+class FramePainter(object):
+	"""Pictures of surfaces drawn offscreen the way actor is drawn in renderer."""
+
+	def __init__(self, renderer, actor):
+		self.view = renderer
+		self.renderer = vtk.vtkRenderer()
+		self.renderer.SetBackground(renderer.GetBackground())
+		self.window = vtk.vtkRenderWindow()
+		self.window.SetOffScreenRendering(1)
+		self.window.AddRenderer(self.renderer)
+		mapper = actor.GetMapper()
+		self.mapper = vtk.vtkPolyDataMapper()
+		self.mapper.SetLookupTable(mapper.GetLookupTable())
+		self.mapper.SetScalarRange(mapper.GetScalarRange())
+		self.actor = vtk.vtkActor()
+		self.actor.SetMapper(self.mapper)
+		self.actor.GetProperty().DeepCopy(actor.GetProperty())
+		self.renderer.AddActor(self.actor)
+		self.grab = vtk.vtkWindowToImageFilter()
+		self.grab.SetInput(self.window)
+		self.grab.ReadFrontBufferOff()
+		self.texture = vtk.vtkTexture()
+
+	def view_key(self):
+		"""What the pictures depend on: the camera and the size of the view."""
+		camera = self.view.GetActiveCamera()
+		return (camera.GetPosition(), camera.GetFocalPoint(), camera.GetViewUp(),
+			camera.GetViewAngle(), tuple(self.view.GetSize()))
+
+	def paint(self, surface):
+		"""(width, height) and compressed RGB bytes of surface."""
+		self.renderer.GetActiveCamera().DeepCopy(self.view.GetActiveCamera())
+		self.window.SetSize(self.view.GetSize())
+		self.mapper.SetInputData(surface)
+		self.renderer.ResetCameraClippingRange()
+		self.window.Render()
+		self.grab.Modified()
+		self.grab.Update()
+		image = self.grab.GetOutput()
+		rgb = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())[:, :3]
+		size = image.GetDimensions()[:2]
+		return size, zlib.compress(np.ascontiguousarray(rgb).tobytes(), 1)
+
+	def show(self, picture):
+		"""Draw picture as the background of the view."""
+		(width, height), data = picture
+		rgb = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(-1, 3)
+		image = vtk.vtkImageData()
+		image.SetDimensions(width, height, 1)
+		array = numpy_support.numpy_to_vtk(rgb, deep=1)
+		image.GetPointData().SetScalars(array)
+		self.texture.SetInputData(image)
+		self.view.SetBackgroundTexture(self.texture)
+		self.view.TexturedBackgroundOn()
+
+	def hide(self):
+		self.view.TexturedBackgroundOff()
+
+
+class Cine(object):
+	"""Sweep of the isosurfaces of image over values, played back in the view.
+
+	mapper and actor show the surface in renderer, slider is the
+	representation of the isovalue slider and restore() brings the surface
+	of the slider value back when playback is left. painter, a
+	FramePainter, keeps pictures instead of surfaces.
+	"""
+
+	def __init__(self, image, values, mapper, actor, renderer, slider, restore,
+			fps=DEFAULT_CINE_FPS, max_bytes=DEFAULT_CINE_MB << 20, jobs=0, painter=None):
+		self.image = image
+		self.values = list(values)
+		self.mapper = mapper
+		self.actor = actor
+		self.renderer = renderer
+		self.slider = slider
+		self.restore = restore
+		self.fps = fps
+		self.max_bytes = max_bytes
+		self.painter = painter
+		self.pool = ThreadPoolExecutor(jobs or os.cpu_count() or 1, thread_name_prefix="cine")
+		self.local = threading.local()
+		self.lock = threading.Lock()
+		self.generation = 0
+		self.futures = []
+		self.done = []
+		self.lower = None
+		self.view = None
+		self.interactor = None
+		self.active = False
+		self.playing = False
+		self.position = 0
+
+	def prepare(self, lower, force=False):
+		"""Contour the sweep in the background for the clip box with the given lower corner."""
+		lower = tuple(lower)
+		if lower == self.lower and not force:
+			return
+		if self.active and not force:
+			# the frames show another box, the viewer shows its own surface again
+			self.stop()
+		self.cancel()
+		self.lower = lower
+		self.frames = {}
+		self.bytes = 0
+		self.stride = 1
+		self.started = time.time()
+		self.reported = False
+		self.view = None
+		self.futures = [self.pool.submit(self.extract, self.generation, index, lower)
+			for index in range(len(self.values))]
+
+	def cancel(self):
+		"""Drop the queued contours and whatever the running ones still deliver."""
+		for future in self.futures:
+			future.cancel()
+		self.futures = []
+		with self.lock:
+			self.generation += 1
+			self.done = []
+
+	def hold(self, lower):
+		"""Drop the sweep while the clip box is dragged, prepare() starts it over on release."""
+		if self.lower is None or tuple(lower) == self.lower:
+			return
+		if self.active:
+			self.stop()
+		self.cancel()
+		self.lower = None
+
+	def extract(self, generation, index, lower):
+		if generation != self.generation or index % self.stride:
+			return
+		if not hasattr(self.local, 'contour'):
+			# the filters of each thread read their own copy of the image
+			image = vtk.vtkImageData()
+			with self.lock:
+				image.ShallowCopy(self.image)
+			self.local.contour = CroppedContour(image)
+		surface = self.local.contour.extract(self.values[index], lower)
+		# pictures can only be drawn on the main thread
+		frame = surface if self.painter is not None else pack_surface(surface)
+		with self.lock:
+			if generation == self.generation:
+				self.done.append((index, frame))
+
+	def collect(self):
+		"""Keep the frames the pool finished since the last call."""
+		with self.lock:
+			if self.painter is not None:
+				# the rest waits for the next ticks
+				done, self.done = self.done[:PAINTS_PER_TICK], self.done[PAINTS_PER_TICK:]
+			else:
+				done, self.done = self.done, []
+		for index, frame in done:
+			if index % self.stride:
+				continue
+			if self.painter is not None:
+				if self.view is None:
+					self.view = self.painter.view_key()
+				elif self.painter.view_key() != self.view:
+					# the camera moved while the pictures were being taken
+					self.prepare(self.lower, force=True)
+					return
+				frame = self.painter.paint(frame)
+			self.frames[index] = frame
+			self.bytes += packed_bytes(frame)
+			while self.bytes > self.max_bytes and self.stride < len(self.values):
+				self.thin()
+		if not self.reported and len(self.frames) == len(range(0, len(self.values), self.stride)):
+			self.reported = True
+			print("Cine: %d frames of isovalues %g to %g step %g, %.0f MB, ready in %.1f s" % (
+				len(self.frames), self.values[0], self.values[-1], self.step(), self.bytes / 1048576.0,
+				time.time() - self.started))
+
+	def thin(self):
+		"""Drop every other frame and double the step, to fit the memory cap."""
+		self.stride *= 2
+		for index in [index for index in self.frames if index % self.stride]:
+			self.bytes -= packed_bytes(self.frames.pop(index))
+		print("Cine: sweep over %d MB, step raised to %g" % (self.max_bytes >> 20, self.step()))
+
+	def step(self):
+		if len(self.values) < 2:
+			return 0
+		return (self.values[1] - self.values[0]) * self.stride
+
+	def nearest(self, isovalue):
+		"""Index of the frame closest to isovalue."""
+		index = int(np.abs(np.asarray(self.values) - isovalue).argmin())
+		return min(int(round(index / float(self.stride))) * self.stride,
+			(len(self.values) - 1) // self.stride * self.stride)
+
+	def show(self, index):
+		"""Put the frame of index in the view; False if it is not ready yet."""
+		frame = self.frames.get(index)
+		if frame is None:
+			return False
+		self.position = index
+		self.slider.SetValue(self.values[index])
+		if self.painter is not None:
+			self.actor.VisibilityOff()
+			self.painter.show(frame)
+		else:
+			self.mapper.SetInputData(unpack_surface(frame, self.values[index]))
+		return True
+
+	def seek(self, isovalue):
+		"""Show the frame closest to isovalue if the sweep is being shown."""
+		if not self.active:
+			return False
+		index = self.nearest(isovalue)
+		if self.playing:
+			self.clock = (time.time(), index)
+		self.show(index)
+		return True
+
+	def play(self):
+		self.active = True
+		self.playing = not self.playing
+		self.clock = (time.time(), self.position)
+
+	def stop(self):
+		self.active = self.playing = False
+		self.actor.VisibilityOn()
+		if self.painter is not None:
+			self.painter.hide()
+
+	def leave(self):
+		self.stop()
+		self.restore()
+
+	def close(self):
+		"""Drop the frames still queued, so that exiting waits for none of them."""
+		self.cancel()
+		self.pool.shutdown(wait=False, cancel_futures=True)
+
+	def exit(self, obj, event):
+		self.close()
+		# observing ExitEvent takes over the default of ending the event loop
+		obj.TerminateApp()
+
+	def tick(self, obj=None, event=None):
+		self.collect()
+		if not self.playing:
+			return
+		if self.painter is not None and self.view is not None and self.painter.view_key() != self.view:
+			# the pictures were taken from elsewhere
+			self.prepare(self.lower, force=True)
+			return
+		start, first = self.clock
+		count = len(range(0, len(self.values), self.stride))
+		# frames follow the clock, so a slow one delays nothing after it
+		index = (first // self.stride + int((time.time() - start) * self.fps)) % count * self.stride
+		if index != self.position and self.show(index):
+			self.interactor.Render()
+
+	def key(self, obj, event):
+		symbol = obj.GetKeySym()
+		if symbol == "space":
+			self.play()
+		elif symbol in ("Left", "Right") and self.active:
+			self.playing = False
+			count = len(range(0, len(self.values), self.stride))
+			step = 1 if symbol == "Right" else -1
+			self.show((self.position // self.stride + step) % count * self.stride)
+		elif symbol == "Escape" and self.active:
+			self.leave()
+		else:
+			return
+		obj.Render()
+
+	def attach(self, interactor):
+		self.interactor = interactor
+		interactor.AddObserver("TimerEvent", self.tick)
+		interactor.AddObserver("KeyPressEvent", self.key)
+		interactor.AddObserver("ExitEvent", self.exit)
+		interactor.CreateRepeatingTimer(POLL_MS)
+
+
+def cine_from_args(args, image, mapper, actor, renderer, slider, restore):
+	"""Build the isovalue sweep requested on the command line, or None."""
+	if args.cine is None or args.cine <= 0:
+		return None
+	low, high = args.cine_range
+	values = np.arange(low, high + args.cine / 2.0, args.cine).tolist()
+	painter = FramePainter(renderer, actor) if args.cine_form == "frames" else None
+	return Cine(image, values, mapper, actor, renderer, slider, restore, args.cine_fps,
+		args.cine_mb << 20, args.cine_jobs, painter)
+
+
+def check_cine_arguments(parser, args):
+	"""Reject the options that leave no volume in the viewer along with --cine."""
+	if args.cine is not None and (args.stream_slab > 0 or args.daemon is not None):
+		parser.error("--cine contours the volume held in the viewer, it can't be combined with "
+			"--stream-slab or --daemon")
+
+
+def add_cine_arguments(parser):
+	parser.add_argument('--cine', type=float, metavar='step', nargs='?', const=DEFAULT_CINE_STEP,
+						help='Contour a sweep of isovalues in the background and play it with '
+						'space, the arrow keys and the isovalue slider (step %g when not given)'
+						% DEFAULT_CINE_STEP)
+	parser.add_argument('--cine-range', type=float, metavar='float', nargs=2,
+						default=list(DEFAULT_CINE_RANGE), help='First and last isovalue of the sweep')
+	parser.add_argument('--cine-fps', type=float, metavar='float', default=DEFAULT_CINE_FPS,
+						help='Frames per second of the playback')
+	parser.add_argument('--cine-mb', type=int, metavar='int', default=DEFAULT_CINE_MB,
+						help='Memory cap of the sweep in MB, the step is doubled until it fits')
+	parser.add_argument('--cine-form', choices=CINE_FORMS, default=CINE_FORMS[0],
+						help='Keep the surfaces of the sweep, or pictures of them taken with the '
+						'camera of the moment')
+	parser.add_argument('--cine-jobs', type=int, metavar='int', default=0,
+						help='Threads contouring the sweep (0 for one per core)')
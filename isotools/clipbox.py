@@ -0,0 +1,229 @@
+"""Contour only the part of the volume inside the clip box.
+
+The viewers keep the part of the isosurface with x >= clip_x, y >= clip_y
+and z >= clip_z. As the planes are axis aligned, the box maps to a voxel
+sub-extent: only that region is contoured, and exact triangle clipping is
+left for the triangles of the boundary slab.
+
+When the whole isosurface is kept instead, SweepClipper follows the planes
+as they move and only revisits the triangles between their old and new
+positions.
+"""
+
+import math
+
+import numpy as np
+import vtk
+
+from isotools.mesh import points_array, triangles_array, with_triangles
+from isotools.worker import check_abort
+
+
+def clip_extent(image, lower):
+	"""Point extent of image holding every cell that reaches past lower.
+
+	One extra layer of points is kept below the box so that the gradient
+	normals of the boundary points are central differences, as in the
+	uncropped volume.
+	"""
+	origin = image.GetOrigin()
+	spacing = image.GetSpacing()
+	whole = image.GetExtent()
+	extent = []
+	for axis in range(3):
+		# the origin is the position of index 0, not of the first point
+		start = math.floor((lower[axis] - origin[axis]) / spacing[axis]) - 1
+		extent.append(min(max(start, whole[2 * axis]), whole[2 * axis + 1]))
+		extent.append(whole[2 * axis + 1])
+	return tuple(extent)
+
+
+class BoxClipper(object):
+	"""Exact clip of a surface against the three lower box planes.
+
+	Only the triangles with a vertex outside the box go through
+	vtkClipPolyData; the rest are passed on untouched.
+	"""
+
+	def __init__(self):
+		self.planes = []
+		self.clippers = []
+		for axis in range(3):
+			plane = vtk.vtkPlane()
+			normal = [0, 0, 0]
+			normal[axis] = 1
+			plane.SetNormal(normal)
+			clipper = vtk.vtkClipPolyData()
+			clipper.SetClipFunction(plane)
+			if self.clippers:
+				clipper.SetInputConnection(self.clippers[-1].GetOutputPort())
+			self.planes.append(plane)
+			self.clippers.append(clipper)
+
+	def move(self, lower):
+		for axis, plane in enumerate(self.planes):
+			origin = [0, 0, 0]
+			origin[axis] = lower[axis]
+			plane.SetOrigin(origin)
+
+	def cut(self, surface, triangles):
+		"""Exact clip of the given triangles of surface against the planes."""
+		self.clippers[0].SetInputData(with_triangles(surface, triangles))
+		self.clippers[-1].Update()
+		check_abort(self.clippers[-1])
+		return self.clippers[-1].GetOutput()
+
+	def join(self, surface, triangles, cut):
+		"""Surface made of the given triangles of surface and the cut ones."""
+		append = vtk.vtkAppendPolyData()
+		append.AddInputData(with_triangles(surface, triangles))
+		append.AddInputData(cut)
+		append.Update()
+		result = vtk.vtkPolyData()
+		result.ShallowCopy(append.GetOutput())
+		return result
+
+	def clip(self, surface, lower):
+		triangles = triangles_array(surface)
+		if len(triangles) == 0:
+			return surface
+		inside = np.all(points_array(surface) >= np.asarray(lower, dtype=np.float64), axis=1)
+		whole = inside[triangles].all(axis=1)
+		if whole.all():
+			return surface
+
+		self.move(lower)
+		return self.join(surface, triangles[whole], self.cut(surface, triangles[~whole]))
+
+
+# where a triangle lies with respect to one plane
+INSIDE, ACROSS, OUTSIDE = 0, 1, 2
+
+
+class SweepClipper(BoxClipper):
+	"""BoxClipper following the planes over a surface it clipped before.
+
+	The triangles are sorted along every axis by their smallest and by
+	their largest coordinate, so moving a plane only revisits the triangles
+	whose bounds lie between its old and its new position. Every triangle is
+	known to be inside the box, outside it or across a plane, and only the
+	ones across a plane go through vtkClipPolyData.
+	"""
+
+	def __init__(self):
+		BoxClipper.__init__(self)
+		self.surface = None
+
+	def load(self, surface):
+		self.surface = surface
+		self.triangles = triangles_array(surface)
+		points = points_array(surface)
+		self.bounds = []
+		for axis in range(3):
+			# compared in double precision, as vtkClipPolyData does
+			corners = points[:, axis].astype(np.float64)[self.triangles]
+			ends = []
+			for end in (corners.min(axis=1), corners.max(axis=1)):
+				order = np.argsort(end, kind='stable')
+				ends.append((end[order], order.astype(np.int32)))
+			self.bounds.append(ends)
+		# planes at -inf leave every triangle inside
+		self.lower = [-np.inf] * 3
+		self.state = np.zeros((3, len(self.triangles)), dtype=np.int8)
+		self.outside = np.zeros(len(self.triangles), dtype=np.int8)
+		self.across = np.zeros(len(self.triangles), dtype=np.int8)
+
+	def sweep(self, axis, position):
+		"""Move the plane of axis to position, updating the triangles it passes."""
+		start, stop = sorted((self.lower[axis], position))
+		self.lower[axis] = position
+		# a triangle changes side when one of its ends lies in [start, stop)
+		ids = np.unique(np.concatenate([order[np.searchsorted(end, start):np.searchsorted(end, stop)]
+			for end, order in self.bounds[axis]]))
+		if len(ids) == 0:
+			return
+		corners = points_array(self.surface)[:, axis].astype(np.float64)[self.triangles[ids]]
+		state = np.full(len(ids), ACROSS, dtype=np.int8)
+		state[corners.min(axis=1) >= position] = INSIDE
+		state[corners.max(axis=1) < position] = OUTSIDE
+		previous = self.state[axis, ids]
+		self.outside[ids] += (state == OUTSIDE).astype(np.int8) - (previous == OUTSIDE)
+		self.across[ids] += (state == ACROSS).astype(np.int8) - (previous == ACROSS)
+		self.state[axis, ids] = state
+
+	def clip(self, surface, lower):
+		if surface is not self.surface:
+			self.load(surface)
+		if len(self.triangles) == 0:
+			return surface
+		for axis in range(3):
+			if lower[axis] != self.lower[axis]:
+				self.sweep(axis, float(lower[axis]))
+		kept = self.outside == 0
+		whole = kept & (self.across == 0)
+		if whole.all():
+			return surface
+
+		self.move(lower)
+		return self.join(surface, self.triangles[whole], self.cut(surface, self.triangles[kept & ~whole]))
+
+
+class CroppedContour(object):
+	"""Contour stage that crops the volume to the clip box first.
+
+	bricks, a spanspace.BrickContour, is used for the contour when given.
+	"""
+
+	def __init__(self, image, bricks=None):
+		self.image = image
+		self.bricks = bricks
+		self.voi = vtk.vtkExtractVOI()
+		self.voi.SetInputData(image)
+		self.contour = vtk.vtkContourFilter()
+		self.contour.ComputeNormalsOn()
+		self.contour.SetInputConnection(self.voi.GetOutputPort())
+		self.box = BoxClipper()
+
+	def extract(self, isovalues, lower):
+		"""Isosurface for isovalues clipped to x, y, z >= lower."""
+		if np.isscalar(isovalues):
+			isovalues = [isovalues]
+		extent = clip_extent(self.image, lower)
+		if extent[0] == extent[1] or extent[2] == extent[3] or extent[4] == extent[5]:
+			return vtk.vtkPolyData()
+
+		if self.bricks is not None:
+			surface = self.bricks.extract(isovalues, extent)
+		else:
+			self.voi.SetVOI(extent)
+			self.contour.SetNumberOfContours(len(isovalues))
+			for i, value in enumerate(isovalues):
+				self.contour.SetValue(i, value)
+			self.contour.Update()
+			check_abort(self.contour)
+			surface = vtk.vtkPolyData()
+			surface.ShallowCopy(self.contour.GetOutput())
+		return self.box.clip(surface, lower)
+
+
+def cropper_from_args(args, image, bricks=None):
+	"""Build the cropped contour stage requested on the command line."""
+	if not args.crop:
+		return None
+	return CroppedContour(image, bricks)
+
+
+def sweep_from_args(args):
+	"""Build the incremental clipper requested on the command line, or None."""
+	if not args.incremental_clip:
+		return None
+	return SweepClipper()
+
+
+def add_crop_arguments(parser):
+	parser.add_argument('--crop', action='store_true',
+						help='Contour only the voxels inside the clip box instead of clipping '
+						'the whole isosurface')
+	parser.add_argument('--incremental-clip', action='store_true',
+						help='Keep the triangles sorted along every axis and only revisit the ones '
+						'a clip plane passed over when it moves')
@@ -0,0 +1,212 @@
+"""Gradient magnitude derived from the CT volume itself.
+
+Instead of reading a separately produced gradient magnitude file, the
+viewers can compute it at load time with vtkImageGradientMagnitude, which
+runs multithreaded over the whole volume. The result is written to an
+on-disk cache as a memory-mappable .vti named after the path, size and
+modification time of the CT file, so later launches only stat the CT and
+map the cached volume. Streaming viewers read a cached volume slab by
+slab; when there is none they derive the gradient of every slab instead,
+since storing it would need the whole volume in memory.
+
+GradientSampler probes the gradient magnitude at the points of an
+isosurface right after it is extracted, before the clip planes, and
+GradientWindow keeps the triangles whose gradient lies in a [gmin, gmax]
+window without re-triangulating the surface.
+"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from isotools.mesh import compact, triangles_array, with_triangles
+from isotools.narrow import narrow_volume, restore_values, scalar_scale
+from isotools.rawvolume import open_volume, volume_from_args, volume_key, write_volume
+from isotools.worker import check_abort
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "isotools")
+HASH_BLOCK = 1 << 22
+
+
+def file_hash(name):
+	"""sha1 hex digest of the contents of name."""
+	digest = hashlib.sha1()
+	with open(name, "rb") as f:
+		block = f.read(HASH_BLOCK)
+		while block:
+			digest.update(block)
+			block = f.read(HASH_BLOCK)
+	return digest.hexdigest()
+
+
+def file_key(name):
+	"""sha1 hex digest of the absolute path, size and modification time of name."""
+	status = os.stat(name)
+	key = "%s:%d:%d" % (os.path.abspath(name), status.st_size, status.st_mtime_ns)
+	return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def gradient_cache_name(data, cache_dir=DEFAULT_CACHE_DIR, key=""):
+	"""File of the cached gradient magnitude of data, None without cache_dir."""
+	if not cache_dir:
+		return None
+	return os.path.join(cache_dir, "gradmag-%s%s.vti" % (file_key(data), key))
+
+
+def gradient_magnitude(image):
+	"""Float gradient magnitude of image, central differences in world units."""
+	cast = vtk.vtkImageCast()
+	cast.SetInputData(image)
+	cast.SetOutputScalarTypeToFloat()
+	gradient = vtk.vtkImageGradientMagnitude()
+	gradient.SetInputConnection(cast.GetOutputPort())
+	gradient.SetDimensionality(3)
+	gradient.HandleBoundariesOn()
+	gradient.Update()
+	output = vtk.vtkImageData()
+	output.ShallowCopy(gradient.GetOutput())
+	output.GetPointData().GetScalars().SetName("gradient_magnitude")
+	return output
+
+
+def cached_gradient(data, image, cache_dir=DEFAULT_CACHE_DIR, key=""):
+	"""Algorithm producing the gradient magnitude of image, read from data.
+
+	The volume is looked up in cache_dir by the file_key() of data and
+	computed and stored there when missing. key tells apart images taken
+	from different parts of data. An empty cache_dir disables the cache.
+	"""
+	name = gradient_cache_name(data, cache_dir, key)
+	if name is not None and os.path.exists(name):
+		return open_volume(name)
+
+	gm = gradient_magnitude(image)
+	if cache_dir:
+		try:
+			if not os.path.isdir(cache_dir):
+				os.makedirs(cache_dir)
+			# write under a temporary name so that a concurrent launch never maps half a file
+			handle, partial = tempfile.mkstemp(suffix=".vti", dir=cache_dir)
+			os.close(handle)
+			try:
+				write_volume(gm, partial)
+				os.replace(partial, name)
+			finally:
+				if os.path.exists(partial):
+					os.remove(partial)
+			return open_volume(name)
+		except (IOError, OSError) as e:
+			print("Gradient magnitude not cached: %s" % e)
+
+	producer = vtk.vtkPassThrough()
+	producer.SetInputData(gm)
+	producer.Update()
+	return producer
+
+
+class GradientSampler(object):
+	"""Gradient magnitude of image looked up at the points of a surface.
+
+	attach() returns the surface with the values as its point scalars. The
+	clip filters interpolate point data, so a surface is sampled once when
+	it is extracted and moving a clip plane never probes again. With an
+	image source vtkProbeFilter finds the cell of every point from its
+	structured coordinates, without building a locator. The steps of a
+	quantized image are turned back into gradient magnitudes.
+	"""
+
+	def __init__(self, image):
+		self.probe = vtk.vtkProbeFilter()
+		self.probe.SetSourceData(image)
+		self.scale = scalar_scale(image)
+
+	def attach(self, surface):
+		self.probe.SetInputData(surface)
+		self.probe.Update()
+		check_abort(self.probe)
+		# only the gradient and the normals, every extra array slows the clippers down
+		result = vtk.vtkPolyData()
+		result.CopyStructure(surface)
+		scalars = self.probe.GetOutput().GetPointData().GetScalars()
+		if self.scale != (1.0, 0.0):
+			values = restore_values(numpy_support.vtk_to_numpy(scalars), self.scale)
+			name = scalars.GetName()
+			scalars = numpy_support.numpy_to_vtk(values, deep=1)
+			scalars.SetName(name)
+		result.GetPointData().SetScalars(scalars)
+		normals = surface.GetPointData().GetNormals()
+		if normals is not None:
+			result.GetPointData().SetNormals(normals)
+		return result
+
+
+def cell_gradient(surface):
+	"""Gradient magnitude at the centroid of every triangle of a probed surface."""
+	triangles = triangles_array(surface)
+	if len(triangles) == 0:
+		return np.empty(0, dtype=np.float64)
+	values = numpy_support.vtk_to_numpy(surface.GetPointData().GetScalars())
+	return values[triangles].mean(axis=1)
+
+
+def gradient_window(surface, gmin, gmax):
+	"""Triangles of a probed surface whose gradient lies in [gmin, gmax].
+
+	Unlike a pair of scalar clips the triangles are kept or dropped whole,
+	which is a single vectorized comparison. The points the window drops
+	are removed as well.
+	"""
+	gradient = cell_gradient(surface)
+	keep = (gradient >= gmin) & (gradient <= gmax)
+	if keep.all():
+		return surface
+	return compact(surface, triangles_array(surface)[keep])
+
+
+class GradientWindow(object):
+	"""gradient_window() for a surface whose window changes often.
+
+	The triangles are sorted once by their gradient, so any window is a
+	contiguous run found with two binary searches and no filter runs when
+	only gmin or gmax moves.
+	"""
+
+	def __init__(self, surface):
+		self.surface = surface
+		gradient = cell_gradient(surface)
+		order = np.argsort(gradient, kind="stable")
+		self.gradient = gradient[order]
+		self.triangles = triangles_array(surface)[order]
+
+	def select(self, gmin, gmax):
+		start = np.searchsorted(self.gradient, gmin, side="left")
+		stop = np.searchsorted(self.gradient, gmax, side="right")
+		if start == 0 and stop == len(self.gradient):
+			return self.surface
+		return with_triangles(self.surface, self.triangles[start:stop])
+
+
+def gradient_from_args(args, name, ct_image):
+	"""Gradient magnitude volume given on the command line, or derived from the CT.
+
+	name is the command line file, possibly None; ct_image is the loaded CT.
+	Both are cut to the region of interest and stride of the command line,
+	and quantized with --narrow.
+	"""
+	if name is not None:
+		return volume_from_args(args, name, quantize=True)
+	gradient = cached_gradient(args.data, ct_image.GetOutput(), args.gradient_cache,
+		volume_key(args.roi, args.stride))
+	if args.narrow:
+		gradient = narrow_volume(gradient, quantize=True, name="gradient magnitude")
+	return gradient
+
+
+def add_gradient_arguments(parser):
+	parser.add_argument('--gradient-cache', metavar='dir', default=DEFAULT_CACHE_DIR,
+						help='Where gradient magnitudes computed from the data are kept '
+						'(empty to always recompute; --stream-slab only reads it)')
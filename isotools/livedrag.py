@@ -0,0 +1,119 @@
+"""Surfaces that follow a slider while it is being dragged.
+
+The viewers recompute their surfaces when a slider is released. A LiveDrag
+also hands the InteractionEvents of the sliders to the same handlers, at
+most hz times per second. The handlers read the slider when they run, so a
+throttled update always applies the newest position and the positions
+skipped in between are only counted. A one-shot timer applies the last
+position once the interval is over, so the surface catches up with a
+slider that stopped moving before its release.
+
+A recompute that takes longer than half the interval stretches it, so the
+window keeps at least half of the time to draw and answer the mouse. With
+--async-updates the handlers only queue the request and the worker aborts
+the ones a newer position superseded; with --progressive they show a
+preview picked to fit its own frame budget. One of the two is required,
+as full recomputes on the UI thread would freeze the slider they follow.
+"""
+
+import time
+
+DEFAULT_LIVE_HZ = 10
+
+
+class LiveDrag(object):
+	"""Slider handlers called while dragging, at most hz times per second.
+
+	worker, the PipelineWorker of the viewer if any, is only read to report
+	the recomputes it abandoned.
+	"""
+
+	def __init__(self, hz=DEFAULT_LIVE_HZ, worker=None):
+		self.interval = 1.0 / hz
+		self.worker = worker
+		self.interactor = None
+		# newest (widget, handler) not applied yet
+		self.pending = None
+		self.timer = None
+		self.next = 0.0
+		self.reset()
+
+	def reset(self):
+		self.updates = 0
+		self.dropped = 0
+		self.busy = 0.0
+		self.abandoned = self.worker.dropped if self.worker is not None else 0
+
+	def watch(self, widget, handler):
+		widget.AddObserver("InteractionEvent", lambda obj, event: self.moved(obj, handler))
+		widget.AddObserver("EndInteractionEvent", self.released)
+
+	def moved(self, widget, handler):
+		if self.pending is not None:
+			self.dropped += 1
+		self.pending = (widget, handler)
+		now = time.time()
+		if now >= self.next:
+			self.apply()
+		elif self.timer is None and self.interactor is not None:
+			self.timer = self.interactor.CreateOneShotTimer(max(1, int(1000 * (self.next - now))))
+
+	def apply(self, render=False):
+		widget, handler = self.pending
+		self.pending = None
+		start = time.time()
+		handler(widget, "InteractionEvent")
+		if render:
+			# the widget renders after its own events, not after a timer
+			self.interactor.Render()
+		elapsed = time.time() - start
+		self.updates += 1
+		self.busy += elapsed
+		self.next = start + max(self.interval, 2 * elapsed)
+
+	def timed(self, obj, event):
+		if self.timer is None or obj.GetTimerEventId() != self.timer:
+			return
+		self.timer = None
+		if self.pending is not None:
+			self.apply(render=True)
+
+	def released(self, obj, event):
+		if self.timer is not None:
+			self.interactor.DestroyTimer(self.timer)
+			self.timer = None
+		if self.pending is not None:
+			# the release handler applies the final position
+			self.pending = None
+			self.dropped += 1
+		if self.updates or self.dropped:
+			message = "Live drag: %d updates (%.0f ms each), %d positions dropped" % (
+				self.updates, 1000 * self.busy / max(self.updates, 1), self.dropped)
+			if self.worker is not None:
+				message += ", %d recomputes abandoned" % (self.worker.dropped - self.abandoned)
+			print(message)
+		self.reset()
+
+	def attach(self, interactor):
+		self.interactor = interactor
+		interactor.AddObserver("TimerEvent", self.timed)
+
+
+def live_drag_from_args(args, worker=None):
+	"""Build the live slider updates requested on the command line, or None."""
+	if args.live_drag is None or args.live_drag <= 0:
+		return None
+	return LiveDrag(args.live_drag, worker)
+
+
+def check_live_drag_arguments(parser, args):
+	"""Reject --live-drag when every update would run in full on the UI thread."""
+	if live_drag_from_args(args) is not None and not (args.async_updates or args.progressive):
+		parser.error("--live-drag needs --async-updates or --progressive, which keep the "
+			"recomputes off the UI thread")
+
+
+def add_live_drag_arguments(parser):
+	parser.add_argument('--live-drag', type=float, metavar='hz', nargs='?', const=DEFAULT_LIVE_HZ,
+						help='Update the surfaces while a slider is dragged, at most hz times '
+						'per second (%g when no rate is given)' % DEFAULT_LIVE_HZ)
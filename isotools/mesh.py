@@ -0,0 +1,96 @@
+"""NumPy access to triangle meshes stored as vtkPolyData."""
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+
+def points_array(surface):
+	"""(n, 3) view of the surface points."""
+	if surface.GetPoints() is None:
+		return np.empty((0, 3), dtype=np.float32)
+	return numpy_support.vtk_to_numpy(surface.GetPoints().GetData())
+
+
+def triangles_array(surface):
+	"""(n, 3) point ids of the surface polygons.
+
+	Contours are made of triangles, but vtkClipPolyData leaves a quad where
+	a plane cuts off one corner of a triangle; other polygons are split into
+	a fan of triangles.
+	"""
+	polys = surface.GetPolys()
+	if polys is None or polys.GetNumberOfCells() == 0:
+		return np.empty((0, 3), dtype=np.int64)
+	connectivity = numpy_support.vtk_to_numpy(polys.GetConnectivityArray())
+	offsets = numpy_support.vtk_to_numpy(polys.GetOffsetsArray())
+	sizes = np.diff(offsets)
+	if (sizes == 3).all():
+		return connectivity.reshape(-1, 3)
+	# polygon i with n points gives the triangles (0, k, k + 1) for k in 1 .. n - 2
+	fans = np.maximum(sizes - 2, 0)
+	first = np.repeat(offsets[:-1], fans)
+	k = np.arange(fans.sum()) - np.repeat(np.cumsum(fans) - fans, fans) + 1
+	return np.stack([connectivity[first], connectivity[first + k], connectivity[first + k + 1]], axis=1)
+
+
+def triangle_cells(triangles):
+	"""vtkCellArray holding the (n, 3) triangles."""
+	triangles = np.ascontiguousarray(triangles, dtype=np.int64)
+	offsets = numpy_support.numpy_to_vtk(
+		np.arange(0, 3 * len(triangles) + 1, 3, dtype=np.int64), deep=1,
+		array_type=vtk.VTK_ID_TYPE)
+	connectivity = numpy_support.numpy_to_vtk(triangles.ravel(), deep=1,
+		array_type=vtk.VTK_ID_TYPE)
+	cells = vtk.vtkCellArray()
+	cells.SetData(offsets, connectivity)
+	return cells
+
+
+def with_triangles(surface, triangles):
+	"""Surface sharing the points and point data of surface, with new triangles."""
+	result = vtk.vtkPolyData()
+	result.SetPoints(surface.GetPoints())
+	result.GetPointData().ShallowCopy(surface.GetPointData())
+	result.SetPolys(triangle_cells(triangles))
+	return result
+
+
+def compact(surface, triangles):
+	"""Surface made of the (n, 3) triangles and only the points they use."""
+	used = np.zeros(surface.GetNumberOfPoints(), dtype=bool)
+	used[triangles] = True
+	ids = np.flatnonzero(used)
+	remap = np.cumsum(used) - 1
+	result = vtk.vtkPolyData()
+	points = vtk.vtkPoints()
+	points.SetData(numpy_support.numpy_to_vtk(points_array(surface)[ids], deep=1))
+	result.SetPoints(points)
+	source = surface.GetPointData()
+	target = result.GetPointData()
+	for i in range(source.GetNumberOfArrays()):
+		array = numpy_support.numpy_to_vtk(numpy_support.vtk_to_numpy(source.GetArray(i))[ids], deep=1)
+		array.SetName(source.GetArrayName(i))
+		attribute = source.IsArrayAnAttribute(i)
+		if attribute >= 0:
+			target.SetAttribute(array, attribute)
+		else:
+			target.AddArray(array)
+	result.SetPolys(triangle_cells(remap[triangles]))
+	return result
+
+
+def split_by_value(surface, values, isovalues):
+	"""One surface per isovalue out of a multi-valued contour.
+
+	values holds the contour value of every point of surface, as computed
+	by vtkContourFilter; each triangle goes to the isovalue closest to the
+	value of its first point.
+	"""
+	triangles = triangles_array(surface)
+	if len(triangles) == 0:
+		return [vtk.vtkPolyData() for value in isovalues]
+	unique = np.unique(isovalues)
+	layer = np.abs(values[triangles[:, 0], None] - unique[None, :]).argmin(axis=1)
+	pieces = dict((value, compact(surface, triangles[layer == i])) for i, value in enumerate(unique))
+	return [pieces[value] for value in isovalues]
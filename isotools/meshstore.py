@@ -0,0 +1,176 @@
+"""Extracted isosurfaces kept on disk between sessions.
+
+A MeshStore saves every surface it is given as a .npz file of float32
+points, normals and scalars and int32 triangles, named after a hash of the
+content of the volume, the isovalues and the extraction settings. Starting a
+viewer again on the same scan then reads the surface instead of running
+marching cubes. The files, least recently used first, are deleted whenever
+they take more than the size cap. The store is only used when a directory
+is given with --mesh-cache, as it hashes the whole scan on every start.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from isotools.gradient import file_hash
+from isotools.mesh import points_array, triangle_cells, triangles_array
+
+DEFAULT_MESH_CACHE_MB = 2048
+# bump when the file layout changes, older files are then never read
+MESH_FORMAT = 1
+
+
+def mesh_arrays(surface):
+	"""Triangles, points, normals and scalars of surface as a dict of arrays."""
+	arrays = {'points': points_array(surface).astype(np.float32),
+		'triangles': triangles_array(surface).astype(np.int32)}
+	point_data = surface.GetPointData()
+	if point_data.GetNormals() is not None:
+		arrays['normals'] = numpy_support.vtk_to_numpy(point_data.GetNormals()).astype(np.float32)
+	if point_data.GetScalars() is not None:
+		arrays['scalars'] = numpy_support.vtk_to_numpy(point_data.GetScalars()).astype(np.float32)
+		arrays['scalars_name'] = np.array(point_data.GetScalars().GetName() or "")
+	return arrays
+
+
+def mesh_from_arrays(arrays):
+	"""vtkPolyData built from the arrays of mesh_arrays()."""
+	surface = vtk.vtkPolyData()
+	points = vtk.vtkPoints()
+	points.SetData(numpy_support.numpy_to_vtk(arrays['points'], deep=1))
+	surface.SetPoints(points)
+	surface.SetPolys(triangle_cells(arrays['triangles']))
+	if 'normals' in arrays:
+		normals = numpy_support.numpy_to_vtk(arrays['normals'], deep=1)
+		normals.SetName("Normals")
+		surface.GetPointData().SetNormals(normals)
+	if 'scalars' in arrays:
+		scalars = numpy_support.numpy_to_vtk(arrays['scalars'], deep=1)
+		scalars.SetName(str(arrays['scalars_name']))
+		surface.GetPointData().SetScalars(scalars)
+	return surface
+
+
+def save_mesh(surface, name, compress=False):
+	"""Write the triangles, points, normals and scalars of surface to name."""
+	with open(name, "wb") as f:
+		if compress:
+			np.savez_compressed(f, **mesh_arrays(surface))
+		else:
+			np.savez(f, **mesh_arrays(surface))
+
+
+def load_mesh(name):
+	"""vtkPolyData read back from a file written by save_mesh()."""
+	with np.load(name) as arrays:
+		return mesh_from_arrays(arrays)
+
+
+class MeshStore(object):
+	"""Surfaces of the volume in the file data, cached in directory.
+
+	settings is any JSON serializable description of how the surfaces are
+	extracted; surfaces extracted with other settings are never returned.
+	"""
+
+	def __init__(self, directory, data, settings=None, max_bytes=DEFAULT_MESH_CACHE_MB << 20,
+			compress=False):
+		self.directory = directory
+		self.data_hash = file_hash(data)
+		self.settings = settings
+		self.max_bytes = max_bytes
+		self.compress = compress
+		self.evict()
+
+	def path(self, isovalues):
+		"""File of the surface for an isovalue or a list of isovalues."""
+		values = [float(value) for value in np.atleast_1d(isovalues)]
+		key = json.dumps([MESH_FORMAT, self.data_hash, values, self.settings], sort_keys=True)
+		return os.path.join(self.directory, "mesh-%s.npz" % hashlib.sha1(key.encode()).hexdigest())
+
+	def get(self, isovalues):
+		name = self.path(isovalues)
+		if not os.path.exists(name):
+			return None
+		try:
+			surface = load_mesh(name)
+			# the modification time orders the files for eviction
+			os.utime(name, None)
+			return surface
+		except (IOError, OSError, ValueError, KeyError, zipfile.BadZipfile) as e:
+			print("Dropping unreadable cached surface %s: %s" % (name, e))
+			self.remove(name)
+			return None
+
+	def put(self, isovalues, surface):
+		name = self.path(isovalues)
+		try:
+			if not os.path.isdir(self.directory):
+				os.makedirs(self.directory)
+			# write under a temporary name so that a concurrent launch never reads half a file
+			handle, partial = tempfile.mkstemp(suffix=".npz.part", dir=self.directory)
+			os.close(handle)
+			try:
+				save_mesh(surface, partial, self.compress)
+				os.replace(partial, name)
+			finally:
+				self.remove(partial)
+			self.evict()
+		except (IOError, OSError) as e:
+			print("Surface not cached: %s" % e)
+
+	def fetch(self, isovalues, extract):
+		"""Return the stored surface or build and store it with extract(isovalues)."""
+		surface = self.get(isovalues)
+		if surface is None:
+			surface = extract(isovalues)
+			self.put(isovalues, surface)
+		return surface
+
+	def evict(self):
+		files = []
+		for name in glob.glob(os.path.join(self.directory, "mesh-*.npz")):
+			try:
+				status = os.stat(name)
+			except OSError:
+				continue
+			files.append((status.st_mtime, status.st_size, name))
+		total = sum(size for mtime, size, name in files)
+		for mtime, size, name in sorted(files):
+			if total <= self.max_bytes:
+				break
+			self.remove(name)
+			total -= size
+
+	def remove(self, name):
+		try:
+			os.remove(name)
+		except OSError:
+			pass
+
+
+def store_from_args(args, settings=None):
+	"""Build the mesh store requested on the command line, or None if disabled."""
+	if args.mesh_cache is None or args.mesh_cache_mb <= 0:
+		return None
+	# surfaces of a region of interest, strided or quantized volume are kept apart
+	settings = dict(settings or {}, roi=args.roi, stride=args.stride, narrow=args.narrow)
+	return MeshStore(args.mesh_cache, args.data, settings, args.mesh_cache_mb << 20,
+		args.mesh_cache_compress)
+
+
+def add_mesh_store_arguments(parser):
+	parser.add_argument('--mesh-cache', metavar='dir',
+						help='Keep extracted surfaces between sessions in this directory')
+	parser.add_argument('--mesh-cache-mb', type=int, metavar='int', default=DEFAULT_MESH_CACHE_MB,
+						help='Size cap of the surfaces kept on disk in MB')
+	parser.add_argument('--mesh-cache-compress', action='store_true',
+						help='Compress the surfaces kept on disk, smaller but slower to read')
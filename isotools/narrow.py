@@ -0,0 +1,141 @@
+"""Compact 16 bit storage of the CT and gradient magnitude volumes.
+
+Scans are often written as float32 or float64 even though CT numbers are
+whole Hounsfield units. narrow_image() checks the range and the fractional
+part of the scalars and, when nothing would be lost, stores them as int16 or
+uint16, which vtkContourFilter and vtkProbeFilter process directly.
+
+A gradient magnitude is rarely a whole number, so quantize_image() stores it
+as uint16 steps of a scale kept in the field data of the image. The probe
+runs on the steps and GradientSampler turns the probed values back into
+gradient magnitudes, so the surfaces, sliders and colormaps keep their units.
+"""
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+# field data array holding the (scale, offset) of quantized scalars
+SCALE_ARRAY = "scalars_scale"
+QUANTIZED_LEVELS = 65535
+# values scanned at once, so the checks never copy a whole volume
+CHUNK = 1 << 24
+
+
+def value_range(values):
+	"""Smallest and largest of values and whether they are all whole numbers."""
+	low, high, integral = np.inf, -np.inf, True
+	for start in range(0, len(values), CHUNK):
+		chunk = values[start:start + CHUNK]
+		low = min(low, chunk.min())
+		high = max(high, chunk.max())
+		if integral and values.dtype.kind == 'f':
+			integral = np.array_equal(chunk, np.rint(chunk))
+	return low, high, integral
+
+
+def narrow_type(values):
+	"""Smallest 16 bit integer type holding all of values exactly, or None."""
+	if values.dtype.itemsize <= 2 or len(values) == 0:
+		return None
+	low, high, integral = value_range(values)
+	if not integral:
+		return None
+	for dtype in (np.int16, np.uint16):
+		if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+			return dtype
+	return None
+
+
+def with_scalars(image, values, name):
+	"""Image with the structure of image and values as its only point array."""
+	result = vtk.vtkImageData()
+	result.CopyStructure(image)
+	array = numpy_support.numpy_to_vtk(values, deep=0)
+	array.SetName(name)
+	result.GetPointData().SetScalars(array)
+	# VTK does not own the buffer
+	result.numpy_array = values
+	return result
+
+
+def narrow_image(image):
+	"""image with its scalars losslessly stored in 16 bits, or None if they don't fit."""
+	scalars = image.GetPointData().GetScalars()
+	values = numpy_support.vtk_to_numpy(scalars).ravel()
+	dtype = narrow_type(values)
+	if dtype is None:
+		return None
+	return with_scalars(image, values.astype(dtype), scalars.GetName())
+
+
+def quantize_image(image, levels=QUANTIZED_LEVELS):
+	"""image with its scalars rounded to uint16 steps; scalar_scale() gives the steps back.
+
+	Scalars that fit in 16 bits are kept exactly instead; None is returned
+	when they already take 16 bits or less.
+	"""
+	scalars = image.GetPointData().GetScalars()
+	values = numpy_support.vtk_to_numpy(scalars).ravel()
+	if values.dtype.itemsize <= 2 or len(values) == 0:
+		return None
+	narrowed = narrow_image(image)
+	if narrowed is not None:
+		return narrowed
+	low, high, integral = value_range(values)
+	scale = (high - low) / float(levels) if high > low else 1.0
+	steps = np.empty(len(values), dtype=np.uint16)
+	for start in range(0, len(values), CHUNK):
+		chunk = values[start:start + CHUNK]
+		steps[start:start + CHUNK] = np.rint((chunk - low) / scale)
+	result = with_scalars(image, steps, scalars.GetName())
+	recorded = vtk.vtkDoubleArray()
+	recorded.SetName(SCALE_ARRAY)
+	recorded.SetNumberOfComponents(2)
+	recorded.InsertNextTuple2(scale, low)
+	result.GetFieldData().AddArray(recorded)
+	return result
+
+
+def scalar_scale(image):
+	"""(scale, offset) turning the scalars of image back into their values."""
+	recorded = image.GetFieldData().GetArray(SCALE_ARRAY)
+	if recorded is None:
+		return 1.0, 0.0
+	return recorded.GetTuple2(0)
+
+
+def restore_values(values, scale):
+	"""Quantized values, as float32, in the units of the original volume."""
+	if scale == (1.0, 0.0):
+		return values
+	return (values * scale[0] + scale[1]).astype(np.float32)
+
+
+def scalar_range(image):
+	"""Range of the scalars of image in the units of the original volume."""
+	scale = scalar_scale(image)
+	return tuple(value * scale[0] + scale[1] for value in image.GetScalarRange())
+
+
+def narrow_volume(source, quantize=False, name="volume"):
+	"""Algorithm producing the narrowed, or quantized, output of source.
+
+	source itself is returned when its scalars are already 16 bits or less,
+	or can't be narrowed losslessly.
+	"""
+	image = source.GetOutput()
+	before = image.GetPointData().GetScalars().GetDataTypeAsString()
+	narrowed = quantize_image(image) if quantize else narrow_image(image)
+	if narrowed is None:
+		if image.GetPointData().GetScalars().GetDataTypeSize() > 2:
+			print("%s kept as %s, its values are not whole numbers within 16 bits" % (name, before))
+		return source
+	after = narrowed.GetPointData().GetScalars().GetDataTypeAsString()
+	if narrowed.GetFieldData().GetArray(SCALE_ARRAY) is not None:
+		after += " steps of %g" % scalar_scale(narrowed)[0]
+	print("%s stored as %s instead of %s" % (name, after, before))
+	producer = vtk.vtkPassThrough()
+	producer.SetInputData(narrowed)
+	producer.Update()
+	return producer
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""Synthetic CT volumes for trying out and benchmarking the viewers.
+
+Every phantom is a (z, y, x) int16 volume in the value range of the scans
+the viewers were written for, so their default isovalues and colormaps
+apply. Volumes are built a few slices at a time to keep the memory use of
+512^3 volumes close to the size of the result.
+
+	python -m isotools.phantom ct 256 ct.vti gm.vti
+"""
+
+import argparse
+
+import numpy as np
+
+from isotools.gradient import gradient_magnitude
+from isotools.rawvolume import write_volume
+from isotools.volume import image_from_array
+
+# slices generated at once
+CHUNK = 16
+NOISE_SIGMA = 40
+# (center, radii, value) in units of the half size of the volume, painted in order
+CT_ELLIPSOIDS = [
+	((0, 0, 0), (0.72, 0.9, 0.85), 600),		# skin and fat
+	((0, 0, 0), (0.68, 0.86, 0.81), 1319),		# skull
+	((0, 0, 0.02), (0.62, 0.8, 0.75), 1040),	# brain
+	((0.22, 0, 0.1), (0.08, 0.28, 0.1), 1000),	# ventricles
+	((-0.22, 0, 0.1), (0.08, 0.28, 0.1), 1000),
+	((0, 0.35, -0.2), (0.12, 0.1, 0.12), 1153),	# denser lesions
+	((0.3, -0.4, -0.1), (0.06, 0.06, 0.06), 1153),
+	((-0.25, -0.3, 0.3), (0.1, 0.05, 0.08), 753),
+]
+SPHERE_SHELLS = [(0.9, 600), (0.7, 1100), (0.4, 1400)]
+
+
+def ellipsoids(size, shapes, chunk=CHUNK):
+	"""int16 volume of the (center, radii, value) ellipsoids, later ones on top."""
+	volume = np.zeros((size, size, size), dtype=np.int16)
+	half = (size - 1) / 2.0
+	axis = (np.arange(size, dtype=np.float32) - half) / half
+	y = axis[None, :, None]
+	x = axis[None, None, :]
+	for start in range(0, size, chunk):
+		z = axis[start:start + chunk, None, None]
+		block = volume[start:start + chunk]
+		for center, radii, value in shapes:
+			inside = (((x - center[0]) / radii[0]) ** 2 + ((y - center[1]) / radii[1]) ** 2
+				+ ((z - center[2]) / radii[2]) ** 2) <= 1
+			block[inside] = value
+	return volume
+
+
+def add_noise(volume, sigma=NOISE_SIGMA, seed=0, chunk=CHUNK):
+	random = np.random.RandomState(seed)
+	for start in range(0, volume.shape[0], chunk):
+		block = volume[start:start + chunk]
+		noisy = block + random.normal(0, sigma, block.shape)
+		block[...] = np.clip(noisy, np.iinfo(np.int16).min, np.iinfo(np.int16).max)
+	return volume
+
+
+def spheres(size):
+	"""Nested spherical shells, a clean surface for every default isovalue."""
+	return ellipsoids(size, [((0, 0, 0), (r, r, r), value) for r, value in SPHERE_SHELLS])
+
+
+def noisy_spheres(size):
+	"""spheres() with Gaussian noise, a worst case for the contour size."""
+	return add_noise(spheres(size))
+
+
+def ct(size):
+	"""Head-like phantom: skin, skull, brain, ventricles and a few lesions."""
+	return add_noise(ellipsoids(size, CT_ELLIPSOIDS), sigma=NOISE_SIGMA / 4)
+
+
+PHANTOMS = {
+	'spheres': spheres,
+	'noise': noisy_spheres,
+	'ct': ct,
+}
+# an isovalue cutting through the structures of each phantom
+ISOVALUES = {'spheres': 1040, 'noise': 1040, 'ct': 1100}
+
+
+def phantom_image(name, size):
+	"""vtkImageData with the named phantom, unit spacing at the origin."""
+	return image_from_array(PHANTOMS[name](size))
+
+
+def write_phantom(name, size, data, gradmag=None):
+	"""Write the phantom, and its gradient magnitude, as mappable .vti files."""
+	image = phantom_image(name, size)
+	write_volume(image, data)
+	if gradmag is not None:
+		write_volume(gradient_magnitude(image), gradmag)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Writes a synthetic CT volume.")
+	parser.add_argument('phantom', choices=sorted(PHANTOMS), help='Kind of volume')
+	parser.add_argument('size', type=int, help='Points along each axis')
+	parser.add_argument('data', help='Output .vti file')
+	parser.add_argument('gradmag', nargs='?', help='Output .vti file for the gradient magnitude')
+	args = parser.parse_args()
+
+	write_phantom(args.phantom, args.size, args.data, args.gradmag)
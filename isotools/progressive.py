@@ -0,0 +1,87 @@
+"""Coarse previews while a slider is being dragged.
+
+Strided copies of the CT volume (2x and 4x by default) are kept next to the
+full resolution one. While a slider moves, the viewers show the isosurface
+of the finest copy that fits the frame budget, and refine to full
+resolution once the slider is released.
+"""
+
+import time
+
+from isotools.clipbox import CroppedContour
+from isotools.gradient import GradientSampler, gradient_window
+from isotools.volume import image_from_array, scalars_array
+
+DEFAULT_STRIDES = (2, 4)
+DEFAULT_PREVIEW_FPS = 15
+
+
+def downsample(image, stride):
+	"""Copy of image keeping every stride-th voxel along each axis."""
+	volume = scalars_array(image)[::stride, ::stride, ::stride]
+	spacing = [s * stride for s in image.GetSpacing()]
+	return image_from_array(volume, image.GetOrigin(), spacing)
+
+
+class ProgressivePreview(object):
+	"""Isosurfaces of strided copies of image, picked to fit a frame budget.
+
+	gradient, when given, is the gradient magnitude image sampled at the
+	preview surface, so it can be colored and windowed like the
+	full resolution one.
+	"""
+
+	def __init__(self, image, strides=DEFAULT_STRIDES, fps=DEFAULT_PREVIEW_FPS, gradient=None):
+		self.budget = 1.0 / fps
+		self.levels = [(stride, CroppedContour(downsample(image, stride)))
+			for stride in sorted(strides)]
+		self.timings = {}
+		self.sampler = None
+		if gradient is not None:
+			self.sampler = GradientSampler(gradient)
+
+	def estimate(self, stride):
+		"""Expected time of a preview at stride, from the closest measured level."""
+		if stride in self.timings:
+			return self.timings[stride]
+		measured = [(abs(s - stride), s) for s in self.timings]
+		if not measured:
+			return None
+		other = min(measured)[1]
+		# the surface, and the work, shrinks with the square of the stride
+		return self.timings[other] * (float(other) / stride) ** 2
+
+	def stride(self):
+		"""Finest stride expected to fit the frame budget."""
+		for stride, cropper in self.levels:
+			expected = self.estimate(stride)
+			if expected is not None and expected <= self.budget:
+				return stride
+		return self.levels[-1][0]
+
+	def extract(self, isovalues, lower, gradient_range=None):
+		"""Coarse surface clipped to lower, probed and windowed if requested."""
+		stride = self.stride()
+		cropper = dict(self.levels)[stride]
+		start = time.time()
+		surface = cropper.extract(isovalues, lower)
+		if self.sampler is not None:
+			surface = self.sampler.attach(surface)
+			if gradient_range is not None:
+				surface = gradient_window(surface, gradient_range[0], gradient_range[1])
+		self.timings[stride] = time.time() - start
+		return surface
+
+
+def preview_from_args(args, image, gradient=None):
+	"""Build the drag preview requested on the command line."""
+	if not args.progressive:
+		return None
+	return ProgressivePreview(image, fps=args.preview_fps, gradient=gradient)
+
+
+def add_progressive_arguments(parser):
+	parser.add_argument('--progressive', action='store_true',
+						help='Show a coarse preview while dragging a slider and refine on release')
+	parser.add_argument('--preview-fps', type=float, metavar='float', default=DEFAULT_PREVIEW_FPS,
+						help='Frame rate the drag preview aims for')
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""Zero-copy loading of uncompressed .vti volumes.
+
+A .vti written in appended, raw, uncompressed mode stores each array as a
+plain block of voxels. Those blocks are memory-mapped with NumPy and handed
+to VTK as the image scalars without copying, so startup only reads the XML
+header and the OS page cache is shared by every process viewing the scan.
+Other files fall back to vtkXMLImageDataReader.
+
+Convert a volume once with
+
+	python -m isotools.rawvolume ct.vti ct_raw.vti
+"""
+
+import argparse
+import os
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from isotools.narrow import narrow_volume
+
+# how far into the file the XML header is searched for
+HEADER_LIMIT = 1 << 20
+VTK_TYPES = {
+	'Int8': 'i1', 'UInt8': 'u1', 'Int16': 'i2', 'UInt16': 'u2',
+	'Int32': 'i4', 'UInt32': 'u4', 'Int64': 'i8', 'UInt64': 'u8',
+	'Float32': 'f4', 'Float64': 'f8',
+}
+
+
+def read_header(name):
+	"""Parsed XML header of name and the file offset of its appended data.
+
+	Returns None when the file is not an uncompressed raw appended .vti.
+	"""
+	with open(name, "rb") as f:
+		head = f.read(HEADER_LIMIT)
+	start = head.find(b"<AppendedData")
+	if start < 0:
+		return None
+	marker = head.find(b"_", head.find(b">", start))
+	if marker < 0 or b'encoding="raw"' not in head[start:marker]:
+		return None
+	try:
+		root = ElementTree.fromstring(head[:start] + b"</VTKFile>")
+	except ElementTree.ParseError:
+		return None
+	if root.get("type") != "ImageData" or root.get("compressor"):
+		return None
+	return root, marker + 1
+
+
+def map_volume(name):
+	"""vtkImageData whose point arrays are memory-maps of name, or None."""
+	header = read_header(name)
+	if header is None:
+		return None
+	root, data_start = header
+	pieces = root.findall("ImageData/Piece")
+	if len(pieces) != 1:
+		return None
+	order = "<" if root.get("byte_order", "LittleEndian") == "LittleEndian" else ">"
+	if (order == "<") != np.little_endian:
+		# VTK arrays are always in the machine byte order
+		return None
+	size_type = np.dtype(order + ("u8" if root.get("header_type") == "UInt64" else "u4"))
+
+	image_node = root.find("ImageData")
+	extent = [int(v) for v in pieces[0].get("Extent").split()]
+	image = vtk.vtkImageData()
+	image.SetExtent(extent)
+	image.SetOrigin([float(v) for v in image_node.get("Origin", "0 0 0").split()])
+	image.SetSpacing([float(v) for v in image_node.get("Spacing", "1 1 1").split()])
+	points = (extent[1] - extent[0] + 1) * (extent[3] - extent[2] + 1) * (extent[5] - extent[4] + 1)
+
+	point_data = pieces[0].find("PointData")
+	if point_data is None:
+		return None
+	image.numpy_arrays = []
+	for node in point_data.findall("DataArray"):
+		if node.get("format") != "appended" or node.get("type") not in VTK_TYPES:
+			return None
+		components = int(node.get("NumberOfComponents", "1"))
+		dtype = np.dtype(order + VTK_TYPES[node.get("type")])
+		offset = data_start + int(node.get("offset")) + size_type.itemsize
+		# copy-on-write keeps the mapping writable for VTK while sharing the pages
+		values = np.memmap(name, dtype=dtype, mode="c", offset=offset,
+			shape=(points * components,))
+		array = numpy_support.numpy_to_vtk(values, deep=0)
+		array.SetNumberOfComponents(components)
+		array.SetName(node.get("Name"))
+		image.GetPointData().AddArray(array)
+		image.numpy_arrays.append(values)
+
+	scalars = point_data.get("Scalars") or point_data.find("DataArray").get("Name")
+	image.GetPointData().SetActiveScalars(scalars)
+	return image
+
+
+def open_volume(name, update=True, roi=None, stride=1):
+	"""Updated algorithm whose output is the volume in name.
+
+	Uncompressed raw appended files are memory-mapped, anything else is read
+	with vtkXMLImageDataReader. Either way the result can be used like the
+	reader, through GetOutputPort() or GetOutput(). Without update the
+	reader only reads the header, for filters that request part of the
+	volume.
+
+	roi (x0, x1, y0, y1, z0, z1) is a point extent to keep and stride keeps
+	the points whose indices in the file are multiples of stride, the last
+	such point of every axis included. Only that part of the file is read;
+	the output extent starts at 0 and its origin and spacing keep the world
+	coordinates of the kept points. The roi is clamped to the extent of the
+	file, and a roi outside it or holding no multiple of stride raises
+	ValueError.
+	"""
+	image = map_volume(name)
+	if image is None:
+		source = vtk.vtkXMLImageDataReader()
+		source.SetFileName(name)
+	else:
+		source = vtk.vtkPassThrough()
+		source.SetInputData(image)
+		source.image = image
+
+	# every stage keeps the one before alive, the mapped arrays hang off the first
+	if roi is not None:
+		source.UpdateInformation()
+		whole = source.GetOutputInformation(0).Get(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT())
+		if any(roi[2 * i] > whole[2 * i + 1] or roi[2 * i + 1] < whole[2 * i] for i in range(3)):
+			raise ValueError("ROI %s lies outside the extent %s of %s" % (
+				" ".join(str(v) for v in roi), " ".join(str(v) for v in whole), name))
+		roi = [min(max(roi[i], whole[i - i % 2]), whole[i - i % 2 + 1]) for i in range(6)]
+		voi = vtk.vtkExtractVOI()
+		voi.SetInputConnection(source.GetOutputPort())
+		voi.SetVOI(roi)
+		voi.source = source
+		source = voi
+	if stride > 1:
+		source.UpdateInformation()
+		whole = source.GetOutputInformation(0).Get(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT())
+		if any(whole[2 * i] + (-whole[2 * i]) % stride > whole[2 * i + 1] for i in range(3)):
+			raise ValueError("no point index of %s is a multiple of %d in the extent %s" % (
+				name, stride, " ".join(str(v) for v in whole)))
+		# the shrink only keeps the samples with a whole block of points after them,
+		# the padding completes the block of the last one and is never sampled
+		pad = vtk.vtkImageConstantPad()
+		pad.SetInputConnection(source.GetOutputPort())
+		pad.SetOutputWholeExtent([v + (stride - 1) * (i % 2) for i, v in enumerate(whole)])
+		pad.source = source
+		source = pad
+		# unlike the sample rate of vtkExtractVOI, the shrink streams sub-extents correctly
+		shrink = vtk.vtkImageShrink3D()
+		shrink.SetInputConnection(source.GetOutputPort())
+		shrink.SetShrinkFactors(stride, stride, stride)
+		shrink.AveragingOff()
+		shrink.source = source
+		source = shrink
+	if roi is not None or stride > 1:
+		source.UpdateInformation()
+		information = source.GetOutputInformation(0)
+		extent = information.Get(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT())
+		spacing = information.Get(vtk.vtkDataObject.SPACING())
+		start = vtk.vtkImageChangeInformation()
+		start.SetInputConnection(source.GetOutputPort())
+		start.SetOutputExtentStart(0, 0, 0)
+		start.SetOriginTranslation([extent[2 * i] * spacing[i] for i in range(3)])
+		start.source = source
+		source = start
+
+	if update:
+		source.Update()
+	else:
+		source.UpdateInformation()
+	return source
+
+
+def volume_bounds(algorithm):
+	"""World bounds (x0, x1, y0, y1, z0, z1) of the volume algorithm produces.
+
+	Only the pipeline information is used, so the volume needs no update.
+	"""
+	algorithm.UpdateInformation()
+	information = algorithm.GetOutputInformation(0)
+	extent = information.Get(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT())
+	origin = information.Get(vtk.vtkDataObject.ORIGIN())
+	spacing = information.Get(vtk.vtkDataObject.SPACING())
+	return [origin[i // 2] + extent[i] * spacing[i // 2] for i in range(6)]
+
+
+def volume_key(roi=None, stride=1):
+	"""Suffix telling apart the cache entries of the parts of a volume."""
+	key = ""
+	if roi is not None:
+		key += "-roi" + ".".join(str(v) for v in roi)
+	if stride > 1:
+		key += "-s%d" % stride
+	return key
+
+
+def volume_from_args(args, name, update=True, quantize=False):
+	"""open_volume() with the region of interest, stride and narrowing of the command line.
+
+	quantize stores the scalars as uint16 steps, for gradient magnitudes,
+	where CT numbers are only narrowed losslessly. A volume opened without
+	update is read in parts and never narrowed.
+	"""
+	source = open_volume(name, update, args.roi, args.stride)
+	if update and args.narrow:
+		source = narrow_volume(source, quantize, os.path.basename(name))
+	return source
+
+
+def check_volume_arguments(parser, args):
+	"""Reject a region of interest without points and strides below 1."""
+	if args.roi is not None and any(args.roi[2 * i] > args.roi[2 * i + 1] for i in range(3)):
+		parser.error("--roi needs x0 <= x1, y0 <= y1 and z0 <= z1")
+	if args.stride < 1:
+		parser.error("--stride must be at least 1")
+
+
+def add_volume_arguments(parser):
+	parser.add_argument('--roi', type=int, nargs=6, metavar='int',
+						help='Only load the points x0 x1 y0 y1 z0 z1 (inclusive voxel indices)')
+	parser.add_argument('--stride', type=int, metavar='int', default=1,
+						help='Only load every stride-th point along each axis')
+	parser.add_argument('--narrow', action='store_true',
+						help='Keep whole valued CT numbers as 16 bit integers and the gradient '
+						'magnitude as 16 bit steps')
+
+
+def write_volume(image, target):
+	"""Write image as an uncompressed raw appended .vti that can be mapped."""
+	writer = vtk.vtkXMLImageDataWriter()
+	writer.SetInputData(image)
+	writer.SetFileName(target)
+	writer.SetDataModeToAppended()
+	writer.EncodeAppendedDataOff()
+	writer.SetCompressorTypeToNone()
+	writer.SetHeaderTypeToUInt64()
+	if not writer.Write():
+		raise IOError("Can't write %s" % target)
+
+
+def convert_volume(source, target):
+	"""Rewrite source as an uncompressed raw appended .vti that can be mapped."""
+	reader = vtk.vtkXMLImageDataReader()
+	reader.SetFileName(source)
+	reader.Update()
+	write_volume(reader.GetOutput(), target)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description="Converts a .vti volume to the uncompressed layout that can be memory-mapped.")
+	parser.add_argument('source', help='Input .vti file')
+	parser.add_argument('target', help='Output .vti file')
+	args = parser.parse_args()
+
+	convert_volume(args.source, args.target)
@@ -0,0 +1,506 @@
+"""Volumes loaded once and shared by every viewer.
+
+	python -m isotools.service
+
+starts a daemon that keeps the CT and gradient magnitude volumes in memory
+and answers contour, crop and probe requests on a Unix socket, or on a
+loopback port given as host:port. A viewer started with --daemon sends the
+names and load options of its files instead of reading them and gets the
+surfaces back as binary meshes, so it starts without loading the scan and
+all the viewers share the copy the daemon holds.
+
+The daemon opens any file a request names, so it only answers the user who
+started it: it writes a random token to a file only that user can read and
+drops the connections whose requests do not carry it. The Unix socket is
+only accessible to that user too, and TCP ports are only opened on
+loopback addresses.
+
+Every message is a line of JSON followed by an .npz payload whose length
+the header gives in 'bytes', up to DEFAULT_MESSAGE_MB. At most jobs
+requests are computed at a time and up to queue more wait for their turn;
+the daemon turns down any request beyond that as busy. Whole, uncropped
+surfaces are kept as their encoded payload, so a viewer opening a scan
+another one showed gets it at once.
+"""
+
+import argparse
+import collections
+import hmac
+import io
+import ipaddress
+import json
+import os
+import secrets
+import socket
+import socketserver
+import threading
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from isotools.clipbox import CroppedContour
+from isotools.gradient import (DEFAULT_CACHE_DIR, GradientSampler, add_gradient_arguments,
+	gradient_from_args)
+from isotools.mesh import points_array
+from isotools.meshstore import mesh_arrays, mesh_from_arrays
+from isotools.narrow import scalar_range
+from isotools.rawvolume import volume_bounds, volume_from_args
+
+DEFAULT_ADDRESS = os.path.join(DEFAULT_CACHE_DIR, "volumes.sock")
+DEFAULT_JOBS = 2
+DEFAULT_QUEUE = 16
+DEFAULT_MAX_VOLUMES = 4
+DEFAULT_SURFACE_MB = 1024
+DEFAULT_MESSAGE_MB = 1024
+# longest JSON header line accepted
+HEADER_LIMIT = 1 << 16
+# payloads are read in chunks, so a header lying about its size costs nothing
+CHUNK_BYTES = 1 << 20
+
+
+class ServiceError(Exception):
+	"""A request the volume daemon could not answer."""
+
+
+def pack_arrays(arrays):
+	buffer = io.BytesIO()
+	np.savez(buffer, **arrays)
+	return buffer.getvalue()
+
+
+def unpack_arrays(payload):
+	with np.load(io.BytesIO(payload)) as arrays:
+		return dict((name, arrays[name]) for name in arrays.files)
+
+
+def send_message(f, header, payload=b""):
+	f.write(json.dumps(dict(header, bytes=len(payload))).encode() + b"\n")
+	f.write(payload)
+	f.flush()
+
+
+def receive_message(f, max_bytes=DEFAULT_MESSAGE_MB << 20):
+	"""(header, payload) of the next message in f, (None, None) once it is closed.
+
+	Raises ServiceError on a malformed header or a payload over max_bytes.
+	"""
+	line = f.readline(HEADER_LIMIT)
+	if not line:
+		return None, None
+	if not line.endswith(b"\n"):
+		raise ServiceError("message header longer than %d bytes" % HEADER_LIMIT)
+	try:
+		header = json.loads(line.decode())
+		size = int(header.pop('bytes', 0))
+	except (ValueError, TypeError, AttributeError) as e:
+		raise ServiceError("malformed message header (%s)" % e)
+	if not 0 <= size <= max_bytes:
+		raise ServiceError("message of %d bytes, at most %d are accepted" % (size, max_bytes))
+	chunks = []
+	while size > 0:
+		chunk = f.read(min(size, CHUNK_BYTES))
+		if not chunk:
+			raise ServiceError("connection closed in the middle of a message")
+		chunks.append(chunk)
+		size -= len(chunk)
+	return header, b"".join(chunks)
+
+
+def parse_address(address):
+	"""Socket family and address of a Unix socket path or a loopback host:port pair.
+
+	Raises ValueError for a host that is not a loopback address.
+	"""
+	host, colon, port = address.rpartition(":")
+	if colon and port.isdigit() and os.sep not in address:
+		host = host.strip("[]") or "127.0.0.1"
+		try:
+			resolved = ipaddress.ip_address(socket.gethostbyname(host))
+		except (socket.error, ValueError):
+			resolved = None
+		if resolved is None or not resolved.is_loopback:
+			raise ValueError("the volume daemon only runs on loopback addresses, not %s" % host)
+		return socket.AF_INET, (host, int(port))
+	return socket.AF_UNIX, address
+
+
+def token_path(address):
+	"""File holding the token of the daemon on address."""
+	family, location = parse_address(address)
+	if family == socket.AF_UNIX:
+		return location + ".token"
+	# every loopback name of the port finds the same file
+	return os.path.join(DEFAULT_CACHE_DIR, "volumes-%d.token" % location[1])
+
+
+def write_token(address):
+	"""New random token of the daemon on address, saved where only this user can read it."""
+	path = token_path(address)
+	directory = os.path.dirname(path)
+	if directory and not os.path.isdir(directory):
+		os.makedirs(directory, 0o700)
+	token = secrets.token_hex(16)
+	handle = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+	with os.fdopen(handle, "w") as f:
+		# an older file may have been created with wider permissions
+		os.fchmod(f.fileno(), 0o600)
+		f.write(token)
+	return token
+
+
+def read_token(address):
+	with open(token_path(address)) as f:
+		return f.read().strip()
+
+
+def contour(image, isovalues, lower=None):
+	"""Isosurface of image for isovalues, cropped to x, y, z >= lower if given."""
+	if lower is not None:
+		return CroppedContour(image).extract(isovalues, lower)
+	contour = vtk.vtkContourFilter()
+	contour.SetInputData(image)
+	contour.ComputeNormalsOn()
+	contour.ComputeScalarsOn()
+	contour.SetNumberOfContours(len(isovalues))
+	for i, value in enumerate(isovalues):
+		contour.SetValue(i, value)
+	contour.Update()
+	return contour.GetOutput()
+
+
+def probe_points(image, points):
+	"""Values of image at an (n, 3) array of points."""
+	vtk_points = vtk.vtkPoints()
+	vtk_points.SetData(numpy_support.numpy_to_vtk(points, deep=1))
+	piece = vtk.vtkPolyData()
+	piece.SetPoints(vtk_points)
+	scalars = GradientSampler(image).attach(piece).GetPointData().GetScalars()
+	return numpy_support.vtk_to_numpy(scalars)
+
+
+class SharedVolume(object):
+	"""CT volume of a viewer request, and its gradient magnitude once asked for.
+
+	spec holds the file names and the roi, stride and narrow load options.
+	"""
+
+	def __init__(self, spec, gradient_cache=DEFAULT_CACHE_DIR):
+		self.options = argparse.Namespace(data=spec['data'], roi=spec['roi'], stride=spec['stride'],
+			narrow=spec['narrow'], gradient_cache=gradient_cache)
+		self.gradmag = spec['gradmag']
+		for name in (spec['data'], spec['gradmag']):
+			if name is not None and not os.path.exists(name):
+				raise IOError("%s does not exist on the daemon side" % name)
+		self.ct = volume_from_args(self.options, spec['data'])
+		self.bounds = volume_bounds(self.ct)
+		self.gradient = None
+		self.lock = threading.Lock()
+
+	def image(self):
+		"""CT image of its own sharing the voxels, for the filters of one request."""
+		image = vtk.vtkImageData()
+		image.ShallowCopy(self.ct.GetOutput())
+		return image
+
+	def gradient_image(self):
+		with self.lock:
+			if self.gradient is None:
+				self.gradient = gradient_from_args(self.options, self.gradmag, self.ct)
+		image = vtk.vtkImageData()
+		image.ShallowCopy(self.gradient.GetOutput())
+		return image
+
+
+class VolumeService(object):
+	"""Answers the viewer requests from the volumes it holds.
+
+	Up to max_volumes volumes and max_bytes of encoded surfaces are kept,
+	the least recently used first dropped.
+	"""
+
+	def __init__(self, gradient_cache=DEFAULT_CACHE_DIR, jobs=DEFAULT_JOBS, queue=DEFAULT_QUEUE,
+			max_volumes=DEFAULT_MAX_VOLUMES, max_bytes=DEFAULT_SURFACE_MB << 20):
+		self.gradient_cache = gradient_cache
+		self.jobs = max(1, jobs)
+		self.queue = queue
+		self.max_volumes = max(1, max_volumes)
+		self.max_bytes = max_bytes
+		self.slots = threading.BoundedSemaphore(self.jobs)
+		self.lock = threading.Lock()
+		self.pending = 0
+		self.volumes = collections.OrderedDict()
+		self.loading = {}
+		self.surfaces = collections.OrderedDict()
+		self.surface_bytes = 0
+
+	def volume(self, key, spec):
+		with self.lock:
+			if key in self.volumes:
+				self.volumes.move_to_end(key)
+				return self.volumes[key]
+			loading = self.loading.setdefault(key, threading.Lock())
+		# a volume asked for by several viewers at once is loaded once
+		with loading:
+			with self.lock:
+				if key in self.volumes:
+					return self.volumes[key]
+			try:
+				volume = SharedVolume(spec, self.gradient_cache)
+				with self.lock:
+					self.volumes[key] = volume
+					while len(self.volumes) > self.max_volumes:
+						self.volumes.popitem(last=False)
+			finally:
+				# a volume that failed to load is tried again by the next request
+				with self.lock:
+					self.loading.pop(key, None)
+		return volume
+
+	def answer(self, request, payload):
+		"""(header, payload) of the reply to a request."""
+		with self.lock:
+			if self.pending >= self.jobs + self.queue:
+				return {'error': "busy, %d requests are waiting" % self.queue}, b""
+			self.pending += 1
+		try:
+			with self.slots:
+				return self.run(request, payload)
+		finally:
+			with self.lock:
+				self.pending -= 1
+
+	def cached(self, key):
+		with self.lock:
+			if key not in self.surfaces:
+				return None
+			self.surfaces.move_to_end(key)
+			return self.surfaces[key]
+
+	def keep(self, key, payload):
+		if len(payload) > self.max_bytes:
+			return
+		with self.lock:
+			if key not in self.surfaces:
+				self.surfaces[key] = payload
+				self.surface_bytes += len(payload)
+			while self.surface_bytes > self.max_bytes:
+				self.surface_bytes -= len(self.surfaces.popitem(last=False)[1])
+
+	def run(self, request, payload):
+		operation = request.get('op')
+		key = json.dumps(request['volume'], sort_keys=True)
+		volume = self.volume(key, request['volume'])
+		if operation == 'info':
+			reply = {'bounds': volume.bounds}
+			if request.get('gradient'):
+				reply['gradient_range'] = scalar_range(volume.gradient_image())
+			return reply, b""
+		if operation == 'surface':
+			lower = request.get('lower')
+			# cropped surfaces depend on the clip box and are not worth keeping
+			key = None if lower is not None else (key, tuple(request['isovalues']))
+			reply = None if key is None else self.cached(key)
+			if reply is None:
+				reply = pack_arrays(mesh_arrays(contour(volume.image(), request['isovalues'], lower)))
+				if key is not None:
+					self.keep(key, reply)
+			return {}, reply
+		if operation == 'probe':
+			points = unpack_arrays(payload)['points']
+			return {}, pack_arrays({'values': probe_points(volume.gradient_image(), points)})
+		raise ValueError("unknown request %r" % operation)
+
+
+class ServiceHandler(socketserver.StreamRequestHandler):
+	"""Answers the requests of one viewer connection in turn."""
+
+	def handle(self):
+		while True:
+			try:
+				request, payload = receive_message(self.rfile)
+			except ServiceError as e:
+				# the stream is out of step, drop the connection
+				send_message(self.wfile, {'error': str(e)})
+				return
+			if request is None:
+				return
+			if not hmac.compare_digest(str(request.pop('token', '')), self.server.token):
+				send_message(self.wfile, {'error': "wrong or missing token"})
+				return
+			try:
+				header, reply = self.server.service.answer(request, payload)
+			except Exception as e:
+				header, reply = {'error': "%s: %s" % (type(e).__name__, e)}, b""
+			send_message(self.wfile, header, reply)
+
+
+def listening(path):
+	"""Whether something accepts connections on the Unix socket path."""
+	probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		probe.connect(path)
+		return True
+	except (IOError, OSError):
+		return False
+	finally:
+		probe.close()
+
+
+def listen(service, address=DEFAULT_ADDRESS):
+	"""Server answering the requests sent to address with service, its new token in server.token."""
+	family, location = parse_address(address)
+	if family == socket.AF_UNIX:
+		directory = os.path.dirname(location)
+		if directory and not os.path.isdir(directory):
+			os.makedirs(directory)
+		if os.path.exists(location):
+			if listening(location):
+				raise IOError("A volume daemon already listens on %s" % location)
+			# left behind by a daemon that did not shut down
+			os.remove(location)
+		server = socketserver.ThreadingUnixStreamServer(location, ServiceHandler)
+		os.chmod(location, 0o600)
+	else:
+		server = socketserver.ThreadingTCPServer(location, ServiceHandler)
+	server.daemon_threads = True
+	server.service = service
+	server.token = write_token(address)
+	return server
+
+
+def serve(service, address=DEFAULT_ADDRESS):
+	"""Answer the requests sent to address with service until interrupted."""
+	family, location = parse_address(address)
+	server = listen(service, address)
+	print("Serving volumes on %s" % address)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		for path in (token_path(address), location if family == socket.AF_UNIX else None):
+			if path is not None and os.path.exists(path):
+				os.remove(path)
+
+
+class RemoteVolume(object):
+	"""Volume held by the daemon, seen from a viewer.
+
+	extract() stands in for the contour and crop stages of the viewers and
+	attach() for their GradientSampler. contour and probe are None, as no
+	local filter runs.
+	"""
+
+	def __init__(self, address, spec):
+		family, location = parse_address(address)
+		self.token = read_token(address)
+		self.socket = socket.socket(family, socket.SOCK_STREAM)
+		try:
+			self.socket.connect(location)
+		except (IOError, OSError):
+			self.socket.close()
+			raise
+		self.reader = self.socket.makefile("rb")
+		self.writer = self.socket.makefile("wb")
+		self.spec = spec
+		self.contour = None
+		self.probe = None
+		# the background worker and the layer threads share the connection
+		self.lock = threading.Lock()
+
+	def request(self, header, payload=b""):
+		with self.lock:
+			send_message(self.writer, dict(header, volume=self.spec, token=self.token), payload)
+			reply, payload = receive_message(self.reader)
+		if reply is None:
+			raise ServiceError("the volume daemon closed the connection")
+		if 'error' in reply:
+			raise ServiceError(reply['error'])
+		return reply, payload
+
+	def info(self, gradient=False):
+		"""Bounds of the volume and, with gradient, the range of its gradient magnitude."""
+		return self.request({'op': 'info', 'gradient': gradient})[0]
+
+	def extract(self, isovalues, lower=None):
+		"""Isosurface for isovalues, cropped to x, y, z >= lower if given."""
+		request = {'op': 'surface', 'isovalues': [float(v) for v in np.atleast_1d(isovalues)],
+			'lower': None if lower is None else [float(v) for v in lower]}
+		return mesh_from_arrays(unpack_arrays(self.request(request)[1]))
+
+	def attach(self, surface):
+		"""surface with the gradient magnitude at its points as scalars."""
+		reply, payload = self.request({'op': 'probe'}, pack_arrays({'points': points_array(surface)}))
+		result = vtk.vtkPolyData()
+		result.CopyStructure(surface)
+		scalars = numpy_support.numpy_to_vtk(unpack_arrays(payload)['values'], deep=1)
+		scalars.SetName("gradient_magnitude")
+		result.GetPointData().SetScalars(scalars)
+		normals = surface.GetPointData().GetNormals()
+		if normals is not None:
+			result.GetPointData().SetNormals(normals)
+		return result
+
+
+def daemon_from_args(args, gradmag=None):
+	"""Connect to the volume daemon given on the command line, or None.
+
+	gradmag is the gradient magnitude file of the viewer, None to derive it.
+	When no daemon answers the viewer loads the volumes itself.
+	"""
+	if args.daemon is None:
+		return None
+	spec = {'data': os.path.abspath(args.data),
+		'gradmag': None if gradmag is None else os.path.abspath(gradmag),
+		'roi': args.roi, 'stride': args.stride, 'narrow': args.narrow}
+	try:
+		return RemoteVolume(args.daemon, spec)
+	except (IOError, OSError) as e:
+		print("No volume daemon on %s (%s), loading the volumes here" % (args.daemon, e))
+		return None
+
+
+def check_daemon_arguments(parser, args):
+	"""Reject the options that need the volume in the viewer along with --daemon."""
+	if args.daemon is not None:
+		try:
+			parse_address(args.daemon)
+		except ValueError as e:
+			parser.error(str(e))
+	# 4A has no --stream-slab
+	if args.daemon is not None and (args.brick_size > 0 or args.progressive
+			or getattr(args, 'stream_slab', 0) > 0):
+		parser.error("--brick-size, --progressive and --stream-slab need the volume in the viewer, "
+			"which --daemon never loads")
+
+
+def add_daemon_arguments(parser):
+	parser.add_argument('--daemon', nargs='?', const=DEFAULT_ADDRESS, metavar='address',
+						help='Get the surfaces from the volume daemon on this Unix socket or '
+						'loopback host:port (python -m isotools.service) instead of loading the volumes')
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description="Keeps volumes in memory for the viewers started with --daemon.")
+	parser.add_argument('--address', default=DEFAULT_ADDRESS,
+						help='Unix socket to listen on, or host:port for a loopback TCP port')
+	parser.add_argument('--jobs', type=int, metavar='int', default=DEFAULT_JOBS,
+						help='Requests computed at the same time')
+	parser.add_argument('--queue', type=int, metavar='int', default=DEFAULT_QUEUE,
+						help='Requests waiting for a job before new ones are turned down')
+	parser.add_argument('--max-volumes', type=int, metavar='int', default=DEFAULT_MAX_VOLUMES,
+						help='Volumes kept in memory, least recently used dropped first')
+	parser.add_argument('--surface-mb', type=int, metavar='int', default=DEFAULT_SURFACE_MB,
+						help='Memory kept for whole surfaces already sent, in MB')
+	add_gradient_arguments(parser)
+	args = parser.parse_args()
+	try:
+		parse_address(args.address)
+	except ValueError as e:
+		parser.error(str(e))
+
+	serve(VolumeService(args.gradient_cache, args.jobs, args.queue, args.max_volumes,
+		args.surface_mb << 20), args.address)
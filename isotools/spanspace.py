@@ -0,0 +1,218 @@
+"""Span-space contouring: only visit bricks whose range holds the isovalue.
+
+The volume is split once into bricks of brick_size cells per axis and the
+minimum and maximum scalar of every brick is stored. A brick can only hold
+part of the isosurface if min <= isovalue <= max, so contouring walks the
+active bricks instead of the whole volume. The pieces of neighbouring
+bricks meet on their shared planes of points, where the points they both
+produced are welded back into one.
+"""
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from isotools.mesh import compact, points_array, triangles_array
+from isotools.volume import image_from_array, scalars_array
+from isotools.worker import check_abort
+
+DEFAULT_BRICK_SIZE = 16
+
+
+def brick_reduce(ufunc, values, brick_size):
+	"""Reduce values over bricks of brick_size cells along every axis.
+
+	Neighbouring bricks share their boundary plane of points, because the
+	cells of a brick reach the first points of the next one.
+	"""
+	for axis in range(3):
+		n = values.shape[axis]
+		starts = np.arange(0, max(n - 1, 1), brick_size)
+		reduced = ufunc.reduceat(values, starts, axis=axis)
+		shared = starts[1:]
+		if len(shared):
+			head = [slice(None)] * 3
+			head[axis] = slice(0, len(shared))
+			head = tuple(head)
+			reduced[head] = ufunc(reduced[head], np.take(values, shared, axis=axis))
+		values = reduced
+	return values
+
+
+class BrickIndex(object):
+	"""Per-brick minimum and maximum of a (z, y, x) volume."""
+
+	def __init__(self, volume, brick_size=DEFAULT_BRICK_SIZE):
+		self.shape = volume.shape
+		self.brick_size = brick_size
+		self.mins = brick_reduce(np.minimum, volume, brick_size)
+		self.maxs = brick_reduce(np.maximum, volume, brick_size)
+
+	def active(self, isovalues):
+		"""Boolean (z, y, x) mask of the bricks straddling any isovalue."""
+		mask = np.zeros(self.mins.shape, dtype=bool)
+		for value in isovalues:
+			mask |= (self.mins <= value) & (self.maxs >= value)
+		return mask
+
+	def runs(self, isovalues, extent=None):
+		"""Point extents (z0, z1, y0, y1, x0, x1) of the active bricks.
+
+		Consecutive active bricks along x are merged into a single run so
+		that each contour call gets a reasonably sized piece of volume. An
+		extent (x0, x1, y0, y1, z0, z1) of points limits the runs to that
+		sub-volume.
+		"""
+		b = self.brick_size
+		nz, ny, nx = self.shape
+		if extent is None:
+			extent = (0, nx - 1, 0, ny - 1, 0, nz - 1)
+		mask = self.active(isovalues)
+		bounds = ((extent[4], extent[5]), (extent[2], extent[3]), (extent[0], extent[1]))
+		for axis, (lo, hi) in enumerate(bounds):
+			keep = np.zeros(mask.shape[axis], dtype=bool)
+			keep[lo // b:max(hi - 1, lo) // b + 1] = True
+			shape = [1, 1, 1]
+			shape[axis] = -1
+			mask &= keep.reshape(shape)
+		edges = np.diff(np.pad(mask, ((0, 0), (0, 0), (1, 1))).astype(np.int8), axis=2)
+		for bz, by in zip(*np.nonzero(mask.any(axis=2))):
+			row = edges[bz, by]
+			for bx0, bx1 in zip(np.flatnonzero(row == 1), np.flatnonzero(row == -1)):
+				run = (max(bz * b, extent[4]), min((bz + 1) * b, nz - 1, extent[5]),
+					max(by * b, extent[2]), min((by + 1) * b, ny - 1, extent[3]),
+					max(bx0 * b, extent[0]), min(bx1 * b, nx - 1, extent[1]))
+				if run[0] < run[1] and run[2] < run[3] and run[4] < run[5]:
+					yield run
+
+
+def node_gradient(flat, nodes, dims, spacing):
+	"""Central difference gradient of a flattened volume at integer nodes."""
+	strides = (1, dims[0], dims[0] * dims[1])
+	index = nodes[:, 0] + nodes[:, 1] * strides[1] + nodes[:, 2] * strides[2]
+	gradient = np.empty(nodes.shape, dtype=np.float64)
+	for axis in range(3):
+		lo = np.maximum(nodes[:, axis] - 1, 0)
+		hi = np.minimum(nodes[:, axis] + 1, dims[axis] - 1)
+		diff = (flat[index + (hi - nodes[:, axis]) * strides[axis]].astype(np.float64)
+			- flat[index + (lo - nodes[:, axis]) * strides[axis]])
+		gradient[:, axis] = diff / (np.maximum(hi - lo, 1) * spacing[axis])
+	return gradient
+
+
+def gradient_normals(volume, points, origin, spacing):
+	"""Contour normals at points, like vtkContourFilter.ComputeNormalsOn().
+
+	Contour points lie on grid edges, so the central difference gradients of
+	the two edge ends are interpolated, negated and normalized. Only the
+	nodes next to the surface are touched.
+	"""
+	nz, ny, nx = volume.shape
+	dims = np.array([nx, ny, nz])
+	spacing = np.asarray(spacing, dtype=np.float64)
+	ijk = (points - np.asarray(origin)) / spacing
+
+	nearest = np.rint(ijk)
+	axis = np.argmax(np.abs(ijk - nearest), axis=1)
+	rows = np.arange(len(points))
+	start = nearest.astype(np.intp)
+	start[rows, axis] = np.floor(ijk[rows, axis])
+	start = np.clip(start, 0, dims - 1)
+	start[rows, axis] = np.minimum(start[rows, axis], np.maximum(dims[axis] - 2, 0))
+	t = np.clip(ijk[rows, axis] - start[rows, axis], 0, 1)[:, None]
+	end = start.copy()
+	end[rows, axis] = np.minimum(start[rows, axis] + 1, dims[axis] - 1)
+
+	flat = volume.reshape(-1)
+	normals = -((1 - t) * node_gradient(flat, start, dims, spacing)
+		+ t * node_gradient(flat, end, dims, spacing))
+	length = np.linalg.norm(normals, axis=1)
+	normals /= np.where(length > 0, length, 1)[:, None]
+	return normals.astype(np.float32)
+
+
+def weld_seams(surface, origin, spacing, brick_size):
+	"""surface with the points repeated by neighbouring bricks merged.
+
+	Both bricks interpolate the edges of their shared plane alike, so only
+	the points lying on a brick boundary are looked at and merged when
+	their coordinates are equal.
+	"""
+	points = points_array(surface)
+	ijk = (points - origin) / spacing
+	nearest = np.rint(ijk)
+	seam = ((np.abs(ijk - nearest) < 1e-3) & (nearest % brick_size == 0)).any(axis=1)
+	ids = np.flatnonzero(seam)
+	if len(ids) == 0:
+		return surface
+	unique, first, inverse = np.unique(points[ids], axis=0, return_index=True, return_inverse=True)
+	remap = np.arange(len(points))
+	remap[ids] = ids[first][inverse.reshape(-1)]
+	return compact(surface, remap[triangles_array(surface)])
+
+
+class BrickContour(object):
+	"""Contour stage that only extracts the active bricks of an image."""
+
+	def __init__(self, image, brick_size=DEFAULT_BRICK_SIZE, compute_normals=True):
+		self.image = image
+		self.volume = scalars_array(image)
+		self.origin = np.array(image.GetOrigin())
+		self.spacing = np.array(image.GetSpacing())
+		self.compute_normals = compute_normals
+		self.index = BrickIndex(self.volume, brick_size)
+		self.contour = vtk.vtkContourFilter()
+		self.contour.ComputeNormalsOff()
+
+	def extract(self, isovalues, extent=None):
+		"""Isosurface for one isovalue or a sequence of them.
+
+		extent optionally restricts the contour to a sub-volume of points.
+		"""
+		if np.isscalar(isovalues):
+			isovalues = [isovalues]
+		self.contour.SetNumberOfContours(len(isovalues))
+		for i, value in enumerate(isovalues):
+			self.contour.SetValue(i, value)
+
+		append = vtk.vtkAppendPolyData()
+		pieces = 0
+		for z0, z1, y0, y1, x0, x1 in self.index.runs(isovalues, extent):
+			origin = self.origin + self.spacing * (x0, y0, z0)
+			piece = image_from_array(self.volume[z0:z1 + 1, y0:y1 + 1, x0:x1 + 1],
+				origin, self.spacing)
+			self.contour.SetInputData(piece)
+			self.contour.Update()
+			check_abort(self.contour)
+			output = vtk.vtkPolyData()
+			output.ShallowCopy(self.contour.GetOutput())
+			append.AddInputData(output)
+			pieces += 1
+
+		surface = vtk.vtkPolyData()
+		if pieces == 0:
+			return surface
+		append.Update()
+		surface.ShallowCopy(append.GetOutput())
+		if pieces > 1:
+			surface = weld_seams(surface, self.origin, self.spacing, self.index.brick_size)
+		if self.compute_normals and surface.GetNumberOfPoints():
+			points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData())
+			normals = numpy_support.numpy_to_vtk(
+				gradient_normals(self.volume, points, self.origin, self.spacing), deep=1)
+			normals.SetName("Normals")
+			surface.GetPointData().SetNormals(normals)
+		return surface
+
+
+def bricks_from_args(args, image):
+	"""Build the span-space contour stage requested on the command line."""
+	if args.brick_size <= 0:
+		return None
+	return BrickContour(image, args.brick_size)
+
+
+def add_span_space_arguments(parser):
+	parser.add_argument('--brick-size', type=int, metavar='int', default=0,
+						help='Only contour bricks of this many cells whose range holds the '
+						'isovalue (0 contours the whole volume)')
@@ -0,0 +1,241 @@
+"""Out-of-core isosurfaces of volumes read a slab at a time.
+
+The readers are only asked for their whole extent; VolumeSlabs then
+requests one z-slab after another through vtkExtractVOI, so
+vtkXMLImageDataReader reads just that slab from the file and a mapped
+volume only touches its pages. Every slab is read with one extra plane on
+each side so that the normals and gradients at its faces are the same
+central differences the whole volume gives. The triangles of those
+padding planes are dropped, because the neighbouring slab extracts them
+too, and the points on the planes shared by two slabs are welded. The
+peak memory is that of a few slabs plus the surface.
+"""
+
+import os
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from isotools.gradient import gradient_cache_name, gradient_magnitude
+from isotools.mesh import points_array, triangle_cells, triangles_array
+from isotools.rawvolume import open_volume, volume_from_args, volume_key
+from isotools.worker import check_abort
+
+# planes of points per slab
+DEFAULT_SLAB = 64
+
+
+class VolumeSlabs(object):
+	"""z-slabs of the volume produced by the algorithm source."""
+
+	def __init__(self, source, slab=DEFAULT_SLAB):
+		self.slab = max(1, slab)
+		source.UpdateInformation()
+		information = source.GetOutputInformation(0)
+		self.whole = list(information.Get(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT()))
+		self.origin = information.Get(vtk.vtkDataObject.ORIGIN())
+		self.spacing = information.Get(vtk.vtkDataObject.SPACING())
+		self.voi = vtk.vtkExtractVOI()
+		self.voi.SetInputConnection(source.GetOutputPort())
+
+	def ranges(self):
+		"""(first, last) z index of every slab, neighbours share a plane."""
+		first, last = self.whole[4], self.whole[5]
+		return [(z, min(z + self.slab, last)) for z in range(first, max(last, first + 1), self.slab)]
+
+	def z(self, index):
+		"""World z of the plane of points index."""
+		return self.origin[2] + index * self.spacing[2]
+
+	def read(self, first, last, pad=1):
+		"""Image of the planes first to last and pad more on each side."""
+		self.voi.SetVOI(self.whole[0], self.whole[1], self.whole[2], self.whole[3],
+			max(first - pad, self.whole[4]), min(last + pad, self.whole[5]))
+		self.voi.Update()
+		image = vtk.vtkImageData()
+		image.ShallowCopy(self.voi.GetOutput())
+		return image
+
+
+def piece_arrays(surface, triangles):
+	"""Points, normals, scalars and triangles of surface restricted to triangles."""
+	used = np.zeros(surface.GetNumberOfPoints(), dtype=bool)
+	used[triangles] = True
+	point_data = surface.GetPointData()
+	arrays = [points_array(surface)[used]]
+	for array in (point_data.GetNormals(), point_data.GetScalars()):
+		arrays.append(None if array is None else numpy_support.vtk_to_numpy(array)[used])
+	arrays.append((np.cumsum(used) - 1)[triangles])
+	return arrays
+
+
+def weld(pieces, seams):
+	"""Surface of the piece_arrays() pieces, merging their points on the z planes seams.
+
+	pieces is emptied on the way, so that its arrays are freed as soon as
+	they are copied.
+	"""
+	if not pieces:
+		return vtk.vtkPolyData()
+	starts = np.cumsum([0] + [len(piece[0]) for piece in pieces])
+	triangles = np.concatenate([piece[3] + start for piece, start in zip(pieces, starts)])
+	columns = []
+	for i in range(3):
+		if any(piece[i] is None for piece in pieces):
+			columns.append(None)
+		else:
+			columns.append(np.concatenate([piece[i] for piece in pieces]))
+	del pieces[:]
+
+	# both slabs interpolate the same edge from the same voxels, so the copies are identical
+	points = columns[0]
+	on_seam = np.flatnonzero(np.isin(points[:, 2], np.asarray(seams, dtype=points.dtype)))
+	remap = np.arange(len(points))
+	if len(on_seam):
+		unique, first, inverse = np.unique(points[on_seam], axis=0, return_index=True,
+			return_inverse=True)
+		remap[on_seam] = on_seam[first[inverse.ravel()]]
+	kept = remap == np.arange(len(points))
+	remap = (np.cumsum(kept) - 1)[remap]
+
+	surface = vtk.vtkPolyData()
+	vtk_points = vtk.vtkPoints()
+	vtk_points.SetData(numpy_support.numpy_to_vtk(points[kept], deep=1))
+	surface.SetPoints(vtk_points)
+	for attribute, name, values in zip((vtk.vtkDataSetAttributes.NORMALS,
+			vtk.vtkDataSetAttributes.SCALARS), ("Normals", "scalars"), columns[1:]):
+		if values is not None:
+			array = numpy_support.numpy_to_vtk(values[kept], deep=1)
+			array.SetName(name)
+			surface.GetPointData().SetAttribute(array, attribute)
+	surface.SetPolys(triangle_cells(remap[triangles]))
+	return surface
+
+
+class SlabContour(object):
+	"""Isosurfaces of the volume of source, contoured slab by slab."""
+
+	def __init__(self, source, slab=DEFAULT_SLAB):
+		self.slabs = VolumeSlabs(source, slab)
+		self.contour = vtk.vtkContourFilter()
+		self.contour.ComputeNormalsOn()
+		self.contour.ComputeScalarsOn()
+
+	def extract(self, isovalues):
+		"""Surface of the isovalues with the contour values as scalars."""
+		if np.isscalar(isovalues):
+			isovalues = [isovalues]
+		self.contour.SetNumberOfContours(len(isovalues))
+		for i, value in enumerate(isovalues):
+			self.contour.SetValue(i, value)
+
+		pieces = []
+		ranges = self.slabs.ranges()
+		for first, last in ranges:
+			self.contour.SetInputData(self.slabs.read(first, last))
+			self.contour.Update()
+			check_abort(self.contour)
+			piece = self.contour.GetOutput()
+			triangles = triangles_array(piece)
+			if len(triangles) == 0:
+				continue
+			# a triangle lies within one cell, its lowest point tells which slab owns it;
+			# one lying on a seam belongs to the slab above
+			z = points_array(piece)[triangles, 2].min(axis=1)
+			inside = z >= self.slabs.z(first)
+			if (first, last) == ranges[-1]:
+				inside &= z <= self.slabs.z(last)
+			else:
+				inside &= z < self.slabs.z(last)
+			pieces.append(piece_arrays(piece, triangles[inside]))
+		self.contour.SetInputData(None)
+		return weld(pieces, [self.slabs.z(last) for first, last in ranges[:-1]])
+
+
+class SlabSampler(object):
+	"""GradientSampler whose gradient magnitude volume is read slab by slab.
+
+	With derive set, source is the CT volume and the gradient magnitude of
+	every slab is computed from it instead.
+	"""
+
+	def __init__(self, source, slab=DEFAULT_SLAB, derive=False):
+		self.slabs = VolumeSlabs(source, slab)
+		self.derive = derive
+		self.probe = vtk.vtkProbeFilter()
+
+	def attach(self, surface):
+		points = points_array(surface)
+		values = np.zeros(len(points), dtype=np.float32)
+		done = np.zeros(len(points), dtype=bool)
+		ranges = self.slabs.ranges()
+		for first, last in ranges:
+			inside = ~done
+			if (first, last) != ranges[-1]:
+				inside &= points[:, 2] <= self.slabs.z(last)
+			ids = np.flatnonzero(inside)
+			done |= inside
+			if len(ids) == 0:
+				continue
+			image = self.slabs.read(first, last)
+			if self.derive:
+				image = gradient_magnitude(image)
+			piece_points = vtk.vtkPoints()
+			piece_points.SetData(numpy_support.numpy_to_vtk(points[ids], deep=1))
+			piece = vtk.vtkPolyData()
+			piece.SetPoints(piece_points)
+			self.probe.SetSourceData(image)
+			self.probe.SetInputData(piece)
+			self.probe.Update()
+			check_abort(self.probe)
+			values[ids] = numpy_support.vtk_to_numpy(self.probe.GetOutput().GetPointData().GetScalars())
+		self.probe.SetSourceData(None)
+
+		result = vtk.vtkPolyData()
+		result.CopyStructure(surface)
+		scalars = numpy_support.numpy_to_vtk(values, deep=1)
+		scalars.SetName("gradient_magnitude")
+		result.GetPointData().SetScalars(scalars)
+		normals = surface.GetPointData().GetNormals()
+		if normals is not None:
+			result.GetPointData().SetNormals(normals)
+		return result
+
+
+def stream_from_args(args, source):
+	"""Build the slab contour requested on the command line, or None.
+
+	source is the CT volume opened without update.
+	"""
+	if args.stream_slab <= 0:
+		return None
+	return SlabContour(source, args.stream_slab)
+
+
+def slab_sampler_from_args(args, name, source):
+	"""SlabSampler of the gradient magnitude file name, or derived from the CT source.
+
+	A gradient magnitude left in --gradient-cache by a viewer that loaded
+	the whole volume is read instead of deriving one; streaming never
+	writes the cache, because that takes the whole gradient in memory.
+	"""
+	if name is not None:
+		return SlabSampler(volume_from_args(args, name, update=False), args.stream_slab)
+	cached = gradient_cache_name(args.data, args.gradient_cache, volume_key(args.roi, args.stride))
+	if cached is not None and os.path.exists(cached):
+		return SlabSampler(open_volume(cached, update=False), args.stream_slab)
+	return SlabSampler(source, args.stream_slab, derive=True)
+
+
+def check_stream_arguments(parser, args):
+	"""Reject the options that need the volume in memory along with --stream-slab."""
+	if args.stream_slab > 0 and (args.crop or args.brick_size > 0 or args.progressive):
+		parser.error("--crop, --brick-size and --progressive need the whole volume in memory, "
+			"which --stream-slab never loads")
+
+
+def add_stream_arguments(parser):
+	parser.add_argument('--stream-slab', type=int, metavar='int', default=0,
+						help='Never load the whole volume, contour and probe it in slabs of '
+						'this many z planes (0 loads it at once)')
@@ -0,0 +1,165 @@
+"""Per-filter timing of the viewer pipelines.
+
+A PipelineTrace puts StartEvent/EndEvent observers on the filters of a
+viewer and on its render window, and marks every slider release as an
+interaction that lasts until the frame showing it has been rendered. Each
+record keeps the wall time, the input and output cell counts and the
+memory in use. At exit the records are written as a Chrome trace, which
+chrome://tracing and ui.perfetto.dev open, and summed up per stage.
+"""
+
+import atexit
+import json
+import os
+import resource
+import threading
+import time
+
+import vtk
+
+
+def resident_mib():
+	"""Resident memory of the process in MiB, the peak where /proc is missing."""
+	try:
+		with open("/proc/self/statm") as f:
+			pages = int(f.read().split()[1])
+		return pages * os.sysconf("SC_PAGE_SIZE") / float(1 << 20)
+	except (IOError, OSError, ValueError):
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def cell_count(data):
+	if isinstance(data, vtk.vtkDataSet):
+		return data.GetNumberOfCells()
+	return None
+
+
+class PipelineTrace(object):
+	"""Timeline of filter executions, renders and slider interactions."""
+
+	def __init__(self, output=None):
+		self.output = output
+		self.lock = threading.Lock()
+		self.origin = time.perf_counter()
+		self.records = []
+		self.running = {}
+		self.interaction = None
+
+	def now(self):
+		return time.perf_counter() - self.origin
+
+	def add(self, name, category, start, args):
+		with self.lock:
+			self.records.append({'name': name, 'cat': category, 'start': start,
+				'dur': self.now() - start, 'tid': threading.current_thread().name, 'args': args})
+
+	def watch(self, algorithm, name):
+		"""Record every execution of algorithm under name."""
+		algorithm.AddObserver("StartEvent", lambda obj, event: self.started(name))
+		algorithm.AddObserver("EndEvent", lambda obj, event: self.finished(algorithm, name))
+
+	def watch_all(self, algorithms):
+		"""watch() every algorithm of a {name: algorithm} dict, skipping None."""
+		for name, algorithm in algorithms.items():
+			if algorithm is not None:
+				self.watch(algorithm, name)
+
+	def started(self, name):
+		with self.lock:
+			self.running[(threading.get_ident(), name)] = self.now()
+
+	def finished(self, algorithm, name):
+		with self.lock:
+			start = self.running.pop((threading.get_ident(), name), None)
+		if start is None:
+			return
+		args = {'rss_mib': round(resident_mib(), 1)}
+		if algorithm.GetNumberOfInputPorts() and algorithm.GetNumberOfInputConnections(0):
+			args['input_cells'] = cell_count(algorithm.GetInputDataObject(0, 0))
+		if algorithm.GetNumberOfOutputPorts():
+			output = algorithm.GetOutputDataObject(0)
+			args['output_cells'] = cell_count(output)
+			if output is not None:
+				args['output_kib'] = output.GetActualMemorySize()
+		self.add(name, "filter", start, args)
+
+	def watch_render(self, render_window):
+		"""Record the renders; a render ends the interaction that caused it."""
+		render_window.AddObserver("StartEvent", lambda obj, event: self.started("render"))
+		render_window.AddObserver("EndEvent", self.rendered)
+
+	def rendered(self, obj, event):
+		with self.lock:
+			start = self.running.pop((threading.get_ident(), "render"), None)
+		if start is not None:
+			self.add("render", "render", start, {'rss_mib': round(resident_mib(), 1)})
+		self.close_interaction()
+
+	def watch_widget(self, widget, name):
+		"""Mark every release of the slider widget as an interaction."""
+		# around the handlers, whatever their priority
+		widget.AddObserver("EndInteractionEvent", lambda obj, event: self.open_interaction(name), 100.0)
+
+	def open_interaction(self, name):
+		self.close_interaction()
+		with self.lock:
+			self.interaction = (name, self.now(), resident_mib())
+
+	def close_interaction(self):
+		with self.lock:
+			interaction, self.interaction = self.interaction, None
+		if interaction is not None:
+			name, start, rss = interaction
+			rss_now = resident_mib()
+			self.add(name, "interaction", start, {'rss_mib': round(rss_now, 1),
+				'rss_delta_mib': round(rss_now - rss, 1)})
+
+	def chrome_trace(self):
+		"""The records as a Chrome trace event list, times in microseconds."""
+		threads = {}
+		events = []
+		for record in self.records:
+			tid = threads.setdefault(record['tid'], len(threads))
+			events.append({'name': record['name'], 'cat': record['cat'], 'ph': 'X',
+				'ts': record['start'] * 1e6, 'dur': record['dur'] * 1e6, 'pid': os.getpid(),
+				'tid': tid, 'args': record['args']})
+		for name, tid in threads.items():
+			events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid,
+				'args': {'name': name}})
+		return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+	def write(self, name):
+		with open(name, "w") as f:
+			json.dump(self.chrome_trace(), f)
+
+	def summary(self):
+		"""Table of calls, total, mean and max time per stage, slowest first."""
+		stages = {}
+		for record in self.records:
+			stages.setdefault((record['cat'], record['name']), []).append(record['dur'])
+		lines = ["%-12s %-24s %6s %10s %10s %10s" % ("kind", "stage", "calls", "total s", "mean ms", "max ms")]
+		for (category, name), durations in sorted(stages.items(), key=lambda item: -sum(item[1])):
+			lines.append("%-12s %-24s %6d %10.3f %10.2f %10.2f" % (category, name, len(durations),
+				sum(durations), 1000 * sum(durations) / len(durations), 1000 * max(durations)))
+		return "\n".join(lines)
+
+	def finish(self):
+		self.close_interaction()
+		if self.output is not None:
+			self.write(self.output)
+		print(self.summary())
+
+
+def trace_from_args(args):
+	"""Build the pipeline trace requested on the command line."""
+	if args.trace is None:
+		return None
+	trace = PipelineTrace(args.trace or None)
+	atexit.register(trace.finish)
+	return trace
+
+
+def add_trace_arguments(parser):
+	parser.add_argument('--trace', nargs='?', const='', metavar='filename',
+						help='Time every filter, render and slider release; print a summary at '
+						'exit and write a Chrome/Perfetto trace to filename if given')
@@ -0,0 +1,118 @@
+"""Depth peeling sized to a frame time budget.
+
+isocomplete draws its translucent layers with depth peeling, whose cost
+grows with the number of peels and the number of triangles. A
+TransparencyBudget times every render while the camera or a slider moves
+and steps the peel count down a ladder when a frame takes longer than the
+budget, and back up when it takes less than half of it. The lowest step
+turns peeling off and blends the layers in the order they are drawn. Once
+the interaction ends the still frame is drawn with every peel. The peel
+count in use is shown in a corner of the window.
+"""
+
+import vtk
+
+# peel counts tried while moving, 0 turns depth peeling off
+PEEL_LADDER = (0, 2, 4, 8, 16, 32, 64)
+DEFAULT_PEELS = 100
+DEFAULT_OCCLUSION_RATIO = 0.4
+DEFAULT_PEEL_FPS = 15
+
+
+def set_peeling(renderer, peels, occlusion_ratio=DEFAULT_OCCLUSION_RATIO):
+	"""Draw the translucent props of renderer with up to peels peels, none for 0."""
+	renderer.SetUseDepthPeeling(1 if peels > 0 else 0)
+	renderer.SetMaximumNumberOfPeels(peels)
+	renderer.SetOcclusionRatio(occlusion_ratio)
+
+
+class TransparencyBudget(object):
+	"""Peel count of renderer adapted to fps frames per second while interacting."""
+
+	def __init__(self, renderer, fps=DEFAULT_PEEL_FPS, max_peels=DEFAULT_PEELS,
+			occlusion_ratio=DEFAULT_OCCLUSION_RATIO):
+		self.renderer = renderer
+		self.budget = 1.0 / fps
+		self.fps = fps
+		self.occlusion_ratio = occlusion_ratio
+		self.ladder = [peels for peels in PEEL_LADDER if peels < max_peels] + [max_peels]
+		# start cheap, the first frames show whether there is room for more
+		self.step = 0
+		self.interactive = False
+		self.timer = vtk.vtkTimerLog()
+		self.label = vtk.vtkTextActor()
+		self.label.GetTextProperty().SetFontSize(14)
+		self.label.SetPosition(10, 10)
+		renderer.AddViewProp(self.label)
+		self.show(self.ladder[-1], False)
+
+	def show(self, peels, interactive):
+		set_peeling(self.renderer, peels, self.occlusion_ratio)
+		text = "depth peeling off" if peels == 0 else "%d peels" % peels
+		self.label.SetInput(text + (" (moving)" if interactive else ""))
+
+	def started(self, obj, event):
+		# the interactor and the widgets ask for their desired rate while something moves
+		self.interactive = obj.GetDesiredUpdateRate() > self.still_rate
+		self.show(self.ladder[self.step] if self.interactive else self.ladder[-1], self.interactive)
+		self.timer.StartTimer()
+
+	def finished(self, obj, event):
+		self.timer.StopTimer()
+		if not self.interactive:
+			return
+		elapsed = self.timer.GetElapsedTime()
+		if elapsed > self.budget and self.step > 0:
+			self.step -= 1
+		elif elapsed < self.budget / 2 and self.step < len(self.ladder) - 1:
+			# a peel more or less costs the same, twice the peels about twice the time
+			self.step += 1
+
+	def attach(self, interactor):
+		interactor.SetDesiredUpdateRate(self.fps)
+		self.still_rate = interactor.GetStillUpdateRate()
+		render_window = interactor.GetRenderWindow()
+		render_window.AddObserver("StartEvent", self.started)
+		render_window.AddObserver("EndEvent", self.finished)
+
+
+def peel_fps_from_args(args):
+	"""Frame rate of the adaptive peeling, the one of the levels of detail with --lod.
+
+	Both set the desired update rate of the interactor, so they share it.
+	"""
+	if args.peel_fps is not None:
+		return args.peel_fps
+	if args.lod:
+		return args.lod_fps
+	return DEFAULT_PEEL_FPS
+
+
+def peeling_from_args(args, renderer):
+	"""Set up the depth peeling of renderer; return the adaptive controller, or None."""
+	if not args.adaptive_peels:
+		set_peeling(renderer, args.max_peels, args.occlusion_ratio)
+		return None
+	return TransparencyBudget(renderer, peel_fps_from_args(args), args.max_peels, args.occlusion_ratio)
+
+
+def check_peeling_arguments(parser, args):
+	"""Reject a --peel-fps the --lod-fps of the same interactor contradicts."""
+	if (args.adaptive_peels and args.lod and args.peel_fps is not None
+			and args.peel_fps != args.lod_fps):
+		parser.error("--peel-fps and --lod-fps both set the frame rate of the interactor, "
+			"give only one of them or the same value")
+
+
+def add_peeling_arguments(parser):
+	parser.add_argument('--adaptive-peels', action='store_true',
+						help='Lower the depth peels while the camera or a slider moves to keep '
+						'--peel-fps, use them all when still')
+	parser.add_argument('--peel-fps', type=float, metavar='float',
+						help='Frame rate the adaptive depth peeling aims for (--lod-fps with '
+						'--lod, %g otherwise)' % DEFAULT_PEEL_FPS)
+	parser.add_argument('--max-peels', type=int, metavar='int', default=DEFAULT_PEELS,
+						help='Depth peels of the still frames')
+	parser.add_argument('--occlusion-ratio', type=float, metavar='float',
+						default=DEFAULT_OCCLUSION_RATIO,
+						help='Fraction of pixels a peel may leave undrawn before peeling stops')
@@ -0,0 +1,30 @@
+"""NumPy views of vtkImageData volumes."""
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+
+def scalars_array(image):
+	"""Point scalars of image as a (z, y, x) array sharing the VTK buffer."""
+	nx, ny, nz = image.GetDimensions()
+	scalars = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+	return scalars.reshape(nz, ny, nx)
+
+
+def image_from_array(array, origin=(0, 0, 0), spacing=(1, 1, 1), name="scalars"):
+	"""Wrap a (z, y, x) array as vtkImageData point scalars without copying.
+
+	The array must stay alive as long as the image does, which is why it is
+	attached to the returned object.
+	"""
+	array = np.ascontiguousarray(array)
+	image = vtk.vtkImageData()
+	image.SetDimensions(array.shape[2], array.shape[1], array.shape[0])
+	image.SetOrigin(origin)
+	image.SetSpacing(spacing)
+	scalars = numpy_support.numpy_to_vtk(array.ravel(), deep=0)
+	scalars.SetName(name)
+	image.GetPointData().SetScalars(scalars)
+	image.numpy_array = array
+	return image
@@ -0,0 +1,154 @@
+"""Pipeline updates off the UI thread.
+
+The slider handlers hand a snapshot of their parameters to a
+PipelineWorker instead of calling Update() inside the interactor callback.
+The worker keeps only the newest request, aborts the filters of a request
+that has been superseded and passes the finished surface back to the main
+thread through an interactor timer.
+
+Independent branches of a pipeline, like the layers of isocomplete, can
+also be updated side by side on a thread pool; VTK releases the GIL while
+a filter executes.
+"""
+
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import vtk
+
+# how often the interactor looks for finished results, in milliseconds
+DEFAULT_POLL_MS = 30
+
+
+class Aborted(Exception):
+	"""Raised by a stage whose filter was aborted by a newer request."""
+
+
+def check_abort(algorithm):
+	if algorithm.GetAbortExecute():
+		raise Aborted()
+
+
+def detach(algorithm):
+	"""Output of algorithm as a vtkPolyData no longer tied to the pipeline."""
+	surface = vtk.vtkPolyData()
+	surface.ShallowCopy(algorithm.GetOutput())
+	return surface
+
+
+class PipelineWorker(object):
+	"""Runs compute(params) on a background thread, newest request wins.
+
+	filters are the VTK algorithms compute() drives; their AbortExecute flag
+	is raised when a request is superseded. apply(result) is called on the
+	main thread once attach() has hooked the worker to an interactor.
+	"""
+
+	def __init__(self, compute, apply, filters=()):
+		self.compute = compute
+		self.apply = apply
+		self.filters = [f for f in filters if f is not None]
+		self.condition = threading.Condition()
+		self.generation = 0
+		self.pending = None
+		self.running = None
+		self.result = None
+		self.dropped = 0
+		self.thread = threading.Thread(target=self.run, name="pipeline-worker")
+		self.thread.daemon = True
+		self.thread.start()
+
+	def submit(self, params):
+		with self.condition:
+			self.generation += 1
+			if self.pending is not None:
+				self.dropped += 1
+			self.pending = (self.generation, params)
+			if self.running is not None:
+				for algorithm in self.filters:
+					algorithm.SetAbortExecute(1)
+			self.condition.notify()
+
+	def cancel(self):
+		"""Forget the pending request and abort the one being computed."""
+		with self.condition:
+			self.generation += 1
+			self.result = None
+			if self.pending is not None:
+				self.pending = None
+				self.dropped += 1
+			if self.running is not None:
+				for algorithm in self.filters:
+					algorithm.SetAbortExecute(1)
+
+	def run(self):
+		while True:
+			with self.condition:
+				while self.pending is None:
+					self.condition.wait()
+				generation, params = self.pending
+				self.pending = None
+				self.running = generation
+				for algorithm in self.filters:
+					if algorithm.GetAbortExecute():
+						# an aborted filter looks up to date, force it to run again
+						algorithm.SetAbortExecute(0)
+						algorithm.Modified()
+
+			try:
+				result = self.compute(params)
+			except Aborted:
+				result = None
+			except Exception:
+				traceback.print_exc()
+				result = None
+
+			with self.condition:
+				self.running = None
+				if result is not None and generation == self.generation:
+					self.result = result
+				else:
+					self.dropped += 1
+
+	def busy(self):
+		with self.condition:
+			return self.pending is not None or self.running is not None
+
+	def poll(self, obj=None, event=None):
+		with self.condition:
+			result, self.result = self.result, None
+		if result is not None:
+			self.apply(result)
+
+	def attach(self, interactor, interval=DEFAULT_POLL_MS):
+		interactor.AddObserver("TimerEvent", self.poll)
+		interactor.CreateRepeatingTimer(interval)
+
+
+def worker_from_args(args, compute, apply, filters=()):
+	"""Build the background worker requested on the command line."""
+	if not args.async_updates:
+		return None
+	return PipelineWorker(compute, apply, filters)
+
+
+def pool_from_args(args, branches):
+	"""Thread pool updating up to branches pipeline branches at once, or None."""
+	threads = args.layer_threads or min(branches, os.cpu_count() or 1)
+	if threads <= 1:
+		return None
+	return ThreadPoolExecutor(threads, thread_name_prefix="pipeline-branch")
+
+
+def add_pool_arguments(parser):
+	parser.add_argument('--layer-threads', type=int, metavar='int', default=0,
+						help='Layers updated at the same time (0 for one per layer, up to '
+						'the number of cores)')
+
+
+def add_worker_arguments(parser):
+	parser.add_argument('--async-updates', action='store_true',
+						help='Recompute the pipeline on a background thread and keep the '
+						'window responsive')
@@ -0,0 +1,59 @@
+"""Shared setup of the tests: the isotools package and small synthetic volumes."""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+import vtk
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from isotools.mesh import points_array, triangles_array
+from isotools.volume import image_from_array
+
+
+@pytest.fixture
+def phantom():
+	"""Factory of float32 vtkImageData sampling field(x, y, z) at the point indices."""
+	def make(field, size=32, origin=(0, 0, 0), spacing=(1, 1, 1)):
+		if np.isscalar(size):
+			size = (size, size, size)
+		z, y, x = np.mgrid[0:size[2], 0:size[1], 0:size[0]].astype(np.float32)
+		return image_from_array(field(x, y, z).astype(np.float32), origin, spacing)
+	return make
+
+
+@pytest.fixture
+def sphere(phantom):
+	"""Factory of volumes holding the distance of every point to the centre."""
+	def make(size=32, origin=(0, 0, 0), spacing=(1, 1, 1)):
+		center = (size - 1) / 2.0
+		return phantom(lambda x, y, z: np.sqrt((x - center) ** 2 + (y - center) ** 2
+			+ (z - center) ** 2), size, origin, spacing)
+	return make
+
+
+@pytest.fixture
+def contour():
+	"""Factory of the vtkContourFilter isosurface of an image."""
+	def make(image, *isovalues):
+		contour = vtk.vtkContourFilter()
+		contour.SetInputData(image)
+		for i, value in enumerate(isovalues):
+			contour.SetValue(i, value)
+		contour.Update()
+		surface = vtk.vtkPolyData()
+		surface.ShallowCopy(contour.GetOutput())
+		return surface
+	return make
+
+
+@pytest.fixture
+def triangle_areas():
+	"""Area of every triangle of a surface, quads split as triangles_array does."""
+	def areas(surface):
+		corners = points_array(surface).astype(np.float64)[triangles_array(surface)]
+		return 0.5 * np.linalg.norm(np.cross(corners[:, 1] - corners[:, 0],
+			corners[:, 2] - corners[:, 0]), axis=1)
+	return areas
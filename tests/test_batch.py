@@ -0,0 +1,11 @@
+"""Colors of the batch renders."""
+
+import numpy as np
+
+from isotools import batch
+
+
+def test_gradient_colormap_ends_at_the_largest_gradient(phantom):
+	gradmag = phantom(lambda x, y, z: 1000.5 * x + y, 16)
+	assert batch.gradient_colormap(gradmag) == batch.GRADIENT_COLORMAP + [[15023, 1, 0, 0]]
+	assert np.isclose(batch.color_function(batch.gradient_colormap(gradmag)).GetRange()[1], 15023)
@@ -0,0 +1,44 @@
+"""Synthetic phantoms and the stage benchmark run on them."""
+
+import argparse
+import json
+
+import numpy as np
+import pytest
+
+from isotools.benchmark import run_benchmarks
+from isotools.phantom import ISOVALUES, PHANTOMS, SPHERE_SHELLS, spheres
+
+
+def test_spheres_hold_every_shell():
+	volume = spheres(33)
+	assert volume.dtype == np.int16
+	assert volume[16, 16, 16] == SPHERE_SHELLS[-1][1]
+	assert volume[0, 0, 0] == 0
+	assert set(np.unique(volume)) == set([0] + [value for radius, value in SPHERE_SHELLS])
+
+
+@pytest.mark.parametrize("name", sorted(PHANTOMS))
+def test_isovalue_cuts_the_phantom(name):
+	volume = PHANTOMS[name](24)
+	assert volume.shape == (24, 24, 24)
+	assert volume.min() < ISOVALUES[name] < volume.max()
+
+
+def test_benchmark_reports_every_engine(tmp_path):
+	args = argparse.Namespace(phantoms=['spheres'], sizes=[20], repeat=2, workdir=str(tmp_path / "work"),
+		stages=['load', 'contour', 'clip', 'probe', 'gradient'], output=str(tmp_path / "bench.json"))
+	output = run_benchmarks(args)
+	with open(args.output) as f:
+		assert json.load(f) == json.loads(json.dumps(output))
+	records = dict(((r['stage'], r['engine']), r) for r in output['results'])
+	assert sorted(records) == [('clip', 'planes'), ('contour', 'bricks'), ('contour', 'crop'),
+		('contour', 'vtkContourFilter'), ('gradient', 'clips'), ('gradient', 'mask'),
+		('gradient', 'sorted'), ('load', 'mmap'), ('load', 'xml-raw'), ('load', 'xml-zlib'),
+		('probe', 'vtkProbeFilter')]
+	assert all(len(r['runs']) == 2 and r['best'] == min(r['runs']) for r in records.values())
+	# the engines of a stage compute the same result
+	assert records[('load', 'mmap')]['cells'] == records[('load', 'xml-zlib')]['cells'] == 19 ** 3
+	assert records[('contour', 'bricks')]['cells'] == records[('contour', 'vtkContourFilter')]['cells']
+	assert records[('gradient', 'sorted')]['cells'] == records[('gradient', 'mask')]['cells'] > 0
+	assert output['environment']['vtk']
@@ -0,0 +1,66 @@
+"""SurfaceCache eviction under its memory and triangle budgets."""
+
+import argparse
+
+import pytest
+
+from isotools.cache import SurfaceCache, add_cache_arguments, cache_from_args, surface_bytes
+
+
+@pytest.fixture
+def spheres(sphere, contour):
+	image = sphere(24)
+	return {radius: contour(image, radius) for radius in (4, 6, 8, 10)}
+
+
+def test_fetch_extracts_once(spheres):
+	cache = SurfaceCache()
+	calls = []
+
+	def extract(isovalue):
+		calls.append(isovalue)
+		return spheres[isovalue]
+
+	assert cache.fetch("ct", 6, extract) is spheres[6]
+	assert cache.fetch("ct", 6.0, extract) is spheres[6]
+	cache.fetch("other", 6, extract)
+	assert calls == [6, 6]
+	assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_least_recently_used_is_evicted_first(spheres):
+	cache = SurfaceCache(max_triangles=sum(spheres[r].GetNumberOfPolys() for r in (4, 6, 8)))
+	for radius in (4, 6, 8):
+		cache.put("ct", radius, spheres[radius])
+	cache.get("ct", 4)
+	cache.put("ct", 10, spheres[10])
+	assert ("ct", 4.0) in cache and ("ct", 10.0) in cache
+	assert ("ct", 6.0) not in cache
+	assert cache.triangles <= cache.max_triangles
+	assert cache.evictions >= 1
+
+
+def test_byte_budget(spheres):
+	cache = SurfaceCache(max_bytes=surface_bytes(spheres[10]))
+	cache.put("ct", 4, spheres[4])
+	cache.put("ct", 10, spheres[10])
+	assert list(cache.entries) == [("ct", 10.0)]
+	assert cache.bytes == surface_bytes(spheres[10])
+	cache.clear()
+	assert (len(cache), cache.bytes, cache.triangles) == (0, 0, 0)
+
+
+def test_oversized_surface_evicts_nothing(spheres):
+	cache = SurfaceCache(max_triangles=spheres[4].GetNumberOfPolys())
+	cache.put("ct", 4, spheres[4])
+	cache.put("ct", 10, spheres[10])
+	assert list(cache.entries) == [("ct", 4.0)]
+	assert cache.evictions == 0
+
+
+def test_cache_can_be_disabled():
+	parser = argparse.ArgumentParser()
+	add_cache_arguments(parser)
+	assert cache_from_args(parser.parse_args(["--cache-mb", "0"])) is None
+	cache = cache_from_args(parser.parse_args(["--cache-mb", "2", "--cache-triangles", "100"]))
+	assert (cache.max_bytes, cache.max_triangles) == (2 << 20, 100)
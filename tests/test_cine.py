@@ -0,0 +1,94 @@
+"""Isovalue sweeps contoured in the background."""
+
+import pytest
+import vtk
+
+from isotools.cine import PAINTS_PER_TICK, Cine, unpack_surface
+from isotools.clipbox import CroppedContour
+from isotools.mesh import points_array, triangles_array
+
+VALUES = [4.0, 6.0, 8.0, 10.0, 12.0]
+
+
+@pytest.fixture
+def cine(sphere):
+	def make(jobs=2, painter=None):
+		cine = Cine(sphere(32), VALUES, vtk.vtkPolyDataMapper(), vtk.vtkActor(), vtk.vtkRenderer(),
+			vtk.vtkSliderRepresentation2D(), lambda: None, jobs=jobs, painter=painter)
+		made.append(cine)
+		return cine
+	made = []
+	yield make
+	for cine in made:
+		cine.close()
+
+
+def finish(cine):
+	for future in list(cine.futures):
+		future.result(timeout=60)
+	cine.collect()
+
+
+def test_frames_follow_the_isovalues(cine, sphere):
+	sweep = cine()
+	lower = (14.5, 3.0, 0.0)
+	sweep.prepare(lower)
+	finish(sweep)
+	assert sorted(sweep.frames) == list(range(len(VALUES)))
+	crop = CroppedContour(sphere(32))
+	for index, value in enumerate(VALUES):
+		frame = unpack_surface(sweep.frames[index], value)
+		assert len(triangles_array(frame)) == len(triangles_array(crop.extract(value, lower)))
+
+
+def test_new_box_cancels_the_old_sweep(cine):
+	sweep = cine(jobs=1)
+	sweep.prepare((0, 0, 0))
+	first = sweep.futures
+	sweep.prepare((16.0, 0, 0))
+	finish(sweep)
+	# the single thread had no time for most of the first sweep
+	assert sum(future.cancelled() for future in first) >= len(VALUES) - 1
+	assert len(sweep.frames) == len(VALUES)
+	for index, packed in sweep.frames.items():
+		points = points_array(unpack_surface(packed, VALUES[index]))
+		if len(points):
+			assert points[:, 0].min() >= 16.0 - 1e-2
+
+
+def test_dragging_holds_the_sweep(cine):
+	sweep = cine(jobs=1)
+	sweep.prepare((0, 0, 0))
+	sweep.hold((0, 0, 0))
+	assert sweep.futures
+	sweep.hold((5.0, 0, 0))
+	assert sweep.futures == [] and sweep.lower is None
+	sweep.hold((6.0, 0, 0))
+	sweep.prepare((6.0, 0, 0))
+	finish(sweep)
+	assert len(sweep.frames) == len(VALUES)
+
+
+class CountingPainter(object):
+	def __init__(self):
+		self.painted = 0
+
+	def view_key(self):
+		return ()
+
+	def paint(self, surface):
+		self.painted += 1
+		return (1, 1), b"\0\0\0"
+
+
+def test_pictures_per_tick_are_capped(cine):
+	painter = CountingPainter()
+	sweep = cine(painter=painter)
+	sweep.prepare((0, 0, 0))
+	for future in list(sweep.futures):
+		future.result(timeout=60)
+	sweep.collect()
+	assert painter.painted == PAINTS_PER_TICK
+	while len(sweep.frames) < len(VALUES):
+		sweep.collect()
+	assert painter.painted == len(VALUES)
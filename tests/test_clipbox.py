@@ -0,0 +1,30 @@
+"""Cropped contours against clipping the whole isosurface."""
+
+import pytest
+
+from isotools.clipbox import BoxClipper, CroppedContour, clip_extent
+from isotools.mesh import triangles_array
+
+
+@pytest.fixture
+def shifted_sphere(sphere):
+	"""Sphere volume whose extent starts at 10, with its first point at the world origin."""
+	image = sphere(48)
+	image.SetExtent(10, 57, 10, 57, 10, 57)
+	image.SetOrigin(-10, -10, -10)
+	return image
+
+
+def test_clip_extent_of_shifted_volume(shifted_sphere):
+	assert clip_extent(shifted_sphere, (10, 10, 10)) == (19, 57, 19, 57, 19, 57)
+	assert clip_extent(shifted_sphere, (20, 20, 20)) == (29, 57, 29, 57, 29, 57)
+	assert clip_extent(shifted_sphere, (-5, 0.5, 100)) == (10, 57, 10, 57, 57, 57)
+
+
+def test_crop_of_shifted_volume_matches_clip(shifted_sphere, contour):
+	crop = CroppedContour(shifted_sphere)
+	surface = contour(shifted_sphere, 20)
+	for lower in ((20, 20, 20), (10.5, 3.2, 30.7), (-5, -5, -5)):
+		expected = len(triangles_array(BoxClipper().clip(surface, lower)))
+		assert expected > 0
+		assert len(triangles_array(crop.extract(20, lower))) == expected
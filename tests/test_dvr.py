@@ -0,0 +1,52 @@
+"""2D transfer function classification of the layers for the ray caster."""
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from isotools.dvr import LayerVolume, classify
+from isotools.gradient import gradient_magnitude
+
+RED = (255, 0, 0, 1.0)
+BLUE = (0, 0, 1, 0.5)
+
+
+def test_opacity_fades_with_distance_over_gradient():
+	values = np.array([100, 102, 104, 105, 100, 100, 500], dtype=np.float32)
+	gradient = np.array([2, 2, 2, 2, 0, 50, 2], dtype=np.float32)
+	rgba = classify(values, gradient, [(100, 1, 10, RED)], 2.0)
+	# opaque on the isovalue, half at half the width, clear beyond it or out of the window
+	assert list(rgba[:, 3]) == [255, 128, 0, 0, 0, 0, 0]
+	assert (rgba[:2, :3] == [255, 0, 0]).all()
+
+
+def test_layers_composite():
+	values = np.array([100, 200, 150], dtype=np.float32)
+	gradient = np.full(3, 100, dtype=np.float32)
+	rgba = classify(values, gradient, [(100, 0, 1000, RED), (200, 0, 1000, BLUE)], 1.0)
+	assert list(rgba[0]) == [255, 0, 0, 255]
+	# colors already in [0, 1] are kept
+	assert list(rgba[1]) == [0, 0, 255, 128]
+	# halfway both layers reach it, weighted by their opacities
+	assert list(rgba[2]) == [170, 0, 85, 159]
+
+
+def test_flat_region_shows_only_the_isovalue():
+	rgba = classify(np.array([100, 101], dtype=np.float32), np.zeros(2, dtype=np.float32),
+		[(100, 0, 10, RED)], 1.0)
+	assert list(rgba[:, 3]) == [255, 0]
+
+
+def test_layer_volume_thickness_is_in_voxels(sphere):
+	image = sphere(16, spacing=(2, 2, 2))
+	gradient = gradient_magnitude(image)
+	layers = LayerVolume(image, gradient, [(5, 0, 10, RED)], thickness=1.5, threads=1)
+	rgba = numpy_support.vtk_to_numpy(layers.image.GetPointData().GetScalars())
+	expected = classify(numpy_support.vtk_to_numpy(image.GetPointData().GetScalars()),
+		numpy_support.vtk_to_numpy(gradient.GetPointData().GetScalars()), [(5, 0, 10, RED)], 3.0)
+	assert np.array_equal(rgba, expected)
+	assert rgba[:, 3].max() > 0
+	assert layers.image.GetSpacing() == (2, 2, 2)
+	plane = vtk.vtkPlane()
+	layers.clip([plane, vtk.vtkPlane()])
+	assert layers.mapper.GetClippingPlanes().GetNumberOfItems() == 2
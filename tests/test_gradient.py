@@ -0,0 +1,107 @@
+"""Gradient windows of surfaces coming out of vtkClipPolyData, and the gradient cache."""
+
+import argparse
+import os
+
+import numpy as np
+import pytest
+import vtk
+from vtk.util import numpy_support
+
+from isotools import gradient
+from isotools.gradient import GradientWindow, cached_gradient, cell_gradient, file_key, gradient_window
+from isotools.mesh import points_array
+from isotools.rawvolume import open_volume, write_volume
+from isotools.streaming import slab_sampler_from_args
+
+
+def image_array(data):
+	return numpy_support.vtk_to_numpy(data.GetPointData().GetScalars())
+
+
+def vtk_area(surface):
+	triangulate = vtk.vtkTriangleFilter()
+	triangulate.SetInputData(surface)
+	mass = vtk.vtkMassProperties()
+	mass.SetInputConnection(triangulate.GetOutputPort())
+	mass.Update()
+	return mass.GetSurfaceArea()
+
+
+@pytest.fixture
+def clipped_sphere(sphere, contour):
+	"""Sphere clipped off the grid, with its z coordinate as the probed gradient."""
+	plane = vtk.vtkPlane()
+	plane.SetOrigin(13.3, 0, 0)
+	plane.SetNormal(1, 0, 0)
+	clipper = vtk.vtkClipPolyData()
+	clipper.SetClipFunction(plane)
+	clipper.SetInputData(contour(sphere(32), 10))
+	clipper.Update()
+	surface = vtk.vtkPolyData()
+	surface.ShallowCopy(clipper.GetOutput())
+	gradient = numpy_support.numpy_to_vtk(points_array(surface)[:, 2].copy(), deep=1)
+	gradient.SetName("gradient")
+	surface.GetPointData().SetScalars(gradient)
+	return surface
+
+
+def test_clipped_surface_has_quads(clipped_sphere, triangle_areas):
+	sizes = np.diff(numpy_support.vtk_to_numpy(clipped_sphere.GetPolys().GetOffsetsArray()))
+	assert (sizes == 4).any()
+	# the fans cover the polygons exactly
+	assert np.isclose(triangle_areas(clipped_sphere).sum(), vtk_area(clipped_sphere))
+
+
+def test_gradient_window_of_clipped_surface(clipped_sphere, triangle_areas):
+	def area(surface):
+		return triangle_areas(surface).sum()
+	low = gradient_window(clipped_sphere, -np.inf, 15.5)
+	high = gradient_window(clipped_sphere, 15.5, np.inf)
+	assert np.isclose(area(low) + area(high), area(clipped_sphere))
+	assert np.isclose(area(gradient_window(clipped_sphere, -np.inf, np.inf)), vtk_area(clipped_sphere))
+	assert (cell_gradient(low) <= 15.5).all()
+	assert (cell_gradient(high) >= 15.5).all()
+
+
+def test_sorted_window_matches_mask_window(clipped_sphere, triangle_areas):
+	window = GradientWindow(clipped_sphere)
+	for gmin, gmax in ((8, 12), (0, 31), (20, 40), (15.5, 15.5)):
+		assert np.isclose(triangle_areas(window.select(gmin, gmax)).sum(),
+			triangle_areas(gradient_window(clipped_sphere, gmin, gmax)).sum())
+
+
+@pytest.fixture
+def ct_file(sphere, tmp_path):
+	name = str(tmp_path / "ct.vti")
+	write_volume(sphere(24), name)
+	return name
+
+
+def test_warm_cache_is_read_without_computing(ct_file, tmp_path, monkeypatch):
+	cache = str(tmp_path / "cache")
+	cold = cached_gradient(ct_file, open_volume(ct_file).GetOutput(), cache).GetOutput()
+	monkeypatch.setattr(gradient, "gradient_magnitude", None)
+	warm = cached_gradient(ct_file, None, cache).GetOutput()
+	assert np.array_equal(image_array(warm), image_array(cold))
+
+
+def test_cache_key_follows_the_file(ct_file):
+	key = file_key(ct_file)
+	assert file_key(ct_file) == key
+	os.utime(ct_file, ns=(0, 0))
+	assert file_key(ct_file) != key
+
+
+def test_streaming_reads_the_warm_cache(ct_file, sphere, contour, tmp_path):
+	args = argparse.Namespace(data=ct_file, gradient_cache=str(tmp_path / "cache"), roi=None,
+		stride=1, stream_slab=8)
+	source = open_volume(ct_file, update=False)
+	derived = slab_sampler_from_args(args, None, source)
+	assert derived.derive
+	cached_gradient(ct_file, open_volume(ct_file).GetOutput(), args.gradient_cache)
+	sampler = slab_sampler_from_args(args, None, source)
+	assert not sampler.derive
+	surface = contour(sphere(24), 8)
+	assert np.allclose(image_array(sampler.attach(surface)), image_array(derived.attach(surface)),
+		atol=1e-4)
@@ -0,0 +1,128 @@
+"""Slider handlers throttled while dragging."""
+
+import argparse
+
+import pytest
+
+from isotools import livedrag
+from isotools.livedrag import LiveDrag, add_live_drag_arguments, check_live_drag_arguments
+
+
+class Clock(object):
+	def __init__(self):
+		self.now = 100.0
+
+	def time(self):
+		return self.now
+
+
+class Interactor(object):
+	"""Interactor handing out one-shot timer ids and counting renders."""
+
+	def __init__(self):
+		self.timers = []
+		self.destroyed = []
+		self.renders = 0
+		self.event = None
+
+	def AddObserver(self, event, callback):
+		self.callback = callback
+
+	def CreateOneShotTimer(self, ms):
+		self.timers.append(ms)
+		return len(self.timers)
+
+	def DestroyTimer(self, timer):
+		self.destroyed.append(timer)
+
+	def GetTimerEventId(self):
+		return self.event
+
+	def Render(self):
+		self.renders += 1
+
+	def fire(self, timer):
+		self.event = timer
+		self.callback(self, "TimerEvent")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+	clock = Clock()
+	monkeypatch.setattr(livedrag, "time", clock)
+	return clock
+
+
+@pytest.fixture
+def interactor():
+	return Interactor()
+
+
+@pytest.fixture
+def drag(clock, interactor):
+	drag = LiveDrag(hz=10)
+	drag.attach(interactor)
+	return drag
+
+
+def test_positions_are_throttled(drag, clock, interactor):
+	positions = []
+	slider = {'value': 0}
+
+	def handler(widget, event):
+		positions.append(widget['value'])
+		clock.now += 0.01
+
+	for value in range(1, 6):
+		slider['value'] = value
+		drag.moved(slider, handler)
+		clock.now += 0.02
+	# the first position runs at once, the next ones wait for the timer
+	assert positions == [1]
+	# one timer for the rest of the 100 ms after the first update
+	assert len(interactor.timers) == 1
+	assert abs(interactor.timers[0] - 70) <= 1
+	clock.now += 0.1
+	interactor.fire(2)
+	assert positions == [1]
+	interactor.fire(1)
+	# the timer applies the newest position and renders it
+	assert positions == [1, 5]
+	assert interactor.renders == 1
+	assert (drag.updates, drag.dropped) == (2, 3)
+
+
+def test_slow_updates_stretch_the_interval(drag, clock):
+	def handler(widget, event):
+		clock.now += 0.3
+
+	drag.moved(None, handler)
+	assert drag.next == pytest.approx(100.6)
+
+
+def test_release_drops_the_pending_position(drag, interactor, capsys):
+	positions = []
+	drag.moved(1, lambda widget, event: positions.append(widget))
+	drag.moved(2, lambda widget, event: positions.append(widget))
+	drag.released(None, "EndInteractionEvent")
+	assert positions == [1]
+	assert interactor.destroyed == [1]
+	assert "1 updates" in capsys.readouterr().out
+	assert (drag.updates, drag.dropped, drag.timer) == (0, 0, None)
+
+
+def drag_args(options):
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--async-updates', action='store_true')
+	parser.add_argument('--progressive', action='store_true')
+	add_live_drag_arguments(parser)
+	args = parser.parse_args(options)
+	check_live_drag_arguments(parser, args)
+	return args
+
+
+def test_live_drag_needs_updates_off_the_ui_thread():
+	assert drag_args(["--live-drag", "--async-updates"]).live_drag == livedrag.DEFAULT_LIVE_HZ
+	assert drag_args(["--live-drag", "4", "--progressive"]).live_drag == 4
+	with pytest.raises(SystemExit):
+		drag_args(["--live-drag"])
@@ -0,0 +1,69 @@
+"""Vertex clustered levels of detail of the surface actors."""
+
+import time
+
+import numpy as np
+import pytest
+import vtk
+from vtk.util import numpy_support
+
+from isotools.lod import LODSurfaces, cluster_surface, lod_actor
+from isotools.mesh import points_array, triangles_array
+
+
+@pytest.fixture
+def ball(sphere, contour):
+	normals = vtk.vtkPolyDataNormals()
+	normals.SetInputData(contour(sphere(64), 25))
+	normals.Update()
+	return normals.GetOutput()
+
+
+@pytest.mark.parametrize("fraction", [0.5, 0.1, 0.01])
+def test_clustering_keeps_about_the_fraction(ball, fraction):
+	level = cluster_surface(ball, fraction)
+	triangles = triangles_array(level)
+	ratio = len(triangles) / float(len(triangles_array(ball)))
+	assert 0.5 < ratio / fraction < 2
+	assert (triangles[:, 0] != triangles[:, 1]).all() and (triangles[:, 1] != triangles[:, 2]).all()
+	# the cluster means stay close to the sphere and its normals stay unit vectors
+	radius = np.linalg.norm(points_array(level) - 31.5, axis=1)
+	assert np.abs(radius - 25).max() < 25 * np.sqrt(fraction)
+	normals = numpy_support.vtk_to_numpy(level.GetPointData().GetNormals())
+	assert np.allclose(np.linalg.norm(normals, axis=1), 1, atol=1e-5)
+
+
+def test_whole_surface_is_kept(ball):
+	assert cluster_surface(ball, 1) is ball
+	empty = vtk.vtkPolyData()
+	assert cluster_surface(empty, 0.1) is empty
+
+
+def test_levels_follow_new_surfaces(ball, sphere, contour):
+	lods = LODSurfaces((0.5, 0.1), min_triangles=1000)
+	mapper = vtk.vtkPolyDataMapper()
+	actor = lod_actor(lods, mapper)
+	assert actor.IsA("vtkLODActor")
+	levels = lods.mappers[0][1]
+	mapper.SetInputData(ball)
+	lods.sync()
+	# the full surface stands in until the worker is done
+	assert all(level.GetInput() is ball for level in levels)
+	deadline = time.time() + 10
+	while lods.worker.busy() or lods.worker.result is None:
+		assert time.time() < deadline
+		time.sleep(0.01)
+	lods.worker.poll()
+	counts = [level.GetInput().GetNumberOfPolys() for level in levels]
+	assert ball.GetNumberOfPolys() > counts[0] > counts[1]
+
+	# small surfaces are drawn whole at every level
+	small = contour(sphere(16), 3)
+	mapper.SetInputData(small)
+	lods.sync()
+	assert not lods.worker.busy()
+	assert all(level.GetInput() is small for level in levels)
+
+
+def test_plain_actor_without_lods():
+	assert not lod_actor(None, vtk.vtkPolyDataMapper()).IsA("vtkLODActor")
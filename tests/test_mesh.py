@@ -0,0 +1,26 @@
+"""Layers split out of one multi-valued contour."""
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from isotools.mesh import points_array, split_by_value, triangles_array
+
+
+def test_split_matches_separate_contours(sphere, contour, triangle_areas):
+	image = sphere(32)
+	surface = contour(image, 5, 9, 13)
+	values = numpy_support.vtk_to_numpy(surface.GetPointData().GetScalars())
+	layers = split_by_value(surface, values, [13, 5, 9, 5])
+	for layer, isovalue in zip(layers, [13, 5, 9, 5]):
+		alone = contour(image, isovalue)
+		assert len(triangles_array(layer)) == len(triangles_array(alone))
+		assert np.isclose(triangle_areas(layer).sum(), triangle_areas(alone).sum())
+		assert np.allclose(np.sqrt(((points_array(layer) - 15.5) ** 2).sum(axis=1)), isovalue, atol=0.2)
+	# repeated isovalues share their layer
+	assert layers[1] is layers[3]
+
+
+def test_split_of_empty_surface():
+	layers = split_by_value(vtk.vtkPolyData(), np.zeros(0), [1, 2])
+	assert [layer.GetNumberOfCells() for layer in layers] == [0, 0]
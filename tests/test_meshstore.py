@@ -0,0 +1,41 @@
+"""Surfaces kept on disk between sessions."""
+
+import argparse
+
+from isotools.mesh import points_array, triangles_array
+from isotools.meshstore import add_mesh_store_arguments, store_from_args
+from isotools.rawvolume import add_volume_arguments, write_volume
+
+
+def store_args(options):
+	parser = argparse.ArgumentParser()
+	parser.add_argument('data')
+	add_volume_arguments(parser)
+	add_mesh_store_arguments(parser)
+	return parser.parse_args(options)
+
+
+def test_store_is_opt_in():
+	assert store_from_args(store_args(["ct.vti"])) is None
+
+
+def test_fetch_extracts_once(tmp_path, sphere, contour):
+	image = sphere(24)
+	data = str(tmp_path / "ct.vti")
+	write_volume(image, data)
+	args = store_args([data, "--mesh-cache", str(tmp_path / "meshes")])
+	calls = []
+
+	def extract(isovalues):
+		calls.append(isovalues)
+		return contour(image, *isovalues)
+
+	first = store_from_args(args, {'normals': False}).fetch([6.0, 9.0], extract)
+	second = store_from_args(args, {'normals': False}).fetch([6.0, 9.0], extract)
+	assert len(calls) == 1
+	assert (points_array(first) == points_array(second)).all()
+	assert (triangles_array(first) == triangles_array(second)).all()
+	# other settings or isovalues never get the stored surface
+	store_from_args(args, {'normals': True}).fetch([6.0, 9.0], extract)
+	store_from_args(args, {'normals': False}).fetch([6.0], extract)
+	assert len(calls) == 3
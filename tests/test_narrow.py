@@ -0,0 +1,61 @@
+"""16 bit storage of the CT and quantized gradient magnitude volumes."""
+
+import numpy as np
+import pytest
+import vtk
+from vtk.util import numpy_support
+
+from isotools.gradient import GradientSampler, gradient_magnitude
+from isotools.narrow import (narrow_image, narrow_volume, quantize_image, restore_values,
+	scalar_range, scalar_scale)
+
+
+def values_of(image):
+	return numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+
+
+def producer(image):
+	source = vtk.vtkPassThrough()
+	source.SetInputData(image)
+	source.Update()
+	return source
+
+
+@pytest.mark.parametrize("field, dtype", [
+	(lambda x, y, z: 40 * x + y - z - 1000, np.int16),
+	(lambda x, y, z: 4000 * x + y + z, np.uint16)])
+def test_whole_numbers_are_narrowed_exactly(phantom, field, dtype):
+	image = phantom(field, 16)
+	narrowed = narrow_image(image)
+	assert values_of(narrowed).dtype == dtype
+	assert np.array_equal(values_of(narrowed), values_of(image))
+	assert scalar_scale(narrowed) == (1.0, 0.0)
+
+
+def test_fractions_and_wide_ranges_are_kept(phantom):
+	assert narrow_image(phantom(lambda x, y, z: x + 0.5, 8)) is None
+	assert narrow_image(phantom(lambda x, y, z: x * 20000 - 70000, 8)) is None
+	source = producer(phantom(lambda x, y, z: x + 0.5, 8))
+	assert narrow_volume(source) is source
+
+
+def test_quantized_steps_keep_their_units(phantom):
+	image = phantom(lambda x, y, z: np.sqrt(x * x + y * y + z * z) * 1234.567, 16)
+	quantized = quantize_image(image)
+	steps = values_of(quantized)
+	scale = scalar_scale(quantized)
+	assert steps.dtype == np.uint16
+	assert np.abs(restore_values(steps, scale) - values_of(image)).max() <= scale[0] / 2 * 1.001
+	assert np.allclose(scalar_range(quantized), image.GetScalarRange(), rtol=1e-6)
+
+
+def test_sampler_restores_quantized_gradient(sphere, contour):
+	image = sphere(24)
+	gradient = gradient_magnitude(image)
+	# spread the values so that they are not whole numbers over a wide range
+	values_of(gradient)[:] = values_of(gradient) * 50000.3
+	quantized = narrow_volume(producer(gradient), quantize=True).GetOutput()
+	surface = contour(image, 7)
+	exact = values_of(GradientSampler(gradient).attach(surface))
+	restored = values_of(GradientSampler(quantized).attach(surface))
+	assert np.abs(restored - exact).max() <= scalar_scale(quantized)[0]
@@ -0,0 +1,69 @@
+"""Regions of interest of memory-mapped volumes."""
+
+import argparse
+
+import numpy as np
+import pytest
+
+from isotools.rawvolume import add_volume_arguments, check_volume_arguments, open_volume, write_volume
+from isotools.volume import image_from_array, scalars_array
+
+
+@pytest.fixture
+def volume(tmp_path):
+	array = np.arange(8 * 6 * 4, dtype=np.int16).reshape(8, 6, 4)
+	name = str(tmp_path / "volume.vti")
+	write_volume(image_from_array(array, spacing=(0.5, 0.5, 2)), name)
+	return name, array
+
+
+def test_roi_is_clamped_to_the_volume(volume):
+	name, array = volume
+	image = open_volume(name, roi=(-3, 2, 1, 100, 5, 7)).GetOutput()
+	assert image.GetExtent() == (0, 2, 0, 4, 0, 2)
+	assert image.GetOrigin() == (0, 0.5, 10)
+	assert (scalars_array(image) == array[5:8, 1:6, 0:3]).all()
+
+
+@pytest.mark.parametrize("roi", [None, (1, 3, 1, 5, 3, 7), (0, 0, 0, 4, 1, 6)])
+@pytest.mark.parametrize("stride", [2, 3])
+def test_stride_keeps_the_last_multiple(volume, roi, stride):
+	name, array = volume
+	whole = (0, 3, 0, 5, 0, 7) if roi is None else roi
+	# indices in the file of the points kept along x, y and z
+	kept = [np.arange(whole[2 * i] + (-whole[2 * i]) % stride, whole[2 * i + 1] + 1, stride)
+		for i in range(3)]
+	image = open_volume(name, roi=roi, stride=stride).GetOutput()
+	assert image.GetExtent() == (0, len(kept[0]) - 1, 0, len(kept[1]) - 1, 0, len(kept[2]) - 1)
+	assert np.allclose(image.GetOrigin(), (0.5 * kept[0][0], 0.5 * kept[1][0], 2 * kept[2][0]))
+	assert np.allclose(image.GetSpacing(), (0.5 * stride, 0.5 * stride, 2 * stride))
+	values = scalars_array(image)
+	assert (values == array[np.ix_(kept[2], kept[1], kept[0])]).all()
+	# the last plane is the last multiple of stride, not the one before it
+	assert (values[-1] == array[kept[2][-1]][np.ix_(kept[1], kept[0])]).all()
+	bounds = image.GetBounds()
+	assert np.isclose(bounds[5], 2 * kept[2][-1]) and np.isclose(bounds[3], 0.5 * kept[1][-1])
+
+
+def test_stride_without_points(volume):
+	name, array = volume
+	with pytest.raises(ValueError):
+		open_volume(name, roi=(1, 2, 0, 5, 0, 7), stride=3)
+
+
+def test_roi_outside_the_volume(volume):
+	name, array = volume
+	with pytest.raises(ValueError):
+		open_volume(name, roi=(4, 9, 0, 5, 0, 7))
+
+
+@pytest.mark.parametrize("options", [
+	["--roi", "3", "1", "0", "5", "0", "7"],
+	["--roi", "0", "3", "0", "5", "7", "6"],
+	["--stride", "0"],
+])
+def test_rejected_arguments(options):
+	parser = argparse.ArgumentParser()
+	add_volume_arguments(parser)
+	with pytest.raises(SystemExit):
+		check_volume_arguments(parser, parser.parse_args(options))
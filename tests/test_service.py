@@ -0,0 +1,92 @@
+"""Messages and addresses of the volume daemon."""
+
+import io
+import os
+import socket
+import stat
+import threading
+
+import pytest
+
+from isotools.rawvolume import write_volume
+from isotools.service import (RemoteVolume, ServiceError, VolumeService, listen, parse_address,
+	receive_message, send_message, token_path)
+
+
+def test_loopback_addresses():
+	assert parse_address("localhost:7000") == (socket.AF_INET, ("localhost", 7000))
+	assert parse_address(":7000") == (socket.AF_INET, ("127.0.0.1", 7000))
+	assert parse_address("127.0.0.2:7000")[0] == socket.AF_INET
+	assert parse_address("/tmp/volumes.sock") == (socket.AF_UNIX, "/tmp/volumes.sock")
+
+
+@pytest.mark.parametrize("address", ["0.0.0.0:7000", "192.168.1.10:7000", "8.8.8.8:53"])
+def test_other_hosts_are_rejected(address):
+	with pytest.raises(ValueError):
+		parse_address(address)
+
+
+def test_round_trip():
+	f = io.BytesIO()
+	send_message(f, {'op': 'probe'}, b"points")
+	f.seek(0)
+	assert receive_message(f) == ({'op': 'probe'}, b"points")
+	assert receive_message(f) == (None, None)
+
+
+@pytest.mark.parametrize("message", [
+	b'{"op": "probe", "bytes": 1000000000000}\n',
+	b'{"op": "probe", "bytes": -1}\n',
+	b'{"op": "probe", "bytes": 10}\nshort',
+	b'[1, 2]\n',
+	b'{' + b' ' * (1 << 17) + b'}\n',
+])
+def test_bad_messages(message):
+	with pytest.raises(ServiceError):
+		receive_message(io.BytesIO(message), max_bytes=1 << 20)
+
+
+@pytest.fixture
+def daemon(tmp_path):
+	address = str(tmp_path / "volumes.sock")
+	server = listen(VolumeService(str(tmp_path / "gradients")), address)
+	thread = threading.Thread(target=server.serve_forever)
+	thread.start()
+	yield address
+	server.shutdown()
+	server.server_close()
+	thread.join()
+
+
+@pytest.fixture
+def spec(tmp_path, sphere):
+	data = str(tmp_path / "ct.vti")
+	write_volume(sphere(16), data)
+	return {'data': data, 'gradmag': None, 'roi': None, 'stride': 1, 'narrow': False}
+
+
+def test_socket_and_token_are_private(daemon):
+	assert stat.S_IMODE(os.stat(daemon).st_mode) == 0o600
+	assert stat.S_IMODE(os.stat(token_path(daemon)).st_mode) == 0o600
+
+
+def test_requests_need_the_token(daemon, spec):
+	assert RemoteVolume(daemon, spec).info()['bounds'] == [0, 15, 0, 15, 0, 15]
+	client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	client.connect(daemon)
+	with client, client.makefile("rwb") as f:
+		send_message(f, {'op': 'info', 'volume': spec, 'token': "0" * 32})
+		reply, payload = receive_message(f)
+		assert 'error' in reply and 'bounds' not in reply
+		# the connection is dropped after a wrong token
+		assert receive_message(f) == (None, None)
+
+
+def test_failed_load_is_retried(tmp_path, spec):
+	service = VolumeService(str(tmp_path / "gradients"))
+	missing = dict(spec, data=str(tmp_path / "missing.vti"))
+	for attempt in range(2):
+		with pytest.raises(Exception):
+			service.volume("missing", missing)
+		assert service.loading == {}
+	assert service.volume("ct", spec).bounds == [0, 15, 0, 15, 0, 15]
@@ -0,0 +1,22 @@
+"""Span-space contours against contouring the whole volume."""
+
+import numpy as np
+import pytest
+
+from isotools.mesh import points_array
+from isotools.spanspace import BrickContour
+
+
+@pytest.mark.parametrize("brick_size", [4, 8, 16])
+@pytest.mark.parametrize("isovalues", [[0.3], [-0.5, 0.8]])
+def test_bricks_are_welded(phantom, contour, brick_size, isovalues):
+	image = phantom(lambda x, y, z: np.sin(x / 5.0) * np.cos(y / 7.0) + np.sin(z / 6.0),
+		(44, 36, 40), origin=(-3, 2, 5), spacing=(0.5, 1, 2))
+	expected = contour(image, *isovalues)
+
+	surface = BrickContour(image, brick_size).extract(isovalues)
+	points = points_array(surface)
+	assert len(np.unique(points, axis=0)) == len(points)
+	assert surface.GetNumberOfPoints() == expected.GetNumberOfPoints()
+	assert surface.GetNumberOfCells() == expected.GetNumberOfCells()
+	assert surface.GetPointData().GetNormals().GetNumberOfTuples() == len(points)
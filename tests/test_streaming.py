@@ -0,0 +1,55 @@
+"""Slab by slab contours and gradients against those of the whole volume."""
+
+import numpy as np
+import pytest
+from vtk.util import numpy_support
+
+from isotools.gradient import GradientSampler, gradient_magnitude
+from isotools.mesh import points_array, triangles_array
+from isotools.rawvolume import open_volume, write_volume
+from isotools.streaming import SlabContour, SlabSampler
+
+
+@pytest.fixture
+def blobs(phantom, tmp_path):
+	"""Volume of two overlapping blobs, written so that it can be read in slabs."""
+	def field(x, y, z):
+		return (np.exp(-((x - 10) ** 2 + (y - 12) ** 2 + (z - 9) ** 2) / 40.0)
+			+ np.exp(-((x - 18) ** 2 + (y - 16) ** 2 + (z - 20) ** 2) / 60.0)) * 1000
+	image = phantom(field, (28, 30, 31), origin=(-3, 2, 5), spacing=(0.5, 0.75, 1.25))
+	name = str(tmp_path / "blobs.vti")
+	write_volume(image, name)
+	return image, name
+
+
+def sorted_points(surface):
+	points = points_array(surface)
+	return points[np.lexsort(points.T[::-1])]
+
+
+@pytest.mark.parametrize("slab", [1, 4, 7, 64])
+def test_slab_contour_matches_whole_contour(blobs, contour, triangle_areas, slab):
+	image, name = blobs
+	whole = contour(image, 300, 600)
+	streamed = SlabContour(open_volume(name, update=False), slab).extract([300, 600])
+	assert streamed.GetNumberOfPoints() == whole.GetNumberOfPoints()
+	assert len(triangles_array(streamed)) == len(triangles_array(whole))
+	assert np.isclose(triangle_areas(streamed).sum(), triangle_areas(whole).sum())
+	assert np.allclose(sorted_points(streamed), sorted_points(whole), atol=1e-5)
+
+
+@pytest.mark.parametrize("derive", [False, True])
+def test_slab_sampler_matches_whole_sampler(blobs, contour, tmp_path, derive):
+	image, name = blobs
+	gradient = gradient_magnitude(image)
+	surface = contour(image, 450)
+	expected = GradientSampler(gradient).attach(surface)
+	if derive:
+		source = open_volume(name, update=False)
+	else:
+		gradient_name = str(tmp_path / "gm.vti")
+		write_volume(gradient, gradient_name)
+		source = open_volume(gradient_name, update=False)
+	sampled = SlabSampler(source, 5, derive).attach(surface)
+	assert np.allclose(numpy_support.vtk_to_numpy(sampled.GetPointData().GetScalars()),
+		numpy_support.vtk_to_numpy(expected.GetPointData().GetScalars()), rtol=1e-4, atol=1e-3)
@@ -0,0 +1,60 @@
+"""SweepClipper moving the planes back and forth over one surface."""
+
+import numpy as np
+import pytest
+import vtk
+
+from isotools.clipbox import SweepClipper
+
+
+@pytest.fixture
+def torus(phantom, contour):
+	def ring(x, y, z):
+		return np.sqrt((np.sqrt((x - 19.5) ** 2 + (y - 19.5) ** 2) - 12) ** 2 + (z - 19.5) ** 2)
+	return contour(phantom(ring, 40), 5)
+
+
+def clip_chain(surface, lower):
+	"""The whole surface through the three vtkClipPolyData the viewers used to chain."""
+	output = surface
+	for axis in range(3):
+		plane = vtk.vtkPlane()
+		origin = [0, 0, 0]
+		origin[axis] = lower[axis]
+		normal = [0, 0, 0]
+		normal[axis] = 1
+		plane.SetOrigin(origin)
+		plane.SetNormal(normal)
+		clipper = vtk.vtkClipPolyData()
+		clipper.SetClipFunction(plane)
+		clipper.SetInputData(output)
+		clipper.Update()
+		output = clipper.GetOutput()
+	return output
+
+
+def test_sweep_matches_clip_chain(torus, triangle_areas):
+	surface = torus
+	sweep = SweepClipper()
+	rng = np.random.default_rng(7)
+	lower = [-np.inf] * 3
+	moves = [(0, 10.3), (1, 25.0), (0, 3.7), (2, 19.5), (0, -np.inf), (1, 60.0), (1, 7.25),
+		(2, -5.0), (0, 33.1), (0, 11.0), (2, np.nextafter(19.5, 0)), (1, -np.inf)]
+	moves += [(axis, float(rng.uniform(-5, 45))) for axis in rng.integers(0, 3, 20)]
+	for axis, position in moves:
+		lower[axis] = position
+		ends = [v if np.isfinite(v) else -1e9 for v in lower]
+		expected = triangle_areas(clip_chain(surface, ends))
+		areas = triangle_areas(sweep.clip(surface, lower))
+		assert np.isclose(areas.sum(), expected.sum(), rtol=1e-6, atol=1e-9)
+		# only zero area slivers may differ between the two
+		assert (areas > 1e-9).sum() == (expected > 1e-9).sum()
+
+
+def test_planes_past_the_bounds(torus):
+	surface = torus
+	sweep = SweepClipper()
+	assert sweep.clip(surface, (-np.inf, -np.inf, -np.inf)) is surface
+	assert sweep.clip(surface, (-100, 0, -100)) is surface
+	assert sweep.clip(surface, (100, 0, 0)).GetNumberOfCells() == 0
+	assert sweep.clip(surface, (0, -np.inf, 0)) is surface
@@ -0,0 +1,56 @@
+"""Timeline of filter executions and slider interactions."""
+
+import json
+
+import vtk
+
+from isotools.trace import PipelineTrace
+
+
+def test_filters_renders_and_interactions(sphere, tmp_path):
+	image = sphere(16)
+	contour = vtk.vtkContourFilter()
+	contour.SetInputData(image)
+	trace = PipelineTrace(str(tmp_path / "trace.json"))
+	trace.watch_all({'contour': contour, 'missing': None})
+	for isovalue in (3, 5):
+		contour.SetValue(0, isovalue)
+		contour.Update()
+	# a slider release lasts until the next frame is drawn
+	trace.open_interaction("slider_x")
+	trace.started("render")
+	trace.rendered(None, "EndEvent")
+	trace.finish()
+
+	assert [(r['cat'], r['name']) for r in trace.records] == [("filter", "contour"),
+		("filter", "contour"), ("render", "render"), ("interaction", "slider_x")]
+	first = trace.records[0]['args']
+	assert first['input_cells'] == image.GetNumberOfCells()
+	assert first['output_cells'] > 0 and first['rss_mib'] > 0
+	interaction, render = trace.records[3], trace.records[2]
+	assert interaction['start'] <= render['start']
+	assert interaction['start'] + interaction['dur'] >= render['start'] + render['dur']
+
+	with open(str(tmp_path / "trace.json")) as f:
+		events = json.load(f)['traceEvents']
+	spans = [event for event in events if event['ph'] == 'X']
+	assert len(spans) == 4
+	assert spans[0]['ts'] == trace.records[0]['start'] * 1e6
+	assert [event['args']['name'] for event in events if event['ph'] == 'M'] == ["MainThread"]
+
+
+def test_summary_adds_up_the_stages():
+	trace = PipelineTrace()
+	trace.records = [{'name': 'probe', 'cat': 'filter', 'start': 0, 'dur': 0.5, 'tid': 'a', 'args': {}},
+		{'name': 'contour', 'cat': 'filter', 'start': 0, 'dur': 2.0, 'tid': 'a', 'args': {}},
+		{'name': 'probe', 'cat': 'filter', 'start': 1, 'dur': 1.0, 'tid': 'b', 'args': {}}]
+	lines = trace.summary().splitlines()
+	assert lines[1].split() == ["filter", "contour", "1", "2.000", "2000.00", "2000.00"]
+	assert lines[2].split() == ["filter", "probe", "2", "1.500", "750.00", "1000.00"]
+
+
+def test_unfinished_stage_is_not_recorded():
+	trace = PipelineTrace()
+	trace.rendered(None, "EndEvent")
+	trace.close_interaction()
+	assert trace.records == []
@@ -0,0 +1,88 @@
+"""Depth peel count stepped along the ladder to keep the frame budget."""
+
+import argparse
+
+import pytest
+import vtk
+
+from isotools.lod import add_lod_arguments
+from isotools.transparency import (TransparencyBudget, add_peeling_arguments, check_peeling_arguments,
+	peel_fps_from_args, peeling_from_args)
+
+
+class Window(object):
+	"""Render window asking for rate frames per second."""
+
+	def __init__(self, rate):
+		self.rate = rate
+
+	def GetDesiredUpdateRate(self):
+		return self.rate
+
+
+class Timer(object):
+	elapsed = 0
+
+	def StartTimer(self):
+		pass
+
+	def StopTimer(self):
+		pass
+
+	def GetElapsedTime(self):
+		return self.elapsed
+
+
+@pytest.fixture
+def budget():
+	budget = TransparencyBudget(vtk.vtkRenderer(), fps=10, max_peels=20)
+	budget.still_rate = 0.0001
+	budget.timer = Timer()
+	return budget
+
+
+def frame(budget, rate, elapsed):
+	budget.timer.elapsed = elapsed
+	budget.started(Window(rate), "StartEvent")
+	peels = budget.renderer.GetMaximumNumberOfPeels() if budget.renderer.GetUseDepthPeeling() else 0
+	budget.finished(Window(rate), "EndEvent")
+	return peels
+
+
+def test_peels_follow_the_frame_time(budget):
+	assert budget.ladder == [0, 2, 4, 8, 16, 20]
+	# fast frames climb the ladder one step at a time
+	assert [frame(budget, 10, 0.01) for i in range(7)] == [0, 2, 4, 8, 16, 20, 20]
+	# slow ones step back down, frames within the budget keep the count
+	assert [frame(budget, 10, 0.2) for i in range(3)] == [20, 16, 8]
+	assert [frame(budget, 10, 0.07) for i in range(2)] == [4, 4]
+	assert budget.label.GetInput() == "4 peels (moving)"
+
+
+def test_still_frames_use_every_peel(budget):
+	frame(budget, 10, 0.01)
+	assert frame(budget, 0.0001, 1) == 20
+	assert budget.step == 1
+	assert budget.label.GetInput() == "20 peels"
+
+
+def peeling_args(options):
+	parser = argparse.ArgumentParser()
+	add_lod_arguments(parser)
+	add_peeling_arguments(parser)
+	args = parser.parse_args(options)
+	check_peeling_arguments(parser, args)
+	return args
+
+
+def test_peel_fps_is_shared_with_lod():
+	assert peel_fps_from_args(peeling_args(["--adaptive-peels", "--lod", "--lod-fps", "24"])) == 24
+	assert peel_fps_from_args(peeling_args(["--adaptive-peels", "--peel-fps", "5"])) == 5
+	with pytest.raises(SystemExit):
+		peeling_args(["--adaptive-peels", "--lod", "--lod-fps", "24", "--peel-fps", "5"])
+
+
+def test_fixed_peeling():
+	renderer = vtk.vtkRenderer()
+	assert peeling_from_args(peeling_args(["--max-peels", "0"]), renderer) is None
+	assert not renderer.GetUseDepthPeeling()
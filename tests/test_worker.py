@@ -0,0 +1,98 @@
+"""PipelineWorker keeping the newest request and aborting the superseded one."""
+
+import threading
+import time
+
+import pytest
+import vtk
+
+from isotools.worker import Aborted, PipelineWorker, check_abort
+
+
+class BlockingCompute(object):
+	"""compute() of a worker that waits for release() on its first request."""
+
+	def __init__(self, algorithm):
+		self.algorithm = algorithm
+		self.started = threading.Event()
+		self.released = threading.Event()
+		self.calls = []
+
+	def __call__(self, params):
+		self.calls.append(params)
+		if len(self.calls) == 1:
+			self.started.set()
+			self.released.wait(5)
+			check_abort(self.algorithm)
+		return params
+
+	def release(self):
+		self.released.set()
+
+
+def wait_idle(worker):
+	deadline = time.time() + 5
+	while worker.busy():
+		assert time.time() < deadline
+		time.sleep(0.01)
+
+
+@pytest.fixture
+def compute():
+	compute = BlockingCompute(vtk.vtkContourFilter())
+	yield compute
+	compute.release()
+
+
+@pytest.fixture
+def applied():
+	return []
+
+
+@pytest.fixture
+def worker(compute, applied):
+	return PipelineWorker(compute, applied.append, [compute.algorithm, None])
+
+
+def test_newest_request_wins(worker, compute, applied):
+	worker.submit(1)
+	assert compute.started.wait(5)
+	for params in (2, 3, 4):
+		worker.submit(params)
+	assert compute.algorithm.GetAbortExecute()
+	compute.release()
+	wait_idle(worker)
+	worker.poll()
+	# 1 was aborted, 2 and 3 were replaced before they ran
+	assert compute.calls == [1, 4]
+	assert applied == [4]
+	assert worker.dropped == 3
+	assert not compute.algorithm.GetAbortExecute()
+
+
+def test_cancel_drops_the_running_request(worker, compute, applied):
+	worker.submit(1)
+	assert compute.started.wait(5)
+	worker.cancel()
+	compute.release()
+	wait_idle(worker)
+	worker.poll()
+	assert compute.calls == [1]
+	assert applied == []
+
+
+def test_failed_compute_is_dropped(capsys):
+	def compute(params):
+		if params == "bad":
+			raise ValueError(params)
+		if params == "aborted":
+			raise Aborted()
+		return params
+	applied = []
+	worker = PipelineWorker(compute, applied.append)
+	for params in ("bad", "aborted", "good"):
+		worker.submit(params)
+		wait_idle(worker)
+		worker.poll()
+	assert applied == ["good"]
+	assert "ValueError" in capsys.readouterr().err